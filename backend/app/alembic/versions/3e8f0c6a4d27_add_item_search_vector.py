@@ -0,0 +1,52 @@
+"""Add item search_vector with a GIN index
+
+Revision ID: 3e8f0c6a4d27
+Revises: 7c3d5b1e2a90
+Create Date: 2026-10-18 19:12:40.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '3e8f0c6a4d27'
+down_revision = '7c3d5b1e2a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Adding a stored generated column rewrites the table under an exclusive
+    # lock, on a large item table run it in a maintenance window
+    op.add_column(
+        'item',
+        sa.Column(
+            'search_vector',
+            postgresql.TSVECTOR(),
+            sa.Computed(
+                "setweight(to_tsvector('english', title), 'A') || "
+                "setweight(to_tsvector('english', coalesce(description, '')), 'B')",
+                persisted=True,
+            ),
+        ),
+    )
+    # The index is built concurrently, see 7c3d5b1e2a90
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_item_search_vector',
+            'item',
+            ['search_vector'],
+            postgresql_using='gin',
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_item_search_vector', table_name='item', postgresql_concurrently=True
+        )
+    op.drop_column('item', 'search_vector')
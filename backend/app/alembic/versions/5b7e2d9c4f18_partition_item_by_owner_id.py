@@ -0,0 +1,169 @@
+"""Hash partition item by owner_id
+
+Revision ID: 5b7e2d9c4f18
+Revises: 3e8f0c6a4d27
+Create Date: 2026-10-18 23:04:51.730862
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+from sqlalchemy.dialects import postgresql
+
+from app.core.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e2d9c4f18'
+down_revision = '3e8f0c6a4d27'
+branch_labels = None
+depends_on = None
+
+# Rows copied per transaction
+BATCH_SIZE = 10000
+
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', title), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
+# Keeps the new table up to date with the changes made to item while the
+# existing rows are copied. An update deletes and inserts again, in case the
+# owner, and so the partition, changed.
+COPY_CHANGES = """
+CREATE FUNCTION item_copy_changes() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM item_partitioned WHERE id = OLD.id AND owner_id = OLD.owner_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO item_partitioned (id, title, description, owner_id)
+        VALUES (NEW.id, NEW.title, NEW.description, NEW.owner_id);
+    END IF;
+    RETURN NULL;
+END $$;
+
+CREATE TRIGGER item_copy_changes AFTER INSERT OR UPDATE OR DELETE ON item
+FOR EACH ROW EXECUTE FUNCTION item_copy_changes();
+"""
+
+# The next batch of rows in id order, returning the last id copied. FOR SHARE
+# makes a concurrent update or delete of a row wait until its copy is
+# committed, so that the trigger then applies it to the copy, and the copy of
+# a row the trigger already inserted is skipped.
+COPY_BATCH = """
+WITH batch AS (
+    SELECT id, title, description, owner_id FROM item
+    WHERE id > CAST(:after AS uuid)
+    ORDER BY id
+    LIMIT :batch_size
+    FOR SHARE
+), copied AS (
+    INSERT INTO item_partitioned (id, title, description, owner_id)
+    SELECT id, title, description, owner_id FROM batch
+    ON CONFLICT DO NOTHING
+)
+SELECT id FROM batch ORDER BY id DESC LIMIT 1
+"""
+
+
+def _create_item_table(name, primary_key, **kwargs):
+    op.create_table(
+        name,
+        sa.Column('description', sqlmodel.sql.sqltypes.AutoString(length=255), nullable=True),
+        sa.Column('id', sa.Uuid(), nullable=False),
+        sa.Column('title', sqlmodel.sql.sqltypes.AutoString(length=255), nullable=False),
+        sa.Column('owner_id', sa.Uuid(), nullable=False),
+        sa.Column(
+            'search_vector',
+            postgresql.TSVECTOR(),
+            sa.Computed(SEARCH_VECTOR, persisted=True),
+        ),
+        sa.ForeignKeyConstraint(
+            ['owner_id'], ['user.id'], name=f'{name}_owner_id_fkey', ondelete='CASCADE'
+        ),
+        sa.PrimaryKeyConstraint(*primary_key, name=f'{name}_pkey'),
+        **kwargs,
+    )
+    op.create_index(
+        f'ix_{name}_owner_id_id',
+        name,
+        ['owner_id', 'id'],
+        postgresql_include=['title', 'description'],
+    )
+    op.create_index(
+        f'ix_{name}_search_vector', name, ['search_vector'], postgresql_using='gin'
+    )
+
+
+def _set_lock_timeout():
+    # Waiting for a lock on item blocks the queries queued behind, give up
+    # instead and run the migration again later
+    op.execute("SET LOCAL lock_timeout = '10s'")
+
+
+def _lock_item_table():
+    # Before any other statement of the transaction locks item, dropping a
+    # trigger does as well
+    _set_lock_timeout()
+    op.execute('LOCK TABLE item IN ACCESS EXCLUSIVE MODE')
+
+
+def _replace_item_table(name):
+    op.drop_table('item')
+    op.rename_table(name, 'item')
+    op.execute(f'ALTER TABLE item RENAME CONSTRAINT {name}_pkey TO item_pkey')
+    op.execute(
+        f'ALTER TABLE item RENAME CONSTRAINT {name}_owner_id_fkey TO item_owner_id_fkey'
+    )
+    op.execute(f'ALTER INDEX ix_{name}_owner_id_id RENAME TO ix_item_owner_id_id')
+    op.execute(f'ALTER INDEX ix_{name}_search_vector RENAME TO ix_item_search_vector')
+
+
+def upgrade():
+    # Creating the trigger locks item too. Left over when a run gave up
+    # waiting for the lock to swap the tables, dropped to start over.
+    _set_lock_timeout()
+    op.execute('DROP TRIGGER IF EXISTS item_copy_changes ON item')
+    op.execute('DROP FUNCTION IF EXISTS item_copy_changes()')
+    op.execute('DROP TABLE IF EXISTS item_partitioned')
+    # The primary key of a partitioned table has to include the partition key
+    _create_item_table(
+        'item_partitioned',
+        ['id', 'owner_id'],
+        postgresql_partition_by='HASH (owner_id)',
+    )
+    for remainder in range(settings.ITEM_PARTITIONS):
+        op.execute(
+            f'CREATE TABLE item_p{remainder} PARTITION OF item_partitioned '
+            f'FOR VALUES WITH (MODULUS {settings.ITEM_PARTITIONS}, REMAINDER {remainder})'
+        )
+    op.execute(COPY_CHANGES)
+
+    # Copied in batches committed one by one, the app keeps reading and
+    # writing item meanwhile
+    conn = op.get_bind()
+    with op.get_context().autocommit_block():
+        after = '00000000-0000-0000-0000-000000000000'
+        while after is not None:
+            after = conn.execute(
+                sa.text(COPY_BATCH), {'after': after, 'batch_size': BATCH_SIZE}
+            ).scalar()
+
+    # Both tables have the same rows, swap them in one short transaction
+    _lock_item_table()
+    op.execute('DROP TRIGGER item_copy_changes ON item')
+    op.execute('DROP FUNCTION item_copy_changes()')
+    _replace_item_table('item_partitioned')
+
+
+def downgrade():
+    # Copied in one transaction, writes to item have to be stopped meanwhile
+    _create_item_table('item_unpartitioned', ['id'])
+    op.execute(
+        'INSERT INTO item_unpartitioned (id, title, description, owner_id) '
+        'SELECT id, title, description, owner_id FROM item'
+    )
+    # Drops the partitions with it
+    _lock_item_table()
+    _replace_item_table('item_unpartitioned')
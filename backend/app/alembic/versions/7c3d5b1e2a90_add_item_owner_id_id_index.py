@@ -0,0 +1,38 @@
+"""Add item owner_id, id index
+
+Revision ID: 7c3d5b1e2a90
+Revises: f9da23486b36
+Create Date: 2026-10-18 21:02:13.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3d5b1e2a90'
+down_revision = 'f9da23486b36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Built concurrently so that writes to item are not blocked meanwhile,
+    # which can't be done in a transaction. If it fails it leaves an invalid
+    # index behind, drop it before running the migration again.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_item_owner_id_id',
+            'item',
+            ['owner_id', 'id'],
+            postgresql_include=['title', 'description'],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_item_owner_id_id', table_name='item', postgresql_concurrently=True
+        )
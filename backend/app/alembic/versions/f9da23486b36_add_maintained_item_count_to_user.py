@@ -0,0 +1,33 @@
+"""Add maintained item count to user
+
+Revision ID: f9da23486b36
+Revises: 1a31ce608336
+Create Date: 2026-10-18 18:21:44.647229
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = 'f9da23486b36'
+down_revision = '1a31ce608336'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('item_count', sa.Integer(), server_default='0', nullable=False))
+    # Backfill from the current items, from here on the app keeps it up to date
+    op.execute(
+        """
+        UPDATE "user" SET item_count = counts.item_count
+        FROM (SELECT owner_id, count(*) AS item_count FROM item GROUP BY owner_id) AS counts
+        WHERE "user".id = counts.owner_id
+        """
+    )
+
+
+def downgrade():
+    op.drop_column('user', 'item_count')
@@ -1,16 +1,29 @@
-from collections.abc import Generator
+import uuid
+from collections.abc import AsyncGenerator
+from dataclasses import dataclass
 from typing import Annotated
 
 import jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jwt.exceptions import InvalidTokenError
 from pydantic import ValidationError
-from sqlmodel import Session
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import make_transient_to_detached
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.core import security
+from app.core import metrics, security
+from app.core.admission import db_admission
+from app.core.cache import user_cache
 from app.core.config import settings
-from app.core.db import engine
+from app.core.db import async_engine
+from app.core.ratelimit import token_subject
+from app.core.replicas import (
+    READ_YOUR_WRITES_COOKIE,
+    mark_wrote,
+    replicas,
+    wrote_recently,
+)
 from app.models import TokenPayload, User
 
 reusable_oauth2 = OAuth2PasswordBearer(
@@ -18,27 +31,82 @@ reusable_oauth2 = OAuth2PasswordBearer(
 )
 
 
-def get_db() -> Generator[Session, None, None]:
-    with Session(engine) as session:
-        yield session
+def choose_engine(request: Request, subject: str | None) -> AsyncEngine:
+    """
+    The engine a session of the request uses. GET and HEAD requests read from
+    a replica when there's a healthy one, unless their user wrote recently,
+    the others use the primary.
+    """
+    bind = None
+    cookie = request.cookies.get(READ_YOUR_WRITES_COOKIE)
+    if request.method in ("GET", "HEAD") and not (
+        subject and wrote_recently(subject, cookie)
+    ):
+        bind = replicas.choose()
+    metrics.DB_SESSIONS.labels("primary" if bind is None else "replica").inc()
+    return bind or async_engine
+
+
+async def get_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    # The user is only taken from the token here, it's validated later
+    subject = await token_subject(request)
+    engine = choose_engine(request, subject)
+    # Wait for a slot before the pool, routes that don't use the database
+    # like the health check are never queued. Don't expire on commit,
+    # attributes can't be lazy loaded after the handler returns and the
+    # response is serialized
+    async with db_admission.admit():
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            yield session
+    if subject and request.method not in ("GET", "HEAD"):
+        mark_wrote(request, subject)
 
 
-SessionDep = Annotated[Session, Depends(get_db)]
+SessionDep = Annotated[AsyncSession, Depends(get_db)]
 TokenDep = Annotated[str, Depends(reusable_oauth2)]
 
 
-def get_current_user(session: SessionDep, token: TokenDep) -> User:
+async def _get_user(session: AsyncSession, user_id: str | None) -> User | None:
+    if user_id is None:
+        return None
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        # A detached copy per request, it can be added to the request's
+        # session to update or delete the user
+        cached_user = User(**cached)
+        make_transient_to_detached(cached_user)
+        return cached_user
+    user = await session.get(User, user_id)
+    if user:
+        user_cache.set(user_id, user.model_dump())
+    return user
+
+
+def decode_token(token: str) -> TokenPayload:
     try:
         payload = jwt.decode(
             token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
         )
-        token_data = TokenPayload(**payload)
+        return TokenPayload(**payload)
     except (InvalidTokenError, ValidationError):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
-    user = session.get(User, token_data.sub)
+
+
+def _decode_access_token(token: str) -> TokenPayload:
+    token_data = decode_token(token)
+    if token_data.type == "refresh":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Could not validate credentials",
+        )
+    return token_data
+
+
+async def _get_active_user(session: AsyncSession, token_data: TokenPayload) -> User:
+    user = await _get_user(session, token_data.sub)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     if not user.is_active:
@@ -46,10 +114,44 @@ def get_current_user(session: SessionDep, token: TokenDep) -> User:
     return user
 
 
+async def get_current_user(session: SessionDep, token: TokenDep) -> User:
+    token_data = _decode_access_token(token)
+    return await _get_active_user(session, token_data)
+
+
 CurrentUser = Annotated[User, Depends(get_current_user)]
 
 
-def get_current_active_superuser(current_user: CurrentUser) -> User:
+@dataclass(frozen=True)
+class Principal:
+    """
+    Who a request is authenticated as, enough to authorize it.
+    """
+
+    id: uuid.UUID
+    is_superuser: bool
+
+
+async def get_current_principal(session: SessionDep, token: TokenDep) -> Principal:
+    token_data = _decode_access_token(token)
+    if token_data.sub and token_data.su is not None:
+        # Stateless access token, it's only issued to active users and
+        # carries the claims, the user doesn't need to be loaded
+        try:
+            return Principal(id=uuid.UUID(token_data.sub), is_superuser=token_data.su)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Could not validate credentials",
+            )
+    user = await _get_active_user(session, token_data)
+    return Principal(id=user.id, is_superuser=user.is_superuser)
+
+
+CurrentPrincipal = Annotated[Principal, Depends(get_current_principal)]
+
+
+def get_current_active_superuser(current_user: CurrentPrincipal) -> Principal:
     if not current_user.is_superuser:
         raise HTTPException(
             status_code=403, detail="The user doesn't have enough privileges"
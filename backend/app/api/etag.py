@@ -0,0 +1,59 @@
+import hashlib
+from typing import Any
+
+from fastapi import HTTPException, Response
+
+from app.api.serialization import dump_json
+
+
+def compute_etag(body: bytes) -> str:
+    """
+    Strong ETag of a response body.
+    """
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def etag_matches(header: str | None, etag: str, *, weak: bool = False) -> bool:
+    """
+    Whether an If-Match or If-None-Match header value lists the ETag. With
+    weak set, as for If-None-Match, W/ prefixed tags match too.
+    """
+    if header is None:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if weak and tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def etag_response(content: Any, if_none_match: str | None = None) -> Response:
+    """
+    JSON response for the content with its ETag, or 304 Not Modified when
+    the client already has it.
+
+    The content is data read from the database, already valid for the
+    response model of the route. It's serialized here once, both for the
+    ETag and the response, and not validated again.
+    """
+    body = dump_json(content)
+    etag = compute_etag(body)
+    if etag_matches(if_none_match, etag, weak=True):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
+def check_if_match(if_match: str | None, content: Any) -> None:
+    """
+    Reject an update made from another version than the current one.
+    """
+    if if_match is None:
+        return
+    if not etag_matches(if_match, compute_etag(dump_json(content))):
+        raise HTTPException(
+            status_code=412, detail="The resource was modified in the meantime"
+        )
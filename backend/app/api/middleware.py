@@ -0,0 +1,134 @@
+import logging
+import time
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.db import QueryStats, query_stats
+from app.core.replicas import read_your_writes_cookie
+
+logger = logging.getLogger(__name__)
+
+
+def route_label(scope: Scope) -> str:
+    # Set by the router once the request is matched to a route
+    route = scope.get("route")
+    return route.unique_id if isinstance(route, APIRoute) else "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Record the count, latency and status of the HTTP requests per route.
+
+    The route is labelled with its unique id rather than the path, so that
+    path parameters don't make a label value each. A plain ASGI middleware,
+    it doesn't wrap the request and response like BaseHTTPMiddleware does.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        metrics.HTTP_REQUESTS_IN_PROGRESS.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.HTTP_REQUESTS_IN_PROGRESS.dec()
+            label = route_label(scope)
+            metrics.HTTP_REQUESTS.labels(label, scope["method"], status_code).inc()
+            metrics.HTTP_REQUEST_SECONDS.labels(label).observe(elapsed)
+
+
+class QueryStatsMiddleware:
+    """
+    Count the database statements of each request and time them.
+
+    Outside of production the numbers so far are added to the response
+    headers, as Server-Timing and X-DB-* headers. Statements run many times
+    in the same request are logged as likely N+1 queries.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+
+        async def send_wrapper(message: Message) -> None:
+            if (
+                message["type"] == "http.response.start"
+                and settings.ENVIRONMENT != "production"
+            ):
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing",
+                    f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} statements"',
+                )
+                headers.append("X-DB-Statements", str(stats.count))
+                headers.append(
+                    "X-DB-Slowest-Statement-Ms", f"{stats.slowest_seconds * 1000:.1f}"
+                )
+            await send(message)
+
+        token = query_stats.set(stats)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            query_stats.reset(token)
+            label = route_label(scope)
+            metrics.DB_STATEMENTS_PER_REQUEST.labels(label).observe(stats.count)
+            metrics.DB_SECONDS_PER_REQUEST.labels(label).observe(stats.seconds)
+            threshold = settings.SQL_REPEATED_STATEMENT_THRESHOLD
+            for statement, count in stats.repeated(threshold):
+                metrics.DB_REPEATED_STATEMENTS.labels(label).inc()
+                logger.warning(
+                    f"Likely N+1 query in {label}, statement run {count} times: "
+                    f"{statement}"
+                )
+
+
+class ReadYourWritesMiddleware:
+    """
+    Set the read your writes cookie on the responses to the requests of a
+    user who wrote, see app.core.replicas. Here rather than in the routes, as
+    many of them return a response of their own.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Message) -> None:
+            # Set by app.core.replicas.mark_wrote
+            subject = scope.get("state", {}).get("wrote")
+            if message["type"] == "http.response.start" and subject:
+                headers = MutableHeaders(scope=message)
+                headers.append("Set-Cookie", read_your_writes_cookie(subject))
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
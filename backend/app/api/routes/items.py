@@ -1,109 +1,393 @@
+import csv
+import io
+import json
 import uuid
-from typing import Any
+from collections.abc import AsyncIterator
+from typing import Annotated, Any, Literal
 
-from fastapi import APIRouter, HTTPException
-from sqlmodel import func, select
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, cast, func, or_
+from sqlalchemy.dialects.postgresql import REAL
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.api.deps import CurrentUser, SessionDep
-from app.models import Item, ItemCreate, ItemPublic, ItemsPublic, ItemUpdate, Message
+from app import crud
+from app.api.deps import CurrentPrincipal, SessionDep, choose_engine
+from app.api.etag import check_if_match, etag_response
+from app.api.pagination import decode_cursor, paginate
+from app.api.serialization import json_response, public_columns, public_dict
+from app.core.admission import db_admission
+from app.core.config import settings
+from app.models import (
+    ITEM_SEARCH_CONFIG,
+    Item,
+    ItemBatchResult,
+    ItemBatchResults,
+    ItemCreate,
+    ItemPublic,
+    ItemsCreate,
+    ItemsDelete,
+    ItemsPublic,
+    ItemsUpdate,
+    ItemUpdate,
+    Message,
+    item_search_vector,
+)
 
 router = APIRouter(prefix="/items", tags=["items"])
 
 
 @router.get("/", response_model=ItemsPublic)
-def read_items(
-    session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100
+async def read_items(
+    session: SessionDep,
+    current_user: CurrentPrincipal,
+    skip: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(ge=1, le=settings.MAX_PAGE_SIZE)] = 100,
+    cursor: str | None = None,
+    include_count: bool = True,
+    exact_count: bool = False,
+    if_none_match: Annotated[str | None, Header()] = None,
 ) -> Any:
     """
     Retrieve items.
+
+    Pass the `next_cursor` of a page as `cursor` to get the page after it,
+    `skip` is ignored then. Set `include_count` to false to skip counting.
+    The count of all items seen by superusers is an estimate unless
+    `exact_count` is set.
     """
 
-    if current_user.is_superuser:
-        count_statement = select(func.count()).select_from(Item)
-        count = session.exec(count_statement).one()
-        statement = select(Item).offset(skip).limit(limit)
-        items = session.exec(statement).all()
+    owner_id = None if current_user.is_superuser else current_user.id
+    # Only the public columns, the rows are serialized as they are
+    statement = select(*public_columns(ItemPublic, Item))
+    if owner_id is not None:
+        statement = statement.where(Item.owner_id == owner_id)
+    if cursor:
+        (last_id,) = decode_cursor(cursor, uuid.UUID)
+        statement = statement.where(col(Item.id) > last_id)
     else:
-        count_statement = (
-            select(func.count())
-            .select_from(Item)
-            .where(Item.owner_id == current_user.id)
+        statement = statement.offset(skip)
+    # Fetch one more row to know if there is a next page
+    statement = statement.order_by(col(Item.id)).limit(limit + 1)
+    rows = (await session.exec(statement)).all()
+    items, next_cursor = paginate(rows, limit, key=lambda item: (item.id,))
+
+    count = None
+    if include_count:
+        count = await crud.async_count_items(
+            session=session, owner_id=owner_id, exact=exact_count
         )
-        count = session.exec(count_statement).one()
-        statement = (
-            select(Item)
-            .where(Item.owner_id == current_user.id)
-            .offset(skip)
-            .limit(limit)
+
+    return etag_response(
+        {
+            "data": [row._asdict() for row in items],
+            "count": count,
+            "next_cursor": next_cursor,
+        },
+        if_none_match,
+    )
+
+
+# Rows fetched from the server-side cursor at a time by the export
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = ("id", "title", "description", "owner_id")
+
+
+async def _export_rows(
+    engine: AsyncEngine, owner_id: uuid.UUID | None, format: Literal["ndjson", "csv"]
+) -> AsyncIterator[str]:
+    # The session of the request is closed, and its database slot released,
+    # before the response is sent. The rows are read with a session of their
+    # own, on the engine the request's session used, taking a slot again for
+    # as long as they stream.
+    statement = select(Item.id, Item.title, Item.description, Item.owner_id).order_by(
+        col(Item.id)
+    )
+    if owner_id is not None:
+        statement = statement.where(Item.owner_id == owner_id)
+    async with db_admission.admit(), AsyncSession(engine) as session:
+        result = await session.stream(
+            statement.execution_options(yield_per=EXPORT_BATCH_SIZE)
         )
-        items = session.exec(statement).all()
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            yield buffer.getvalue()
+        async for rows in result.partitions():
+            if format == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerows(rows)
+                yield buffer.getvalue()
+            else:
+                yield "".join(
+                    json.dumps(dict(zip(EXPORT_COLUMNS, row, strict=True)), default=str)
+                    + "\n"
+                    for row in rows
+                )
 
-    return ItemsPublic(data=items, count=count)
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_items(
+    request: Request,
+    current_user: CurrentPrincipal,
+    format: Literal["ndjson", "csv"] = "ndjson",
+) -> Any:
+    """
+    Export all the items as NDJSON or CSV.
+
+    The rows are streamed from a server-side cursor, so any number of items
+    can be exported with constant memory. An export that can't get a database
+    slot fails before any row is sent, the connection is closed.
+    """
+    owner_id = None if current_user.is_superuser else current_user.id
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _export_rows(choose_engine(request, str(current_user.id)), owner_id, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="items.{format}"'},
+    )
+
+
+@router.get("/search", response_model=ItemsPublic)
+async def search_items(
+    session: SessionDep,
+    current_user: CurrentPrincipal,
+    q: Annotated[str, Query(min_length=1, max_length=255)],
+    limit: Annotated[int, Query(ge=1, le=settings.MAX_PAGE_SIZE)] = 100,
+    cursor: str | None = None,
+) -> Any:
+    """
+    Search items by their title and description, best matches first.
+
+    `q` takes words, "quoted phrases", `or` and `-` to exclude a word, as web
+    search engines do. Pass the `next_cursor` of a page as `cursor` to get the
+    page after it. Matches are not counted, `count` is always null.
+
+    Every match is ranked to sort them, up to `SEARCH_MAX_CANDIDATES`. A
+    query matching that many items or more only ranks the first ones the
+    index finds, for a superuser in the first partitions of item it scans,
+    so the best matches may be missing. It gets a single page, without a
+    `next_cursor`, as the next page could rank other matches, narrow the
+    query down instead.
+    """
+    owner_id = None if current_user.is_superuser else current_user.id
+    query = func.websearch_to_tsquery(ITEM_SEARCH_CONFIG, q)
+    columns = [*public_columns(ItemPublic, Item), item_search_vector]
+    matches = select(*columns).where(item_search_vector.bool_op("@@")(query))
+    if owner_id is not None:
+        matches = matches.where(Item.owner_id == owner_id)
+    candidates = matches.limit(settings.SEARCH_MAX_CANDIDATES).subquery("candidates")
+    columns = [
+        *(candidates.c[name] for name in ItemPublic.model_fields),
+        func.ts_rank(candidates.c.search_vector, query, type_=REAL).label("rank"),
+        # Before the cursor leaves some out
+        func.count().over().label("candidates"),
+    ]
+    ranked = select(*columns).subquery("ranked")
+    statement = select(*ranked.c)
+    if cursor:
+        last_rank, last_id = decode_cursor(cursor, float, uuid.UUID)
+        # Compared as the real that ts_rank returns, not as a double
+        after = cast(last_rank, REAL)
+        statement = statement.where(
+            or_(
+                ranked.c.rank < after,
+                and_(ranked.c.rank == after, ranked.c.id > last_id),
+            )
+        )
+    statement = statement.order_by(ranked.c.rank.desc(), ranked.c.id).limit(limit + 1)
+    rows = (await session.exec(statement)).all()
+    items, next_cursor = paginate(rows, limit, key=lambda item: (item.rank, item.id))
+    if rows and rows[0].candidates >= settings.SEARCH_MAX_CANDIDATES:
+        next_cursor = None
+    return json_response(
+        {
+            "data": [public_dict(ItemPublic, row) for row in items],
+            "count": None,
+            "next_cursor": next_cursor,
+        }
+    )
+
+
+def _check_batch_size(size: int) -> None:
+    if size > settings.MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batches are limited to {settings.MAX_BATCH_SIZE} items",
+        )
+
+
+async def _get_batch_items(
+    session: SessionDep, current_user: CurrentPrincipal, ids: list[uuid.UUID]
+) -> tuple[dict[uuid.UUID, Item], dict[uuid.UUID, ItemBatchResult]]:
+    """
+    Load the items of a batch in one query, split into the ones the user may
+    change and the results of the ones they may not.
+    """
+    statement = select(Item).where(col(Item.id).in_(ids))
+    found = {item.id: item for item in (await session.exec(statement)).all()}
+    allowed: dict[uuid.UUID, Item] = {}
+    rejected: dict[uuid.UUID, ItemBatchResult] = {}
+    for id in ids:
+        item = found.get(id)
+        if not item:
+            rejected[id] = ItemBatchResult(
+                id=id, status_code=404, detail="Item not found"
+            )
+        elif not current_user.is_superuser and (item.owner_id != current_user.id):
+            rejected[id] = ItemBatchResult(
+                id=id, status_code=400, detail="Not enough permissions"
+            )
+        else:
+            allowed[id] = item
+    return allowed, rejected
+
+
+@router.post("/batch", response_model=ItemBatchResults)
+async def create_items(
+    *, session: SessionDep, current_user: CurrentPrincipal, items_in: ItemsCreate
+) -> Any:
+    """
+    Create new items, in one transaction.
+    """
+    _check_batch_size(len(items_in.data))
+    items = await crud.async_create_items(
+        session=session, items_in=items_in.data, owner_id=current_user.id
+    )
+    return ItemBatchResults(
+        data=[
+            ItemBatchResult(id=item.id, item=ItemPublic.model_validate(item))
+            for item in items
+        ]
+    )
+
+
+@router.patch("/batch", response_model=ItemBatchResults)
+async def update_items(
+    *, session: SessionDep, current_user: CurrentPrincipal, items_in: ItemsUpdate
+) -> Any:
+    """
+    Update items, in one transaction.
+
+    Items that are missing or not owned by the user are reported in the
+    results, the other items are updated.
+    """
+    _check_batch_size(len(items_in.data))
+    allowed, rejected = await _get_batch_items(
+        session, current_user, [item_in.id for item_in in items_in.data]
+    )
+    for item_in in items_in.data:
+        if item_in.id in allowed:
+            update_dict = item_in.model_dump(exclude_unset=True, exclude={"id"})
+            allowed[item_in.id].sqlmodel_update(update_dict)
+    # The flush groups the UPDATEs setting the same columns in executemany calls
+    await session.commit()
+    return ItemBatchResults(
+        data=[
+            rejected.get(item_in.id)
+            or ItemBatchResult(
+                id=item_in.id, item=ItemPublic.model_validate(allowed[item_in.id])
+            )
+            for item_in in items_in.data
+        ]
+    )
+
+
+@router.delete("/batch", response_model=ItemBatchResults)
+async def delete_items(
+    *, session: SessionDep, current_user: CurrentPrincipal, items_in: ItemsDelete
+) -> Any:
+    """
+    Delete items, in one transaction.
+
+    Items that are missing or not owned by the user are reported in the
+    results, the other items are deleted.
+    """
+    _check_batch_size(len(items_in.ids))
+    allowed, rejected = await _get_batch_items(session, current_user, items_in.ids)
+    if allowed:
+        await crud.async_delete_items(session=session, db_items=list(allowed.values()))
+    return ItemBatchResults(
+        data=[rejected.get(id) or ItemBatchResult(id=id) for id in items_in.ids]
+    )
 
 
 @router.get("/{id}", response_model=ItemPublic)
-def read_item(session: SessionDep, current_user: CurrentUser, id: uuid.UUID) -> Any:
+async def read_item(
+    session: SessionDep,
+    current_user: CurrentPrincipal,
+    id: uuid.UUID,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> Any:
     """
     Get item by ID.
     """
-    item = session.get(Item, id)
+    item = await session.get(Item, id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     if not current_user.is_superuser and (item.owner_id != current_user.id):
         raise HTTPException(status_code=400, detail="Not enough permissions")
-    return item
+    return etag_response(public_dict(ItemPublic, item), if_none_match)
 
 
 @router.post("/", response_model=ItemPublic)
-def create_item(
-    *, session: SessionDep, current_user: CurrentUser, item_in: ItemCreate
+async def create_item(
+    *, session: SessionDep, current_user: CurrentPrincipal, item_in: ItemCreate
 ) -> Any:
     """
     Create new item.
     """
-    item = Item.model_validate(item_in, update={"owner_id": current_user.id})
-    session.add(item)
-    session.commit()
-    session.refresh(item)
+    item = await crud.async_create_item(
+        session=session, item_in=item_in, owner_id=current_user.id
+    )
     return item
 
 
 @router.put("/{id}", response_model=ItemPublic)
-def update_item(
+async def update_item(
     *,
     session: SessionDep,
-    current_user: CurrentUser,
+    current_user: CurrentPrincipal,
     id: uuid.UUID,
     item_in: ItemUpdate,
+    if_match: Annotated[str | None, Header()] = None,
 ) -> Any:
     """
     Update an item.
+
+    With `If-Match`, the update is only made if the item still has that ETag.
     """
-    item = session.get(Item, id)
+    # Lock the row so that the item can't change between the check and the
+    # update
+    item = await session.get(Item, id, with_for_update=if_match is not None)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     if not current_user.is_superuser and (item.owner_id != current_user.id):
         raise HTTPException(status_code=400, detail="Not enough permissions")
+    check_if_match(if_match, public_dict(ItemPublic, item))
     update_dict = item_in.model_dump(exclude_unset=True)
     item.sqlmodel_update(update_dict)
     session.add(item)
-    session.commit()
-    session.refresh(item)
-    return item
+    await session.commit()
+    await session.refresh(item)
+    return etag_response(public_dict(ItemPublic, item))
 
 
 @router.delete("/{id}")
-def delete_item(
-    session: SessionDep, current_user: CurrentUser, id: uuid.UUID
+async def delete_item(
+    session: SessionDep, current_user: CurrentPrincipal, id: uuid.UUID
 ) -> Message:
     """
     Delete an item.
     """
-    item = session.get(Item, id)
+    item = await session.get(Item, id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     if not current_user.is_superuser and (item.owner_id != current_user.id):
         raise HTTPException(status_code=400, detail="Not enough permissions")
-    session.delete(item)
-    session.commit()
+    await crud.async_delete_item(session=session, db_item=item)
     return Message(message="Item deleted successfully")
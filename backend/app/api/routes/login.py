@@ -1,62 +1,136 @@
+import uuid
 from datetime import timedelta
 from typing import Annotated, Any
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import HTMLResponse
 from fastapi.security import OAuth2PasswordRequestForm
 
 from app import crud
-from app.api.deps import CurrentUser, SessionDep, get_current_active_superuser
+from app.api.deps import (
+    CurrentUser,
+    SessionDep,
+    decode_token,
+    get_current_active_superuser,
+)
 from app.core import security
+from app.core.cache import user_cache
 from app.core.config import settings
-from app.core.security import get_password_hash
-from app.models import Message, NewPassword, Token, UserPublic
+from app.core.ratelimit import RateLimit, client_ip, form_field, path_param
+from app.core.replicas import mark_wrote
+from app.core.security import get_password_hash_async
+from app.models import Message, NewPassword, Token, TokenRefresh, User, UserPublic
+from app.outbox import email_outbox
 from app.utils import (
     generate_password_reset_token,
     generate_reset_password_email,
-    send_email,
     verify_password_reset_token,
 )
 
 router = APIRouter(tags=["login"])
 
 
-@router.post("/login/access-token")
-def login_access_token(
-    session: SessionDep, form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
+def _issue_tokens(request: Request, user: User) -> Token:
+    # The first reads with the new token go to the primary, a replica might
+    # not have the user yet
+    mark_wrote(request, str(user.id))
+    if not settings.STATELESS_ACCESS_TOKENS:
+        access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+        return Token(
+            access_token=security.create_access_token(
+                user.id, expires_delta=access_token_expires
+            )
+        )
+    # Short lived access token carrying what's needed to authorize requests,
+    # the refresh token is checked against the database when it's used
+    access_token_expires = timedelta(
+        minutes=settings.STATELESS_ACCESS_TOKEN_EXPIRE_MINUTES
+    )
+    refresh_token_expires = timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES)
+    return Token(
+        access_token=security.create_access_token(
+            user.id,
+            expires_delta=access_token_expires,
+            claims={"su": user.is_superuser},
+        ),
+        refresh_token=security.create_refresh_token(
+            user.id, user.hashed_password, expires_delta=refresh_token_expires
+        ),
+    )
+
+
+@router.post(
+    "/login/access-token",
+    dependencies=[
+        Depends(RateLimit("RATE_LIMIT_LOGIN_PER_IP", client_ip)),
+        Depends(RateLimit("RATE_LIMIT_LOGIN_PER_ACCOUNT", form_field("username"))),
+    ],
+)
+async def login_access_token(
+    request: Request,
+    session: SessionDep,
+    form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
 ) -> Token:
     """
     OAuth2 compatible token login, get an access token for future requests
     """
-    user = crud.authenticate(
+    user = await crud.async_authenticate(
         session=session, email=form_data.username, password=form_data.password
     )
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect email or password")
     elif not user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
-    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    return Token(
-        access_token=security.create_access_token(
-            user.id, expires_delta=access_token_expires
-        )
-    )
+    return _issue_tokens(request, user)
+
+
+@router.post("/login/refresh-token")
+async def refresh_access_token(
+    request: Request, session: SessionDep, body: TokenRefresh
+) -> Token:
+    """
+    Get new tokens with a refresh token
+    """
+    token_data = decode_token(body.refresh_token)
+    user = None
+    if token_data.type == "refresh" and token_data.sub:
+        try:
+            user = await session.get(User, uuid.UUID(token_data.sub))
+        except ValueError:
+            pass
+    if (
+        not user
+        or not token_data.pwd
+        or token_data.pwd != security.password_fingerprint(user.hashed_password)
+    ):
+        raise HTTPException(status_code=403, detail="Could not validate credentials")
+    elif not user.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return _issue_tokens(request, user)
 
 
 @router.post("/login/test-token", response_model=UserPublic)
-def test_token(current_user: CurrentUser) -> Any:
+async def test_token(current_user: CurrentUser) -> Any:
     """
     Test access token
     """
     return current_user
 
 
-@router.post("/password-recovery/{email}")
-def recover_password(email: str, session: SessionDep) -> Message:
+@router.post(
+    "/password-recovery/{email}",
+    dependencies=[
+        Depends(RateLimit("RATE_LIMIT_PASSWORD_RECOVERY_PER_IP", client_ip)),
+        Depends(
+            RateLimit("RATE_LIMIT_PASSWORD_RECOVERY_PER_ACCOUNT", path_param("email"))
+        ),
+    ],
+)
+async def recover_password(email: str, session: SessionDep) -> Message:
     """
     Password Recovery
     """
-    user = crud.get_user_by_email(session=session, email=email)
+    user = await crud.async_get_user_by_email(session=session, email=email)
 
     if not user:
         raise HTTPException(
@@ -67,7 +141,7 @@ def recover_password(email: str, session: SessionDep) -> Message:
     email_data = generate_reset_password_email(
         email_to=user.email, email=email, token=password_reset_token
     )
-    send_email(
+    email_outbox.enqueue(
         email_to=user.email,
         subject=email_data.subject,
         html_content=email_data.html_content,
@@ -76,14 +150,14 @@ def recover_password(email: str, session: SessionDep) -> Message:
 
 
 @router.post("/reset-password/")
-def reset_password(session: SessionDep, body: NewPassword) -> Message:
+async def reset_password(session: SessionDep, body: NewPassword) -> Message:
     """
     Reset password
     """
     email = verify_password_reset_token(token=body.token)
     if not email:
         raise HTTPException(status_code=400, detail="Invalid token")
-    user = crud.get_user_by_email(session=session, email=email)
+    user = await crud.async_get_user_by_email(session=session, email=email)
     if not user:
         raise HTTPException(
             status_code=404,
@@ -91,10 +165,11 @@ def reset_password(session: SessionDep, body: NewPassword) -> Message:
         )
     elif not user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
-    hashed_password = get_password_hash(password=body.new_password)
+    hashed_password = await get_password_hash_async(body.new_password)
     user.hashed_password = hashed_password
     session.add(user)
-    session.commit()
+    await session.commit()
+    user_cache.invalidate(str(user.id))
     return Message(message="Password updated successfully")
 
 
@@ -103,11 +178,11 @@ def reset_password(session: SessionDep, body: NewPassword) -> Message:
     dependencies=[Depends(get_current_active_superuser)],
     response_class=HTMLResponse,
 )
-def recover_password_html_content(email: str, session: SessionDep) -> Any:
+async def recover_password_html_content(email: str, session: SessionDep) -> Any:
     """
     HTML Content for Password Recovery
     """
-    user = crud.get_user_by_email(session=session, email=email)
+    user = await crud.async_get_user_by_email(session=session, email=email)
 
     if not user:
         raise HTTPException(
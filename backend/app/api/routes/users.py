@@ -1,30 +1,39 @@
 import uuid
-from typing import Any
+from typing import Annotated, Any
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, UploadFile
 from sqlmodel import col, delete, func, select
 
 from app import crud
 from app.api.deps import (
+    CurrentPrincipal,
     CurrentUser,
     SessionDep,
     get_current_active_superuser,
 )
+from app.api.etag import check_if_match, etag_response
+from app.api.pagination import decode_cursor, paginate
+from app.api.serialization import json_response, public_columns, public_dict
+from app.core.cache import user_cache
 from app.core.config import settings
-from app.core.security import get_password_hash, verify_password
+from app.core.ratelimit import RateLimit, token_subject
+from app.core.security import get_password_hash_async, verify_password_async
 from app.models import (
     Item,
     Message,
     UpdatePassword,
     User,
     UserCreate,
+    UserImportResults,
     UserPublic,
     UserRegister,
     UsersPublic,
     UserUpdate,
     UserUpdateMe,
 )
-from app.utils import generate_new_account_email, send_email
+from app.outbox import email_outbox
+from app.user_import import InvalidUserImport, import_users
+from app.utils import generate_new_account_email
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -34,40 +43,66 @@ router = APIRouter(prefix="/users", tags=["users"])
     dependencies=[Depends(get_current_active_superuser)],
     response_model=UsersPublic,
 )
-def read_users(session: SessionDep, skip: int = 0, limit: int = 100) -> Any:
+async def read_users(
+    session: SessionDep,
+    skip: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(ge=1, le=settings.MAX_PAGE_SIZE)] = 100,
+    cursor: str | None = None,
+    include_count: bool = True,
+) -> Any:
     """
     Retrieve users.
+
+    Pass the `next_cursor` of a page as `cursor` to get the page after it,
+    `skip` is ignored then. Set `include_count` to false to skip counting.
     """
 
-    count_statement = select(func.count()).select_from(User)
-    count = session.exec(count_statement).one()
+    # Only the public columns, the rows are serialized as they are
+    statement = select(*public_columns(UserPublic, User))
+    if cursor:
+        (last_id,) = decode_cursor(cursor, uuid.UUID)
+        statement = statement.where(col(User.id) > last_id)
+    else:
+        statement = statement.offset(skip)
+    # Fetch one more row to know if there is a next page
+    statement = statement.order_by(col(User.id)).limit(limit + 1)
+    rows = (await session.exec(statement)).all()
+    users, next_cursor = paginate(rows, limit, key=lambda user: (user.id,))
 
-    statement = select(User).offset(skip).limit(limit)
-    users = session.exec(statement).all()
+    count = None
+    if include_count:
+        count_statement = select(func.count()).select_from(User)
+        count = (await session.exec(count_statement)).one()
 
-    return UsersPublic(data=users, count=count)
+    return json_response(
+        {
+            "data": [row._asdict() for row in users],
+            "count": count,
+            "next_cursor": next_cursor,
+        }
+    )
 
 
 @router.post(
     "/", dependencies=[Depends(get_current_active_superuser)], response_model=UserPublic
 )
-def create_user(*, session: SessionDep, user_in: UserCreate) -> Any:
+async def create_user(*, session: SessionDep, user_in: UserCreate) -> Any:
     """
     Create new user.
     """
-    user = crud.get_user_by_email(session=session, email=user_in.email)
+    user = await crud.async_get_user_by_email(session=session, email=user_in.email)
     if user:
         raise HTTPException(
             status_code=400,
             detail="The user with this email already exists in the system.",
         )
 
-    user = crud.create_user(session=session, user_create=user_in)
+    user = await crud.async_create_user(session=session, user_create=user_in)
     if settings.emails_enabled and user_in.email:
         email_data = generate_new_account_email(
             email_to=user_in.email, username=user_in.email, password=user_in.password
         )
-        send_email(
+        email_outbox.enqueue(
             email_to=user_in.email,
             subject=email_data.subject,
             html_content=email_data.html_content,
@@ -75,16 +110,57 @@ def create_user(*, session: SessionDep, user_in: UserCreate) -> Any:
     return user
 
 
+@router.post(
+    "/import",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=UserImportResults,
+)
+async def import_users_csv(session: SessionDep, file: UploadFile) -> Any:
+    """
+    Create users from a CSV file.
+
+    The header names the columns, `email` and `password` are required,
+    `full_name`, `is_active` and `is_superuser` are optional. Rows that
+    can't be imported are reported with their line, the other rows are
+    imported. New users get the same welcome email as with a single create.
+    """
+    try:
+        return await import_users(
+            session=session,
+            file=file.file,
+            batch_size=settings.USER_IMPORT_BATCH_SIZE,
+        )
+    except InvalidUserImport as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.patch("/me", response_model=UserPublic)
-def update_user_me(
-    *, session: SessionDep, user_in: UserUpdateMe, current_user: CurrentUser
+async def update_user_me(
+    *,
+    session: SessionDep,
+    user_in: UserUpdateMe,
+    current_user: CurrentUser,
+    if_match: Annotated[str | None, Header()] = None,
 ) -> Any:
     """
     Update own user.
+
+    With `If-Match`, the update is only made if the user still has that ETag.
     """
+    if if_match is not None:
+        # The current user can come from the cache, check the locked row
+        db_user = await session.get(
+            User, current_user.id, with_for_update=True, populate_existing=True
+        )
+        if not db_user:
+            raise HTTPException(status_code=404, detail="User not found")
+        check_if_match(if_match, public_dict(UserPublic, db_user))
+        current_user = db_user
 
     if user_in.email:
-        existing_user = crud.get_user_by_email(session=session, email=user_in.email)
+        existing_user = await crud.async_get_user_by_email(
+            session=session, email=user_in.email
+        )
         if existing_user and existing_user.id != current_user.id:
             raise HTTPException(
                 status_code=409, detail="User with this email already exists"
@@ -92,41 +168,59 @@ def update_user_me(
     user_data = user_in.model_dump(exclude_unset=True)
     current_user.sqlmodel_update(user_data)
     session.add(current_user)
-    session.commit()
-    session.refresh(current_user)
-    return current_user
+    await session.commit()
+    user_cache.invalidate(str(current_user.id))
+    await session.refresh(current_user)
+    return etag_response(public_dict(UserPublic, current_user))
 
 
-@router.patch("/me/password", response_model=Message)
-def update_password_me(
+@router.patch(
+    "/me/password",
+    dependencies=[
+        Depends(RateLimit("RATE_LIMIT_PASSWORD_CHANGE_PER_USER", token_subject))
+    ],
+    response_model=Message,
+)
+async def update_password_me(
     *, session: SessionDep, body: UpdatePassword, current_user: CurrentUser
 ) -> Any:
     """
     Update own password.
     """
-    if not verify_password(body.current_password, current_user.hashed_password):
+    # Not the cached user's hash, another worker may have changed the
+    # password since it was cached
+    statement = select(User.hashed_password).where(User.id == current_user.id)
+    current_hash = (await session.exec(statement)).one_or_none()
+    if current_hash is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    # Not holding the connection in a transaction while hashing
+    await session.commit()
+    if not await verify_password_async(body.current_password, current_hash):
         raise HTTPException(status_code=400, detail="Incorrect password")
     if body.current_password == body.new_password:
         raise HTTPException(
             status_code=400, detail="New password cannot be the same as the current one"
         )
-    hashed_password = get_password_hash(body.new_password)
+    hashed_password = await get_password_hash_async(body.new_password)
     current_user.hashed_password = hashed_password
     session.add(current_user)
-    session.commit()
+    await session.commit()
+    user_cache.invalidate(str(current_user.id))
     return Message(message="Password updated successfully")
 
 
 @router.get("/me", response_model=UserPublic)
-def read_user_me(current_user: CurrentUser) -> Any:
+async def read_user_me(
+    current_user: CurrentUser, if_none_match: Annotated[str | None, Header()] = None
+) -> Any:
     """
     Get current user.
     """
-    return current_user
+    return etag_response(public_dict(UserPublic, current_user), if_none_match)
 
 
 @router.delete("/me", response_model=Message)
-def delete_user_me(session: SessionDep, current_user: CurrentUser) -> Any:
+async def delete_user_me(session: SessionDep, current_user: CurrentUser) -> Any:
     """
     Delete own user.
     """
@@ -135,44 +229,53 @@ def delete_user_me(session: SessionDep, current_user: CurrentUser) -> Any:
             status_code=403, detail="Super users are not allowed to delete themselves"
         )
     statement = delete(Item).where(col(Item.owner_id) == current_user.id)
-    session.exec(statement)  # type: ignore
-    session.delete(current_user)
-    session.commit()
+    await session.exec(statement)  # type: ignore
+    await session.delete(current_user)
+    await session.commit()
+    user_cache.invalidate(str(current_user.id))
     return Message(message="User deleted successfully")
 
 
 @router.post("/signup", response_model=UserPublic)
-def register_user(session: SessionDep, user_in: UserRegister) -> Any:
+async def register_user(session: SessionDep, user_in: UserRegister) -> Any:
     """
     Create new user without the need to be logged in.
     """
-    user = crud.get_user_by_email(session=session, email=user_in.email)
+    user = await crud.async_get_user_by_email(session=session, email=user_in.email)
     if user:
         raise HTTPException(
             status_code=400,
             detail="The user with this email already exists in the system",
         )
     user_create = UserCreate.model_validate(user_in)
-    user = crud.create_user(session=session, user_create=user_create)
+    user = await crud.async_create_user(session=session, user_create=user_create)
     return user
 
 
 @router.get("/{user_id}", response_model=UserPublic)
-def read_user_by_id(
-    user_id: uuid.UUID, session: SessionDep, current_user: CurrentUser
+async def read_user_by_id(
+    user_id: uuid.UUID,
+    session: SessionDep,
+    current_user: CurrentUser,
+    if_none_match: Annotated[str | None, Header()] = None,
 ) -> Any:
     """
     Get a specific user by id.
     """
-    user = session.get(User, user_id)
-    if user == current_user:
-        return user
+    if user_id == current_user.id:
+        return etag_response(public_dict(UserPublic, current_user), if_none_match)
     if not current_user.is_superuser:
         raise HTTPException(
             status_code=403,
             detail="The user doesn't have enough privileges",
         )
-    return user
+    user = await session.get(User, user_id)
+    if not user:
+        raise HTTPException(
+            status_code=404,
+            detail="The user with this id does not exist in the system",
+        )
+    return etag_response(public_dict(UserPublic, user), if_none_match)
 
 
 @router.patch(
@@ -180,49 +283,58 @@ def read_user_by_id(
     dependencies=[Depends(get_current_active_superuser)],
     response_model=UserPublic,
 )
-def update_user(
+async def update_user(
     *,
     session: SessionDep,
     user_id: uuid.UUID,
     user_in: UserUpdate,
+    if_match: Annotated[str | None, Header()] = None,
 ) -> Any:
     """
     Update a user.
+
+    With `If-Match`, the update is only made if the user still has that ETag.
     """
 
-    db_user = session.get(User, user_id)
+    db_user = await session.get(User, user_id, with_for_update=if_match is not None)
     if not db_user:
         raise HTTPException(
             status_code=404,
             detail="The user with this id does not exist in the system",
         )
+    check_if_match(if_match, public_dict(UserPublic, db_user))
     if user_in.email:
-        existing_user = crud.get_user_by_email(session=session, email=user_in.email)
+        existing_user = await crud.async_get_user_by_email(
+            session=session, email=user_in.email
+        )
         if existing_user and existing_user.id != user_id:
             raise HTTPException(
                 status_code=409, detail="User with this email already exists"
             )
 
-    db_user = crud.update_user(session=session, db_user=db_user, user_in=user_in)
-    return db_user
+    db_user = await crud.async_update_user(
+        session=session, db_user=db_user, user_in=user_in
+    )
+    return etag_response(public_dict(UserPublic, db_user))
 
 
 @router.delete("/{user_id}", dependencies=[Depends(get_current_active_superuser)])
-def delete_user(
-    session: SessionDep, current_user: CurrentUser, user_id: uuid.UUID
+async def delete_user(
+    session: SessionDep, current_user: CurrentPrincipal, user_id: uuid.UUID
 ) -> Message:
     """
     Delete a user.
     """
-    user = session.get(User, user_id)
+    user = await session.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    if user == current_user:
+    if user.id == current_user.id:
         raise HTTPException(
             status_code=403, detail="Super users are not allowed to delete themselves"
         )
     statement = delete(Item).where(col(Item.owner_id) == user_id)
-    session.exec(statement)  # type: ignore
-    session.delete(user)
-    session.commit()
+    await session.exec(statement)  # type: ignore
+    await session.delete(user)
+    await session.commit()
+    user_cache.invalidate(str(user_id))
     return Message(message="User deleted successfully")
@@ -2,8 +2,10 @@ from fastapi import APIRouter, Depends
 from pydantic.networks import EmailStr
 
 from app.api.deps import get_current_active_superuser
-from app.models import Message
-from app.utils import generate_test_email, send_email
+from app.core.db import async_engine, get_pool_status
+from app.models import DbPoolStatus, Message
+from app.outbox import email_outbox
+from app.utils import generate_test_email
 
 router = APIRouter(prefix="/utils", tags=["utils"])
 
@@ -13,12 +15,12 @@ router = APIRouter(prefix="/utils", tags=["utils"])
     dependencies=[Depends(get_current_active_superuser)],
     status_code=201,
 )
-def test_email(email_to: EmailStr) -> Message:
+async def test_email(email_to: EmailStr) -> Message:
     """
     Test emails.
     """
     email_data = generate_test_email(email_to=email_to)
-    send_email(
+    email_outbox.enqueue(
         email_to=email_to,
         subject=email_data.subject,
         html_content=email_data.html_content,
@@ -26,6 +28,17 @@ def test_email(email_to: EmailStr) -> Message:
     return Message(message="Test email sent")
 
 
+@router.get(
+    "/db-pool/",
+    dependencies=[Depends(get_current_active_superuser)],
+)
+async def db_pool_status() -> DbPoolStatus:
+    """
+    Connection pool status of the worker process that serves the request.
+    """
+    return get_pool_status(async_engine.sync_engine)
+
+
 @router.get("/health-check/")
 async def health_check() -> bool:
     return True
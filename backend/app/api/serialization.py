@@ -0,0 +1,35 @@
+from typing import Any
+
+import orjson
+from fastapi import Response
+from sqlmodel import SQLModel
+
+
+def dump_json(content: Any) -> bytes:
+    """
+    Serialize plain data to JSON, UUIDs included.
+    """
+    return orjson.dumps(content)
+
+
+def json_response(content: Any) -> Response:
+    """
+    JSON response for data read from the database, already valid for the
+    response model of the route, that is not validated again.
+    """
+    return Response(content=dump_json(content), media_type="application/json")
+
+
+def public_columns(public: type[SQLModel], table: type[SQLModel]) -> list[Any]:
+    """
+    The columns of the table for the fields of the public model, to select
+    rows that can be serialized as they are.
+    """
+    return [getattr(table, name) for name in public.model_fields]
+
+
+def public_dict(public: type[SQLModel], obj: Any) -> dict[str, Any]:
+    """
+    The fields of the public model read from an object of the table model.
+    """
+    return {name: getattr(obj, name) for name in public.model_fields}
@@ -0,0 +1,45 @@
+import argparse
+import logging
+
+from app.core.config import settings
+from app.core.security import calibrate_argon2_time_cost, calibrate_bcrypt_rounds
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Find the password hash cost that takes about the target "
+        "verify time on this machine, and print the settings for it. Run it "
+        "on the hardware the backend is deployed on."
+    )
+    parser.add_argument(
+        "--scheme", choices=["bcrypt", "argon2"], default=settings.PASSWORD_HASH_SCHEME
+    )
+    parser.add_argument(
+        "--target-ms", type=float, default=250.0, help="verify time to aim for"
+    )
+    args = parser.parse_args()
+    target_seconds = args.target_ms / 1000
+
+    if args.scheme == "bcrypt":
+        rounds, seconds = calibrate_bcrypt_rounds(target_seconds)
+        logger.info(f"bcrypt rounds {rounds} verify in {seconds * 1000:.0f} ms")
+        print("PASSWORD_HASH_SCHEME=bcrypt")
+        print(f"PASSWORD_BCRYPT_ROUNDS={rounds}")
+    else:
+        time_cost, seconds = calibrate_argon2_time_cost(
+            target_seconds,
+            settings.PASSWORD_ARGON2_MEMORY_COST,
+            settings.PASSWORD_ARGON2_PARALLELISM,
+        )
+        logger.info(f"argon2 time cost {time_cost} verify in {seconds * 1000:.0f} ms")
+        print("PASSWORD_HASH_SCHEME=argon2")
+        print(f"PASSWORD_ARGON2_TIME_COST={time_cost}")
+        print(f"PASSWORD_ARGON2_MEMORY_COST={settings.PASSWORD_ARGON2_MEMORY_COST}")
+        print(f"PASSWORD_ARGON2_PARALLELISM={settings.PASSWORD_ARGON2_PARALLELISM}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import asyncio
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from app.core import metrics
+from app.core.config import settings
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request can't get a database slot, because the queue for
+    one is full or the wait for one timed out.
+    """
+
+    def __init__(self, reason: str) -> None:
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AdmissionGate:
+    """
+    Caps the requests using the database at once in this worker process to
+    limit, as many as the connection pool can serve, and queues at most
+    queue_size more in arrival order. A request waits at most timeout
+    seconds in the queue. Past that, or with the queue full, it's rejected
+    right away instead of piling up on the pool checkout.
+
+    Plain futures of the running loop rather than an asyncio.Semaphore, which
+    binds to the first loop it waits on, as the test clients each run their
+    own loop.
+    """
+
+    def __init__(self, *, limit: int, queue_size: int, timeout: float) -> None:
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _reject(self, reason: str) -> AdmissionRejected:
+        metrics.DB_ADMISSION_REJECTED.labels(reason).inc()
+        return AdmissionRejected(reason)
+
+    def _update_gauges(self) -> None:
+        metrics.DB_ADMISSION_ACTIVE.set(self.active)
+        metrics.DB_ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+
+    async def _wait(self) -> None:
+        if len(self._waiters) >= self.queue_size:
+            raise self._reject("queue_full")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._update_gauges()
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait ended, pass it on
+                self._release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            self._update_gauges()
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject("timeout")
+            raise
+
+    def _release(self) -> None:
+        # Hand the slot to the first waiter still waiting, active stays the same
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        start = time.perf_counter()
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+        else:
+            await self._wait()
+        metrics.DB_ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start)
+        self._update_gauges()
+        try:
+            yield
+        finally:
+            self._release()
+            self._update_gauges()
+
+
+db_admission = AdmissionGate(
+    limit=settings.DB_ADMISSION_LIMIT
+    or settings.POSTGRES_POOL_SIZE + settings.POSTGRES_MAX_OVERFLOW,
+    queue_size=settings.DB_ADMISSION_QUEUE_SIZE,
+    timeout=settings.DB_ADMISSION_QUEUE_TIMEOUT,
+)
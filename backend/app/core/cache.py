@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Generic, TypeVar
+
+from app.core import metrics
+from app.core.config import settings
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """
+    In-process LRU cache whose entries also expire after ttl seconds.
+
+    Each worker process has its own copy, so invalidating an entry only
+    affects the current process, other processes see the change once their
+    entry expires. A ttl of 0 disables the cache.
+    """
+
+    def __init__(self, *, name: str, maxsize: int, ttl: float) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> V | None:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                metrics.CACHE_HITS.labels(self.name).inc()
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            metrics.CACHE_MISSES.labels(self.name).inc()
+            return None
+
+    def set(self, key: K, value: V) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: K) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+# Column values of authenticated users by id, see app.api.deps.get_current_user
+user_cache: TTLCache[str, dict[str, Any]] = TTLCache(
+    name="user",
+    maxsize=settings.USER_CACHE_MAX_SIZE,
+    ttl=settings.USER_CACHE_TTL_SECONDS,
+)
@@ -34,8 +34,34 @@ class Settings(BaseSettings):
     SECRET_KEY: str = secrets.token_urlsafe(32)
     # 60 minutes * 24 hours * 8 days = 8 days
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8
+    # When set, login issues short-lived access tokens carrying the claims
+    # needed to authorize requests without loading the user, and a refresh
+    # token to get new ones. Changes to a user can take this long to apply.
+    STATELESS_ACCESS_TOKENS: bool = False
+    STATELESS_ACCESS_TOKEN_EXPIRE_MINUTES: int = 5
+    REFRESH_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8
+    # Authenticated users are cached per worker for this long, a change to a
+    # user can take this long to be seen by the other workers. 0 disables it.
+    USER_CACHE_TTL_SECONDS: float = 30.0
+    USER_CACHE_MAX_SIZE: int = 10_000
     FRONTEND_HOST: str = "http://localhost:5173"
     ENVIRONMENT: Literal["local", "staging", "production"] = "local"
+    # Statements slower than this get their plan logged, 0 disables it
+    SQL_SLOW_STATEMENT_SECONDS: float = 0.5
+    # A statement run this many times in one request is logged as a likely
+    # N+1 query
+    SQL_REPEATED_STATEMENT_THRESHOLD: int = 10
+    # Upper bound for the limit of list endpoints
+    MAX_PAGE_SIZE: int = 1000
+    # Upper bound for the number of items in a batch request
+    MAX_BATCH_SIZE: int = 1000
+    # Item search ranks at most this many matches, the first ones the index
+    # finds, so that a query matching most items doesn't rank all of them
+    SEARCH_MAX_CANDIDATES: int = 10_000
+    # Rows of a user import validated, hashed and inserted together. The
+    # passwords are hashed a few at a time, leaving a password hash process
+    # to the logins when there are more than one.
+    USER_IMPORT_BATCH_SIZE: int = 100
 
     BACKEND_CORS_ORIGINS: Annotated[
         list[AnyUrl] | str, BeforeValidator(parse_cors)
@@ -50,11 +76,57 @@ class Settings(BaseSettings):
 
     PROJECT_NAME: str
     SENTRY_DSN: HttpUrl | None = None
+    # Bearer token Prometheus scrapes /metrics with. Without one, /metrics is
+    # only served in the local environment, as it's exposed with the API.
+    METRICS_TOKEN: str | None = None
     POSTGRES_SERVER: str = "localhost"
     POSTGRES_PORT: int = 5432
     POSTGRES_USER: str = "postgres"
     POSTGRES_PASSWORD: str = "postgres"
     POSTGRES_DB: str = "taxform"
+    # Connection pool, per worker process
+    POSTGRES_POOL_SIZE: int = 5
+    POSTGRES_MAX_OVERFLOW: int = 10
+    POSTGRES_POOL_TIMEOUT: float = 30.0
+    # Seconds before a connection is replaced, -1 to never recycle
+    POSTGRES_POOL_RECYCLE: int = 1800
+    POSTGRES_POOL_PRE_PING: bool = True
+    # Set when connecting through a transaction pooler like PgBouncer, it
+    # does the pooling, so the engine uses NullPool and no prepared statements
+    POSTGRES_PGBOUNCER: bool = False
+    # Read replicas, comma separated URLs. GET and HEAD requests read from a
+    # healthy replica, except those of a user who wrote or logged in during
+    # the last POSTGRES_READ_YOUR_WRITES_SECONDS, see app.core.replicas
+    POSTGRES_REPLICA_URLS: Annotated[
+        list[PostgresDsn] | str, BeforeValidator(parse_cors)
+    ] = []
+    POSTGRES_READ_YOUR_WRITES_SECONDS: float = 5.0
+    # A replica further behind than this is not read from until it catches up
+    POSTGRES_REPLICA_MAX_LAG_SECONDS: float = 5.0
+    POSTGRES_REPLICA_CHECK_SECONDS: float = 5.0
+    # Admission control, see app.core.admission. Requests using the database
+    # at once per worker process, by default as many as the pool has
+    # connections, and how many more wait for a slot before getting a 503
+    DB_ADMISSION_LIMIT: int | None = None
+    DB_ADMISSION_QUEUE_SIZE: int = 50
+    DB_ADMISSION_QUEUE_TIMEOUT: float = 10.0
+    # Hash partitions of the item table, read by the migration partitioning
+    # it, changing it afterwards takes a new migration
+    ITEM_PARTITIONS: int = 16
+
+    # Token bucket rate limits, see app.core.ratelimit. A rate is a burst of
+    # requests and how long the bucket takes to refill, as "5/minute",
+    # "100/hour" or "10/30s". The memory backend limits each worker process
+    # on its own, the redis backend (redis extra) shares the buckets.
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: Literal["memory", "redis"] = "memory"
+    RATE_LIMIT_REDIS_URL: str | None = None
+    RATE_LIMIT_MAX_BUCKETS: int = 100_000
+    RATE_LIMIT_LOGIN_PER_IP: str = "20/minute"
+    RATE_LIMIT_LOGIN_PER_ACCOUNT: str = "5/minute"
+    RATE_LIMIT_PASSWORD_RECOVERY_PER_IP: str = "5/minute"
+    RATE_LIMIT_PASSWORD_RECOVERY_PER_ACCOUNT: str = "3/hour"
+    RATE_LIMIT_PASSWORD_CHANGE_PER_USER: str = "5/minute"
 
     @computed_field  # type: ignore[prop-decorator]
     @property
@@ -85,6 +157,32 @@ class Settings(BaseSettings):
         return self
 
     EMAIL_RESET_TOKEN_EXPIRE_HOURS: int = 48
+    # Emails are queued and sent in the background, see app.outbox. Each
+    # sender keeps an SMTP connection open while it has emails to send.
+    EMAIL_SENDERS: int = 2
+    EMAIL_OUTBOX_SIZE: int = 1000
+    EMAIL_BATCH_SIZE: int = 20
+    EMAIL_MAX_ATTEMPTS: int = 5
+    EMAIL_RETRY_BACKOFF_SECONDS: float = 2.0
+    EMAIL_SMTP_IDLE_SECONDS: float = 30.0
+    # How long shutdown waits for the queued emails to be sent
+    EMAIL_OUTBOX_DRAIN_SECONDS: float = 10.0
+
+    # Processes per worker that hash and verify passwords, 0 to use the
+    # threadpool instead
+    PASSWORD_HASH_WORKERS: int = 2
+    # Calls that may wait for a free process, beyond that they are rejected
+    PASSWORD_HASH_QUEUE_SIZE: int = 32
+    # Scheme and cost of new password hashes, pick the cost with
+    # `python -m app.calibrate_password_hash`. argon2 needs the argon2 extra.
+    # On login, hashes made with the other scheme or another cost are
+    # rehashed with these.
+    PASSWORD_HASH_SCHEME: Literal["bcrypt", "argon2"] = "bcrypt"
+    PASSWORD_BCRYPT_ROUNDS: int = 12
+    PASSWORD_ARGON2_TIME_COST: int = 3
+    # KiB
+    PASSWORD_ARGON2_MEMORY_COST: int = 65536
+    PASSWORD_ARGON2_PARALLELISM: int = 1
 
     @computed_field  # type: ignore[prop-decorator]
     @property
@@ -1,10 +1,246 @@
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any
+
+from sqlalchemy import Connection, Engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import (
+    AsyncAdaptedQueuePool,
+    NullPool,
+    Pool,
+    PoolProxiedConnection,
+    QueuePool,
+)
 from sqlmodel import Session, create_engine, select
 
 from app import crud
+from app.core import metrics
 from app.core.config import settings
-from app.models import User, UserCreate
+from app.models import DbPoolStatus, User, UserCreate
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PoolCheckoutStats:
+    checked_out: int = 0
+    checkouts: int = 0
+    timeouts: int = 0
+    wait_seconds_total: float = 0.0
+    wait_seconds_max: float = 0.0
+
+
+# Keyed by the pool logging name, which survives the pool being recreated
+pool_checkout_stats: defaultdict[str, PoolCheckoutStats] = defaultdict(
+    PoolCheckoutStats
+)
+
+
+class _CheckoutTimer(Pool):
+    """Record how long each checkout waits for a connection."""
+
+    def connect(self) -> PoolProxiedConnection:
+        label = self.logging_name or "default"
+        stats = pool_checkout_stats[label]
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            stats.timeouts += 1
+            metrics.DB_POOL_CHECKOUT_TIMEOUTS.labels(label).inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            stats.checkouts += 1
+            stats.wait_seconds_total += elapsed
+            stats.wait_seconds_max = max(stats.wait_seconds_max, elapsed)
+            metrics.DB_POOL_CHECKOUT_SECONDS.labels(label).observe(elapsed)
+
+
+class TimedQueuePool(_CheckoutTimer, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_CheckoutTimer, AsyncAdaptedQueuePool):
+    pass
+
+
+class TimedNullPool(_CheckoutTimer, NullPool):
+    pass
+
+
+def engine_options(*, name: str, is_async: bool = False) -> dict[str, Any]:
+    options: dict[str, Any] = {"pool_logging_name": name}
+    if settings.POSTGRES_PGBOUNCER:
+        # PgBouncer hands each transaction to any server connection, so keep
+        # no connections here and don't use server-side prepared statements
+        options["poolclass"] = TimedNullPool
+        options["connect_args"] = {"prepare_threshold": None}
+        return options
+    options["poolclass"] = TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool
+    options["pool_size"] = settings.POSTGRES_POOL_SIZE
+    options["max_overflow"] = settings.POSTGRES_MAX_OVERFLOW
+    options["pool_timeout"] = settings.POSTGRES_POOL_TIMEOUT
+    options["pool_recycle"] = settings.POSTGRES_POOL_RECYCLE
+    options["pool_pre_ping"] = settings.POSTGRES_POOL_PRE_PING
+    return options
+
+
+def instrument_pool(engine: Engine) -> None:
+    label = engine.pool.logging_name or "default"
+    stats = pool_checkout_stats[label]
+
+    def update_gauges() -> None:
+        pool = engine.pool
+        metrics.DB_POOL_CHECKED_OUT.labels(label).set(stats.checked_out)
+        if isinstance(pool, QueuePool):
+            metrics.DB_POOL_IDLE.labels(label).set(pool.checkedin())
+            metrics.DB_POOL_OVERFLOW.labels(label).set(max(pool.overflow(), 0))
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(*_args: Any) -> None:
+        stats.checked_out += 1
+        update_gauges()
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(*_args: Any) -> None:
+        stats.checked_out -= 1
+        update_gauges()
+
+
+@dataclass
+class QueryStats:
+    """
+    The statements run while handling a request, see app.api.middleware.
+    """
+
+    count: int = 0
+    seconds: float = 0.0
+    slowest_seconds: float = 0.0
+    slowest_statement: str | None = None
+    statements: Counter[str] = field(default_factory=Counter)
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+        if seconds > self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        """
+        The statements run at least threshold times, likely N+1 queries.
+        """
+        return [
+            (statement, count)
+            for statement, count in self.statements.items()
+            if count >= threshold
+        ]
+
+
+# Set by the middleware for the request being handled
+query_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+def _log_plan(
+    conn: Connection, statement: str, parameters: Any, seconds: float
+) -> None:
+    if statement.lstrip()[:6].upper() not in ("SELECT", "UPDATE", "DELETE"):
+        return
+    # On the DBAPI connection, so that it doesn't go through these events.
+    # In a transaction, within a savepoint, so that an EXPLAIN failing
+    # doesn't abort the transaction of the statement.
+    driver_connection = conn.connection.driver_connection
+    savepoint = driver_connection is not None and not driver_connection.autocommit
+    cursor = conn.connection.cursor()
+    try:
+        if savepoint:
+            cursor.execute("SAVEPOINT log_plan")
+        try:
+            cursor.execute(f"EXPLAIN {statement}", parameters)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        except Exception:
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT log_plan")
+            logger.warning("Could not get the plan of a slow statement", exc_info=True)
+            return
+        if savepoint:
+            cursor.execute("RELEASE SAVEPOINT log_plan")
+    finally:
+        cursor.close()
+    logger.warning(f"Slow statement, {seconds * 1000:.0f} ms:\n{statement}\n{plan}")
+
+
+def instrument_statements(engine: Engine) -> None:
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(
+        _conn: Connection,
+        _cursor: Any,
+        _statement: str,
+        _parameters: Any,
+        context: Any,
+        _executemany: bool,
+    ) -> None:
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(
+        conn: Connection,
+        _cursor: Any,
+        statement: str,
+        parameters: Any,
+        context: Any,
+        executemany: bool,
+    ) -> None:
+        seconds = time.perf_counter() - context._query_start
+        stats = query_stats.get()
+        if stats is not None:
+            stats.record(statement, seconds)
+        slow = settings.SQL_SLOW_STATEMENT_SECONDS
+        if slow and seconds >= slow and not executemany:
+            _log_plan(conn, statement, parameters, seconds)
+
+
+def get_pool_status(engine: Engine) -> DbPoolStatus:
+    pool = engine.pool
+    stats = pool_checkout_stats[pool.logging_name or "default"]
+    status = DbPoolStatus(
+        pid=os.getpid(),
+        pool_class=type(pool).__name__,
+        checked_out=stats.checked_out,
+        idle=0,
+        overflow=0,
+        checkouts=stats.checkouts,
+        checkout_timeouts=stats.timeouts,
+        checkout_wait_seconds_total=stats.wait_seconds_total,
+        checkout_wait_seconds_max=stats.wait_seconds_max,
+    )
+    if isinstance(pool, QueuePool):
+        status.pool_size = pool.size()
+        status.max_overflow = pool._max_overflow
+        status.idle = pool.checkedin()
+        status.overflow = max(pool.overflow(), 0)
+    return status
+
 
-engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
+engine = create_engine(
+    str(settings.SQLALCHEMY_DATABASE_URI), **engine_options(name="sync")
+)
+# Used by the API request handlers, the sync engine above is kept for scripts,
+# migrations and tests. SQLAlchemy picks the async psycopg dialect for the same URL.
+async_engine = create_async_engine(
+    str(settings.SQLALCHEMY_DATABASE_URI), **engine_options(name="async", is_async=True)
+)
+instrument_pool(engine)
+instrument_pool(async_engine.sync_engine)
+instrument_statements(engine)
+instrument_statements(async_engine.sync_engine)
 
 
 # make sure all SQLModel models are imported (app.models) before initializing DB
@@ -0,0 +1,204 @@
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# With several worker processes, set PROMETHEUS_MULTIPROC_DIR to an empty
+# directory before starting them, each process writes its values there and
+# the /metrics of any of them reports the values of all of them
+if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """
+    The metrics in the Prometheus text format, and its content type.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)  # type: ignore[no-untyped-call]
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead() -> None:
+    """
+    Drop the live gauges of this process, when it exits.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())  # type: ignore[no-untyped-call]
+
+
+# HTTP requests, labelled by the unique id of the route, see
+# app.main.custom_generate_unique_id, or "unmatched"
+HTTP_REQUESTS = Counter(
+    "http_requests",
+    "HTTP requests handled",
+    ["route", "method", "status"],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds",
+    "Time to handle an HTTP request, until the response is sent",
+    ["route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "HTTP requests being handled",
+    multiprocess_mode="livesum",
+)
+
+# Database connection pool, labelled by engine. The gauges are per worker
+# process, "liveall" keeps the pid label when aggregating across workers
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections",
+    "Connections currently checked out from the pool",
+    ["engine"],
+    multiprocess_mode="liveall",
+)
+DB_POOL_IDLE = Gauge(
+    "db_pool_idle_connections",
+    "Connections idle in the pool",
+    ["engine"],
+    multiprocess_mode="liveall",
+)
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow_connections",
+    "Connections opened above the pool size",
+    ["engine"],
+    multiprocess_mode="liveall",
+)
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds",
+    "Time spent waiting for a connection from the pool",
+    ["engine"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+DB_POOL_CHECKOUT_TIMEOUTS = Counter(
+    "db_pool_checkout_timeouts",
+    "Checkouts that gave up waiting for a connection",
+    ["engine"],
+)
+
+# Admission control of the requests using the database, see app.core.admission
+DB_ADMISSION_ACTIVE = Gauge(
+    "db_admission_active_requests",
+    "Requests admitted to use the database",
+    multiprocess_mode="livesum",
+)
+DB_ADMISSION_QUEUE_DEPTH = Gauge(
+    "db_admission_queue_depth",
+    "Requests waiting to be admitted to use the database",
+    multiprocess_mode="livesum",
+)
+DB_ADMISSION_WAIT_SECONDS = Histogram(
+    "db_admission_wait_seconds",
+    "Time a request waited to be admitted to use the database",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_ADMISSION_REJECTED = Counter(
+    "db_admission_rejected",
+    "Requests rejected because the admission queue was full or the wait timed out",
+    ["reason"],
+)
+
+# Read replicas, see app.core.replicas
+DB_REPLICA_HEALTHY = Gauge(
+    "db_replica_healthy",
+    "Whether the replica is read from, 1 when its lag is within the limit",
+    ["replica"],
+    multiprocess_mode="liveall",
+)
+DB_REPLICA_LAG_SECONDS = Gauge(
+    "db_replica_lag_seconds",
+    "How far behind the primary the replica was at its last check",
+    ["replica"],
+    multiprocess_mode="liveall",
+)
+DB_SESSIONS = Counter(
+    "db_sessions",
+    "Request sessions opened, by the database they use",
+    ["database"],
+)
+
+# Statements run per HTTP request, see app.core.db.QueryStats
+DB_STATEMENTS_PER_REQUEST = Histogram(
+    "db_statements_per_request",
+    "Database statements run while handling an HTTP request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250),
+)
+DB_SECONDS_PER_REQUEST = Histogram(
+    "db_seconds_per_request",
+    "Time spent in database statements while handling an HTTP request",
+    ["route"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_REPEATED_STATEMENTS = Counter(
+    "db_repeated_statements",
+    "Statements run repeatedly in one HTTP request, likely N+1 queries",
+    ["route"],
+)
+
+# Password hashing, see app.core.security
+PASSWORD_HASH_QUEUE_DEPTH = Gauge(
+    "password_hash_queue_depth",
+    "Password hash and verify calls running or waiting for a process",
+    multiprocess_mode="livesum",
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    "password_hash_seconds",
+    "Time to hash or verify a password, including the wait for a process",
+    ["operation"],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 2.5, 5, 10),
+)
+PASSWORD_HASH_REJECTED = Counter(
+    "password_hash_rejected",
+    "Password hash and verify calls rejected because the queue was full",
+    ["operation"],
+)
+PASSWORD_REHASHES = Counter(
+    "password_rehashes",
+    "Password hashes replaced on login, made with another scheme or cost",
+)
+
+# Rate limits, see app.core.ratelimit
+RATE_LIMITED = Counter(
+    "rate_limited",
+    "Requests rejected because their token bucket was empty",
+    ["bucket"],
+)
+
+# In-process caches, see app.core.cache
+CACHE_HITS = Counter("cache_hits", "Cache lookups that found an entry", ["cache"])
+CACHE_MISSES = Counter(
+    "cache_misses", "Cache lookups that found no live entry", ["cache"]
+)
+
+# Email outbox, see app.outbox
+EMAIL_OUTBOX_DEPTH = Gauge(
+    "email_outbox_depth",
+    "Emails queued and not yet sent",
+    multiprocess_mode="livesum",
+)
+EMAIL_SEND_SECONDS = Histogram(
+    "email_send_seconds",
+    "Time to send an email over an SMTP connection, connecting included",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+EMAIL_SEND_FAILURES = Counter(
+    "email_send_failures",
+    "Email sends that failed, outcome is retried or dropped",
+    ["outcome"],
+)
+EMAIL_OUTBOX_REJECTED = Counter(
+    "email_outbox_rejected", "Emails rejected because the outbox was full"
+)
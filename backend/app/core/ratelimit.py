@@ -0,0 +1,228 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Any, Protocol
+
+import jwt
+from fastapi import Request
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.security import ALGORITHM
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when a request finds its token bucket empty.
+    """
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class Rate:
+    """
+    A bucket of capacity tokens, refilled with capacity tokens every period
+    seconds. Bursts of up to capacity requests go through at once.
+    """
+
+    capacity: int
+    period: float
+
+    @classmethod
+    def parse(cls, value: str) -> "Rate":
+        """
+        Parse a rate like "5/minute", "100/hour" or "10/30s".
+        """
+        match = re.fullmatch(r"\s*(\d+)\s*/\s*(?:(\d+)s|(\w+))\s*", value)
+        if not match or (match[3] and match[3] not in _PERIODS):
+            raise ValueError(f"Invalid rate: {value!r}")
+        period = int(match[2]) if match[2] else _PERIODS[match[3]]
+        return cls(capacity=int(match[1]), period=period)
+
+    @property
+    def per_second(self) -> float:
+        return self.capacity / self.period
+
+
+class RateLimitBackend(Protocol):
+    async def hit(self, key: str, rate: Rate) -> float:
+        """
+        Take a token from the bucket of the key. Returns 0 when there was one,
+        else the seconds until there is one.
+        """
+        ...
+
+
+class MemoryBackend:
+    """
+    Token buckets in the memory of the process, each worker process limits
+    on its own. The least recently used buckets are dropped beyond maxsize,
+    a dropped bucket starts full again.
+    """
+
+    def __init__(self, *, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def hit(self, key: str, rate: Rate) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (rate.capacity, now))
+            tokens = min(rate.capacity, tokens + (now - updated) * rate.per_second)
+            retry_after = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                retry_after = (1 - tokens) / rate.per_second
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+# Same bucket as MemoryBackend, updated atomically with the clock of Redis,
+# so that the workers don't have to agree on the time. The bucket expires
+# once it would be full again.
+_REDIS_HIT = """
+local capacity = tonumber(ARGV[1])
+local per_second = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * per_second)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / per_second
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / per_second * 1000))
+return tostring(retry_after)
+"""
+
+
+class RedisBackend:
+    """
+    Token buckets in Redis, shared by all the workers. Needs the redis extra.
+    """
+
+    def __init__(self, *, url: str, prefix: str = "ratelimit:") -> None:
+        from redis.asyncio import Redis  # type: ignore[import-not-found,unused-ignore]
+
+        self.prefix = prefix
+        self._redis = Redis.from_url(url)
+        self._hit = self._redis.register_script(_REDIS_HIT)
+
+    async def hit(self, key: str, rate: Rate) -> float:
+        retry_after = await self._hit(
+            keys=[self.prefix + key], args=[rate.capacity, rate.per_second]
+        )
+        return float(retry_after)
+
+
+def _create_backend() -> RateLimitBackend:
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        assert settings.RATE_LIMIT_REDIS_URL, "RATE_LIMIT_REDIS_URL is not set"
+        return RedisBackend(url=settings.RATE_LIMIT_REDIS_URL)
+    return MemoryBackend(maxsize=settings.RATE_LIMIT_MAX_BUCKETS)
+
+
+rate_limit_backend = _create_backend()
+
+
+# What a bucket is per: returns the key of the request, or None to not limit it
+KeyFunc = Callable[[Request], Awaitable[str | None]]
+
+
+async def client_ip(request: Request) -> str | None:
+    """
+    Per client IP. Behind a proxy, run the server so that it trusts the
+    forwarded headers of the proxy, see FORWARDED_ALLOW_IPS of uvicorn.
+    """
+    return request.client.host if request.client else None
+
+
+def form_field(name: str) -> KeyFunc:
+    """
+    Per value of a form field, like the username of a login.
+    """
+
+    async def key(request: Request) -> str | None:
+        # The form is parsed once, the route gets the same one
+        value = (await request.form()).get(name)
+        return value.lower() if isinstance(value, str) and value else None
+
+    return key
+
+
+def path_param(name: str) -> KeyFunc:
+    """
+    Per value of a path parameter.
+    """
+
+    async def key(request: Request) -> str | None:
+        value = request.path_params.get(name)
+        return str(value).lower() if value else None
+
+    return key
+
+
+async def token_subject(request: Request) -> str | None:
+    """
+    Per authenticated user, from the subject of the access token. The token
+    is only decoded here, a request with an invalid one is rejected later.
+    """
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload: dict[str, Any] = jwt.decode(
+            token, settings.SECRET_KEY, algorithms=[ALGORITHM]
+        )
+    except jwt.InvalidTokenError:
+        return None
+    subject = payload.get("sub")
+    return str(subject) if subject else None
+
+
+class RateLimit:
+    """
+    Route dependency taking a token from the bucket of the request, and
+    raising RateLimitExceeded when it's empty. As a dependency of the route
+    decorator it runs before the other dependencies and the route, so a
+    rejected request doesn't get to the database or to password hashing.
+
+    The rate is read from the named setting on each request, the name is
+    also the bucket name in metrics.
+    """
+
+    def __init__(self, setting: str, key: KeyFunc) -> None:
+        # Fail on import rather than on the first request
+        Rate.parse(getattr(settings, setting))
+        self.setting = setting
+        self.key = key
+
+    async def __call__(self, request: Request) -> None:
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+        key = await self.key(request)
+        if key is None:
+            return
+        rate = Rate.parse(getattr(settings, self.setting))
+        retry_after = await rate_limit_backend.hit(f"{self.setting}:{key}", rate)
+        if retry_after > 0:
+            metrics.RATE_LIMITED.labels(self.setting).inc()
+            raise RateLimitExceeded(retry_after)
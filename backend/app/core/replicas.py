@@ -0,0 +1,207 @@
+import asyncio
+import hashlib
+import hmac
+import itertools
+import logging
+import math
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from starlette.requests import Request
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.db import engine_options, instrument_pool, instrument_statements
+
+logger = logging.getLogger(__name__)
+
+# Seconds the replica is behind the primary, 0 when it replayed all it received,
+# as there is nothing to replay while the primary has no writes. NULL when it
+# isn't streaming from the primary, it could be any way behind then. Seeing
+# the status of the WAL receiver takes the pg_read_all_stats role.
+_LAG_QUERY = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (
+            SELECT FROM pg_stat_wal_receiver WHERE status = 'streaming'
+        ) THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+    END
+    """
+)
+
+
+@dataclass(eq=False)
+class Replica:
+    name: str
+    engine: AsyncEngine
+    healthy: bool = False
+    lag_seconds: float | None = None
+
+
+class ReplicaSet:
+    """
+    Read replicas of the primary database, see app.api.deps.get_db.
+
+    A background task checks the lag of each replica every check_interval
+    seconds. A replica is read from only while its last check succeeded
+    with a lag of at most max_lag seconds, so until the first check all the
+    reads go to the primary.
+    """
+
+    def __init__(
+        self, replicas: list[Replica], *, max_lag: float, check_interval: float
+    ):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._next = itertools.count()
+        self._task: asyncio.Task[None] | None = None
+
+    @classmethod
+    def from_urls(
+        cls, urls: list[str], *, max_lag: float, check_interval: float
+    ) -> "ReplicaSet":
+        replicas = []
+        for i, url in enumerate(urls):
+            name = f"replica-{i}"
+            engine = create_async_engine(
+                url, **engine_options(name=name, is_async=True)
+            )
+            instrument_pool(engine.sync_engine)
+            instrument_statements(engine.sync_engine)
+            replicas.append(Replica(name=name, engine=engine))
+        return cls(replicas, max_lag=max_lag, check_interval=check_interval)
+
+    def choose(self) -> AsyncEngine | None:
+        """
+        The engine of the next healthy replica, round robin, or None when
+        there is none.
+        """
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._next) % len(healthy)].engine
+
+    async def _lag(self, replica: Replica) -> float:
+        async with replica.engine.connect() as conn:
+            lag = await conn.scalar(_LAG_QUERY)
+        if lag is None:
+            raise RuntimeError("Lag unknown, not streaming from the primary")
+        return float(lag)
+
+    async def _check_replica(self, replica: Replica) -> None:
+        try:
+            lag = await asyncio.wait_for(self._lag(replica), self.check_interval)
+        except Exception as e:
+            lag = None
+            if replica.healthy:
+                logger.warning(f"Replica {replica.name} out of rotation: {e!r}")
+        replica.lag_seconds = lag
+        healthy = (
+            replica.lag_seconds is not None and replica.lag_seconds <= self.max_lag
+        )
+        if replica.healthy and not healthy and replica.lag_seconds is not None:
+            logger.warning(
+                f"Replica {replica.name} out of rotation, "
+                f"{replica.lag_seconds:.1f} s behind"
+            )
+        elif healthy and not replica.healthy:
+            logger.info(f"Replica {replica.name} in rotation")
+        replica.healthy = healthy
+        metrics.DB_REPLICA_HEALTHY.labels(replica.name).set(healthy)
+        if replica.lag_seconds is not None:
+            metrics.DB_REPLICA_LAG_SECONDS.labels(replica.name).set(replica.lag_seconds)
+
+    async def check(self) -> None:
+        """
+        Check the lag of all the replicas, updating which ones are read from.
+        """
+        await asyncio.gather(
+            *(self._check_replica(replica) for replica in self.replicas)
+        )
+
+    async def _run(self) -> None:
+        while True:
+            await self.check()
+            await asyncio.sleep(self.check_interval)
+
+    def start(self) -> None:
+        """
+        Start the lag checks on the running event loop, if there are replicas.
+        """
+        if self.replicas and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for replica in self.replicas:
+            replica.healthy = False
+            # Async connections are bound to the event loop that opened them
+            await replica.engine.dispose()
+
+
+replicas = ReplicaSet.from_urls(
+    [str(url) for url in settings.POSTGRES_REPLICA_URLS],
+    max_lag=settings.POSTGRES_REPLICA_MAX_LAG_SECONDS,
+    check_interval=settings.POSTGRES_REPLICA_CHECK_SECONDS,
+)
+
+# Set on the responses to the writes and logins of a user, so that their
+# reads go to the primary for POSTGRES_READ_YOUR_WRITES_SECONDS and they see
+# their own changes, whichever worker or instance serves the reads. It holds
+# when the user wrote, signed along with their id.
+READ_YOUR_WRITES_COOKIE = "wrote_at"
+
+
+def _signature(subject: str, wrote_at: str) -> str:
+    message = f"read-your-writes:{subject}:{wrote_at}"
+    return hmac.new(
+        settings.SECRET_KEY.encode(), message.encode(), hashlib.sha256
+    ).hexdigest()
+
+
+def mark_wrote(request: Request, subject: str) -> None:
+    """
+    Have the response to the request set the read your writes cookie of the
+    user, see app.api.middleware.ReadYourWritesMiddleware.
+    """
+    request.state.wrote = subject
+
+
+def read_your_writes_cookie(subject: str) -> str:
+    """
+    The Set-Cookie header value for a user who just wrote.
+    """
+    wrote_at = f"{time.time():.3f}"
+    value = f"{wrote_at}.{_signature(subject, wrote_at)}"
+    max_age = math.ceil(settings.POSTGRES_READ_YOUR_WRITES_SECONDS)
+    cookie = (
+        f"{READ_YOUR_WRITES_COOKIE}={value}; Max-Age={max_age}; Path=/; "
+        "HttpOnly; SameSite=lax"
+    )
+    return cookie if settings.ENVIRONMENT == "local" else f"{cookie}; Secure"
+
+
+def wrote_recently(subject: str, cookie: str | None) -> bool:
+    """
+    Whether the read your writes cookie was set for the user less than
+    POSTGRES_READ_YOUR_WRITES_SECONDS ago.
+    """
+    if not cookie:
+        return False
+    wrote_at, _, signature = cookie.rpartition(".")
+    try:
+        age = time.time() - float(wrote_at)
+    except ValueError:
+        return False
+    if not 0 <= age <= settings.POSTGRES_READ_YOUR_WRITES_SECONDS:
+        return False
+    return hmac.compare_digest(signature, _signature(subject, wrote_at))
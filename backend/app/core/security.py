@@ -1,27 +1,244 @@
+import asyncio
+import hashlib
+import multiprocessing
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta, timezone
-from typing import Any
+from typing import Any, TypeVar
 
 import jwt
+from fastapi.concurrency import run_in_threadpool
 from passlib.context import CryptContext
 
+from app.core import metrics
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Both schemes verify, new hashes use the configured one. A hash of the other
+# scheme, or of this one with another cost, needs an update.
+pwd_context = CryptContext(
+    schemes=["bcrypt", "argon2"],
+    default=settings.PASSWORD_HASH_SCHEME,
+    deprecated="auto",
+    bcrypt__default_rounds=settings.PASSWORD_BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.PASSWORD_BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.PASSWORD_BCRYPT_ROUNDS,
+    argon2__default_rounds=settings.PASSWORD_ARGON2_TIME_COST,
+    argon2__min_rounds=settings.PASSWORD_ARGON2_TIME_COST,
+    argon2__max_rounds=settings.PASSWORD_ARGON2_TIME_COST,
+    argon2__memory_cost=settings.PASSWORD_ARGON2_MEMORY_COST,
+    argon2__parallelism=settings.PASSWORD_ARGON2_PARALLELISM,
+)
+
+# Below this bcrypt is too cheap to hash passwords, whatever the hardware
+MIN_BCRYPT_ROUNDS = 10
 
 
 ALGORITHM = "HS256"
 
+T = TypeVar("T")
+
+
+class PasswordHashQueueFull(Exception):
+    """
+    Raised when too many password hash or verify calls are already queued.
+    """
 
-def create_access_token(subject: str | Any, expires_delta: timedelta) -> str:
+
+def create_access_token(
+    subject: str | Any,
+    expires_delta: timedelta,
+    claims: dict[str, Any] | None = None,
+) -> str:
     expire = datetime.now(timezone.utc) + expires_delta
-    to_encode = {"exp": expire, "sub": str(subject)}
+    to_encode = {**(claims or {}), "exp": expire, "sub": str(subject)}
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def password_fingerprint(hashed_password: str) -> str:
+    """
+    Short digest of a password hash, put in refresh tokens so that they stop
+    working when the password changes.
+    """
+    return hashlib.sha256(hashed_password.encode()).hexdigest()[:16]
+
+
+def create_refresh_token(
+    subject: str | Any, hashed_password: str, expires_delta: timedelta
+) -> str:
+    return create_access_token(
+        subject,
+        expires_delta,
+        claims={"type": "refresh", "pwd": password_fingerprint(hashed_password)},
+    )
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def verify_and_update_password(
+    plain_password: str, hashed_password: str
+) -> tuple[bool, str | None]:
+    """
+    Verify a password, and when its hash needs an update, hash it again with
+    the current scheme and cost. Returns whether it matches and the new hash,
+    if any.
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+
+def get_password_hashes(passwords: list[str]) -> list[str]:
+    return [pwd_context.hash(password) for password in passwords]
+
+
+# bcrypt keeps a CPU busy for each call, in the request worker that would stall
+# every other request on it. The async versions below run the calls on a pool
+# of processes, at most PASSWORD_HASH_QUEUE_SIZE calls wait for a free one.
+
+_hash_pool: ProcessPoolExecutor | None = None
+# Passwords hashed per call by get_password_hashes_async
+HASH_MANY_CHUNK_SIZE = 2
+_hash_pending = 0
+
+
+def start_hash_pool() -> None:
+    global _hash_pool
+    if _hash_pool is None and settings.PASSWORD_HASH_WORKERS > 0:
+        # Spawn instead of forking the worker with its event loop and threads
+        _hash_pool = ProcessPoolExecutor(
+            max_workers=settings.PASSWORD_HASH_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+
+def shutdown_hash_pool() -> None:
+    global _hash_pool
+    if _hash_pool is not None:
+        _hash_pool.shutdown(cancel_futures=True)
+        _hash_pool = None
+
+
+async def _run_hash_call(operation: str, func: Callable[..., T], *args: Any) -> T:
+    global _hash_pending
+    capacity = max(settings.PASSWORD_HASH_WORKERS, 1)
+    if _hash_pending >= capacity + settings.PASSWORD_HASH_QUEUE_SIZE:
+        metrics.PASSWORD_HASH_REJECTED.labels(operation).inc()
+        raise PasswordHashQueueFull(operation)
+    start_hash_pool()
+    _hash_pending += 1
+    metrics.PASSWORD_HASH_QUEUE_DEPTH.set(_hash_pending)
+    start = time.perf_counter()
+    try:
+        if _hash_pool is None:
+            return await run_in_threadpool(func, *args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_pool, func, *args)
+    except BrokenProcessPool:
+        # A process died, start a new pool for the next calls
+        shutdown_hash_pool()
+        raise
+    finally:
+        _hash_pending -= 1
+        metrics.PASSWORD_HASH_QUEUE_DEPTH.set(_hash_pending)
+        metrics.PASSWORD_HASH_SECONDS.labels(operation).observe(
+            time.perf_counter() - start
+        )
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_hash_call(
+        "verify", verify_password, plain_password, hashed_password
+    )
+
+
+async def verify_and_update_password_async(
+    plain_password: str, hashed_password: str
+) -> tuple[bool, str | None]:
+    return await _run_hash_call(
+        "verify", verify_and_update_password, plain_password, hashed_password
+    )
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_hash_call("hash", get_password_hash, password)
+
+
+async def get_password_hashes_async(passwords: list[str]) -> list[str]:
+    """
+    Hash many passwords, for bulk imports. They are hashed a few per call,
+    on all the processes of the pool but one, so that a login meanwhile waits
+    for a call of a few hashes at most rather than for the whole list.
+    """
+    chunks = [
+        passwords[i : i + HASH_MANY_CHUNK_SIZE]
+        for i in range(0, len(passwords), HASH_MANY_CHUNK_SIZE)
+    ]
+    hashed: list[list[str]] = [[] for _ in chunks]
+    # Shared by the tasks below, each takes the next chunk when it's done
+    indexes = iter(range(len(chunks)))
+
+    async def hash_chunks() -> None:
+        for i in indexes:
+            hashed[i] = await _run_hash_call(
+                "hash_many", get_password_hashes, chunks[i]
+            )
+
+    concurrency = max(settings.PASSWORD_HASH_WORKERS - 1, 1)
+    await asyncio.gather(*(hash_chunks() for _ in range(concurrency)))
+    return [password for chunk in hashed for password in chunk]
+
+
+def _verify_seconds(handler: Any, repeat: int = 3) -> float:
+    hashed = handler.hash("calibration")
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        handler.verify("calibration", hashed)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def calibrate_bcrypt_rounds(target_seconds: float) -> tuple[int, float]:
+    """
+    The highest bcrypt rounds whose verify takes at most target_seconds on
+    this machine, but no less than MIN_BCRYPT_ROUNDS, with its verify time.
+    """
+    bcrypt = pwd_context.handler("bcrypt")
+    rounds, seconds = (
+        MIN_BCRYPT_ROUNDS,
+        _verify_seconds(bcrypt.using(rounds=MIN_BCRYPT_ROUNDS)),
+    )
+    # Each round doubles the time
+    while rounds < bcrypt.max_rounds:
+        next_seconds = _verify_seconds(bcrypt.using(rounds=rounds + 1))
+        if next_seconds > target_seconds:
+            break
+        rounds, seconds = rounds + 1, next_seconds
+    return rounds, seconds
+
+
+def calibrate_argon2_time_cost(
+    target_seconds: float, memory_cost: int, parallelism: int
+) -> tuple[int, float]:
+    """
+    The highest argon2 time cost whose verify takes at most target_seconds on
+    this machine with the given memory cost and parallelism, but at least 1,
+    with its verify time.
+    """
+    argon2 = pwd_context.handler("argon2").using(
+        memory_cost=memory_cost, parallelism=parallelism
+    )
+    time_cost, seconds = 1, _verify_seconds(argon2.using(rounds=1))
+    while True:
+        next_seconds = _verify_seconds(argon2.using(rounds=time_cost + 1))
+        if next_seconds > target_seconds:
+            break
+        time_cost, seconds = time_cost + 1, next_seconds
+    return time_cost, seconds
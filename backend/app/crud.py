@@ -1,9 +1,20 @@
 import uuid
+from collections import Counter
 from typing import Any
 
-from sqlmodel import Session, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql.dml import Update
+from sqlmodel import Session, col, delete, func, select, text, update
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.core.security import get_password_hash, verify_password
+from app.core import metrics
+from app.core.cache import user_cache
+from app.core.security import (
+    get_password_hash,
+    get_password_hash_async,
+    verify_and_update_password,
+    verify_and_update_password_async,
+)
 from app.models import Item, ItemCreate, User, UserCreate, UserUpdate
 
 
@@ -27,6 +38,7 @@ def update_user(*, session: Session, db_user: User, user_in: UserUpdate) -> Any:
     db_user.sqlmodel_update(user_data, update=extra_data)
     session.add(db_user)
     session.commit()
+    user_cache.invalidate(str(db_user.id))
     session.refresh(db_user)
     return db_user
 
@@ -37,18 +49,251 @@ def get_user_by_email(*, session: Session, email: str) -> User | None:
     return session_user
 
 
+def _rehash(db_user: User, new_hash: str) -> None:
+    """
+    Replace a hash made with another scheme or cost, found on login. This
+    also ends the refresh tokens of the user, see password_fingerprint.
+    """
+    db_user.hashed_password = new_hash
+    metrics.PASSWORD_REHASHES.inc()
+
+
 def authenticate(*, session: Session, email: str, password: str) -> User | None:
     db_user = get_user_by_email(session=session, email=email)
     if not db_user:
         return None
-    if not verify_password(password, db_user.hashed_password):
+    verified, new_hash = verify_and_update_password(password, db_user.hashed_password)
+    if not verified:
         return None
+    if new_hash:
+        _rehash(db_user, new_hash)
+        session.add(db_user)
+        session.commit()
+        user_cache.invalidate(str(db_user.id))
     return db_user
 
 
+class OwnerNotFound(Exception):
+    """
+    Raised when the owner of the items doesn't exist anymore. A stateless
+    access token keeps working for a while after its user is deleted.
+    """
+
+
+def update_item_count(owner_id: uuid.UUID, delta: int) -> Update:
+    """
+    Statement that keeps User.item_count in step with the items of the owner,
+    to be run in the same transaction that adds or removes them.
+    """
+    return (
+        update(User)
+        .where(col(User.id) == owner_id)
+        .values(item_count=col(User.item_count) + delta)
+    )
+
+
+# Planner's estimate of the rows in the item table, the sum over its
+# partitions each scaled to its current size as the planner does. NULL if a
+# partition with rows was never analyzed, or if they are all empty.
+ITEM_ROW_ESTIMATE = text(
+    """
+    SELECT CASE
+        WHEN bool_or((reltuples < 0 OR relpages = 0) AND pg_relation_size(oid) > 0)
+            OR sum(relpages) = 0
+        THEN NULL
+        ELSE sum(
+            CASE WHEN relpages = 0 THEN 0 ELSE
+                reltuples / relpages
+                * (pg_relation_size(oid) / current_setting('block_size')::float8)
+            END
+        )::bigint
+    END
+    FROM pg_class
+    WHERE oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'item'::regclass)
+    """
+)
+
+
 def create_item(*, session: Session, item_in: ItemCreate, owner_id: uuid.UUID) -> Item:
     db_item = Item.model_validate(item_in, update={"owner_id": owner_id})
     session.add(db_item)
+    session.exec(update_item_count(owner_id, 1))  # type: ignore
     session.commit()
     session.refresh(db_item)
     return db_item
+
+
+# Async versions of the functions above, used by the API request handlers
+
+
+async def async_create_user(*, session: AsyncSession, user_create: UserCreate) -> User:
+    hashed_password = await get_password_hash_async(user_create.password)
+    db_obj = User.model_validate(
+        user_create, update={"hashed_password": hashed_password}
+    )
+    session.add(db_obj)
+    await session.commit()
+    await session.refresh(db_obj)
+    return db_obj
+
+
+async def async_update_user(
+    *, session: AsyncSession, db_user: User, user_in: UserUpdate
+) -> Any:
+    user_data = user_in.model_dump(exclude_unset=True)
+    extra_data = {}
+    if "password" in user_data:
+        password = user_data["password"]
+        hashed_password = await get_password_hash_async(password)
+        extra_data["hashed_password"] = hashed_password
+    db_user.sqlmodel_update(user_data, update=extra_data)
+    session.add(db_user)
+    await session.commit()
+    user_cache.invalidate(str(db_user.id))
+    await session.refresh(db_user)
+    return db_user
+
+
+async def async_create_users(
+    *,
+    session: AsyncSession,
+    users_create: list[UserCreate],
+    hashed_passwords: list[str],
+) -> list[User]:
+    """
+    Insert users with already hashed passwords in one statement, returning
+    the ones created. A user whose email is taken by then is skipped.
+    """
+    db_users = [
+        User.model_validate(user_create, update={"hashed_password": hashed_password})
+        for user_create, hashed_password in zip(
+            users_create, hashed_passwords, strict=True
+        )
+    ]
+    if not db_users:
+        return []
+    statement = (
+        insert(User)
+        .values([db_user.model_dump() for db_user in db_users])
+        .on_conflict_do_nothing(index_elements=[User.email])
+        .returning(col(User.id))
+    )
+    created = set((await session.exec(statement)).scalars())  # type: ignore
+    await session.commit()
+    return [db_user for db_user in db_users if db_user.id in created]
+
+
+async def async_get_existing_emails(
+    *, session: AsyncSession, emails: list[str]
+) -> set[str]:
+    """
+    The emails of the list that belong to a user, in one query.
+    """
+    statement = select(User.email).where(col(User.email).in_(emails))
+    return set((await session.exec(statement)).all())
+
+
+async def async_get_user_by_email(*, session: AsyncSession, email: str) -> User | None:
+    statement = select(User).where(User.email == email)
+    session_user = (await session.exec(statement)).first()
+    return session_user
+
+
+async def async_authenticate(
+    *, session: AsyncSession, email: str, password: str
+) -> User | None:
+    db_user = await async_get_user_by_email(session=session, email=email)
+    if not db_user:
+        return None
+    verified, new_hash = await verify_and_update_password_async(
+        password, db_user.hashed_password
+    )
+    if not verified:
+        return None
+    if new_hash:
+        _rehash(db_user, new_hash)
+        session.add(db_user)
+        await session.commit()
+        user_cache.invalidate(str(db_user.id))
+    return db_user
+
+
+async def _add_item_count(
+    session: AsyncSession, owner_id: uuid.UUID, delta: int
+) -> None:
+    # Before the items are added, the owner is found missing here rather than
+    # by the foreign key when they are flushed
+    result = await session.exec(update_item_count(owner_id, delta))  # type: ignore
+    if result.rowcount == 0:
+        await session.rollback()
+        raise OwnerNotFound()
+
+
+async def async_create_item(
+    *, session: AsyncSession, item_in: ItemCreate, owner_id: uuid.UUID
+) -> Item:
+    db_item = Item.model_validate(item_in, update={"owner_id": owner_id})
+    await _add_item_count(session, owner_id, 1)
+    session.add(db_item)
+    await session.commit()
+    await session.refresh(db_item)
+    return db_item
+
+
+async def _delete_items(session: AsyncSession, *whereclause: Any) -> None:
+    # The counts are lowered by the rows actually deleted, a concurrent
+    # delete of the same items may have deleted some of them already
+    statement = delete(Item).where(*whereclause).returning(col(Item.owner_id))
+    owner_ids = (await session.exec(statement)).scalars()  # type: ignore
+    for owner_id, count in Counter(owner_ids).items():
+        await session.exec(update_item_count(owner_id, -count))  # type: ignore
+    await session.commit()
+
+
+async def async_delete_item(*, session: AsyncSession, db_item: Item) -> None:
+    await _delete_items(
+        session, col(Item.id) == db_item.id, col(Item.owner_id) == db_item.owner_id
+    )
+
+
+async def async_create_items(
+    *, session: AsyncSession, items_in: list[ItemCreate], owner_id: uuid.UUID
+) -> list[Item]:
+    db_items = [
+        Item.model_validate(item_in, update={"owner_id": owner_id})
+        for item_in in items_in
+    ]
+    await _add_item_count(session, owner_id, len(db_items))
+    # The ids are generated here, so the flush sends the rows in multi-row
+    # INSERTs and nothing has to be read back
+    session.add_all(db_items)
+    await session.commit()
+    return db_items
+
+
+async def async_delete_items(*, session: AsyncSession, db_items: list[Item]) -> None:
+    ids = [db_item.id for db_item in db_items]
+    await _delete_items(session, col(Item.id).in_(ids))
+
+
+async def async_count_items(
+    *, session: AsyncSession, owner_id: uuid.UUID | None = None, exact: bool = True
+) -> int:
+    """
+    Count the items of an owner, or all items when owner_id is None.
+
+    Per owner it reads the maintained User.item_count. For all items, unless
+    exact is set, the planner's row estimate is used when there is one.
+    """
+    if owner_id is not None:
+        statement = select(User.item_count).where(User.id == owner_id)
+        count = (await session.exec(statement)).one_or_none()
+        if count is None:
+            raise OwnerNotFound()
+        return count
+    if not exact:
+        estimate = (await session.exec(ITEM_ROW_ESTIMATE)).scalar_one()  # type: ignore
+        if estimate is not None:
+            return int(estimate)
+    count_statement = select(func.count()).select_from(Item)
+    return (await session.exec(count_statement)).one()
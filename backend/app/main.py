@@ -1,10 +1,28 @@
-import sentry_sdk
-from fastapi import FastAPI
+import math
+import secrets
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi.routing import APIRoute
 from starlette.middleware.cors import CORSMiddleware
 
 from app.api.main import api_router
+from app.api.middleware import (
+    MetricsMiddleware,
+    QueryStatsMiddleware,
+    ReadYourWritesMiddleware,
+)
+from app.core import metrics, security
+from app.core.admission import AdmissionRejected
 from app.core.config import settings
+from app.core.db import async_engine
+from app.core.ratelimit import RateLimitExceeded
+from app.core.replicas import replicas
+from app.crud import OwnerNotFound
+from app.outbox import EmailOutboxFull, email_outbox
+from app.utils import preload_email_templates
 
 
 def custom_generate_unique_id(route: APIRoute) -> str:
@@ -12,14 +30,87 @@ def custom_generate_unique_id(route: APIRoute) -> str:
 
 
 if settings.SENTRY_DSN and settings.ENVIRONMENT != "local":
+    # Only imported when used, it's slow to import
+    import sentry_sdk
+
     sentry_sdk.init(dsn=str(settings.SENTRY_DSN), enable_tracing=True)
 
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    security.start_hash_pool()
+    if settings.emails_enabled:
+        preload_email_templates()
+    email_outbox.start()
+    replicas.start()
+    yield
+    await replicas.stop()
+    await email_outbox.stop(timeout=settings.EMAIL_OUTBOX_DRAIN_SECONDS)
+    security.shutdown_hash_pool()
+    metrics.mark_process_dead()
+    # Async connections are bound to the event loop that opened them
+    await async_engine.dispose()
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     generate_unique_id_function=custom_generate_unique_id,
+    lifespan=lifespan,
 )
 
+
+@app.exception_handler(security.PasswordHashQueueFull)
+async def password_hash_queue_full_handler(
+    _request: Request, _exc: security.PasswordHashQueueFull
+) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, try again later"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(
+    _request: Request, _exc: AdmissionRejected
+) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, try again later"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exceeded_handler(
+    _request: Request, exc: RateLimitExceeded
+) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many requests, try again later"},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+
+@app.exception_handler(OwnerNotFound)
+async def owner_not_found_handler(
+    _request: Request, _exc: OwnerNotFound
+) -> JSONResponse:
+    return JSONResponse(status_code=404, content={"detail": "User not found"})
+
+
+@app.exception_handler(EmailOutboxFull)
+async def email_outbox_full_handler(
+    _request: Request, _exc: EmailOutboxFull
+) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, try again later"},
+        headers={"Retry-After": "1"},
+    )
+
+
 # Set all CORS enabled origins
 if settings.all_cors_origins:
     app.add_middleware(
@@ -30,4 +121,27 @@ if settings.all_cors_origins:
         allow_headers=["*"],
     )
 
+app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(QueryStatsMiddleware)
+# Outermost, so that the time spent in the other middleware is counted
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
+
+
+@app.get("/metrics", tags=["metrics"], include_in_schema=False)
+def prometheus_metrics(request: Request) -> Response:
+    if settings.METRICS_TOKEN:
+        authorization = request.headers.get("Authorization", "")
+        if not secrets.compare_digest(
+            authorization.encode(), f"Bearer {settings.METRICS_TOKEN}".encode()
+        ):
+            raise HTTPException(
+                status_code=401,
+                detail="Not authenticated",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+    elif settings.ENVIRONMENT != "local":
+        raise HTTPException(status_code=404, detail="Not Found")
+    content, content_type = metrics.render_metrics()
+    return Response(content=content, media_type=content_type)
@@ -1,6 +1,8 @@
 import uuid
 
 from pydantic import EmailStr
+from sqlalchemy import Column, Computed, Index
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlmodel import Field, Relationship, SQLModel
 
 
@@ -43,6 +45,8 @@ class UpdatePassword(SQLModel):
 class User(UserBase, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     hashed_password: str
+    # Number of items owned, maintained by the crud item functions
+    item_count: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
     items: list["Item"] = Relationship(back_populates="owner", cascade_delete=True)
 
 
@@ -53,7 +57,22 @@ class UserPublic(UserBase):
 
 class UsersPublic(SQLModel):
     data: list[UserPublic]
-    count: int
+    # None when the count is not requested
+    count: int | None = None
+    next_cursor: str | None = None
+
+
+# A CSV row that was not imported
+class UserImportError(SQLModel):
+    # Line in the file, the header is line 1
+    line: int
+    email: str | None = None
+    detail: str
+
+
+class UserImportResults(SQLModel):
+    created: int
+    errors: list[UserImportError]
 
 
 # Shared properties
@@ -74,14 +93,50 @@ class ItemUpdate(ItemBase):
 
 # Database model, database table inferred from class name
 class Item(ItemBase, table=True):
+    __table_args__ = (
+        # Items of an owner in id order, the list and export order and the
+        # keyset pagination, covering so the list can be an index only scan.
+        # Also serves the owner_id foreign key for deletes of users.
+        Index(
+            "ix_item_owner_id_id",
+            "owner_id",
+            "id",
+            postgresql_include=["title", "description"],
+        ),
+        # All the items of an owner are in one partition, so the queries of
+        # an owner only read that one. The ITEM_PARTITIONS partitions are
+        # created by the migrations, see 5b7e2d9c4f18.
+        {"postgresql_partition_by": "HASH (owner_id)"},
+    )
+    # The primary key of a partitioned table has to include the partition
+    # key, the items are still identified by their id alone
+    __mapper_args__ = {"primary_key": ["id"]}
+
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     title: str = Field(max_length=255)
     owner_id: uuid.UUID = Field(
-        foreign_key="user.id", nullable=False, ondelete="CASCADE"
+        foreign_key="user.id", nullable=False, ondelete="CASCADE", primary_key=True
     )
     owner: User | None = Relationship(back_populates="items")
 
 
+# Full-text search document of an item, titles weigh more than descriptions.
+# Generated by the database and left out of the model, so that it's never
+# loaded or written with the items, only used by searches.
+ITEM_SEARCH_CONFIG = "english"
+item_search_vector = Column(
+    "search_vector",
+    TSVECTOR,
+    Computed(
+        f"setweight(to_tsvector('{ITEM_SEARCH_CONFIG}', title), 'A') || "
+        f"setweight(to_tsvector('{ITEM_SEARCH_CONFIG}', coalesce(description, '')), 'B')",
+        persisted=True,
+    ),
+)
+Item.__table__.append_column(item_search_vector)  # type: ignore[attr-defined]
+Index("ix_item_search_vector", item_search_vector, postgresql_using="gin")
+
+
 # Properties to return via API, id is always required
 class ItemPublic(ItemBase):
     id: uuid.UUID
@@ -90,7 +145,39 @@ class ItemPublic(ItemBase):
 
 class ItemsPublic(SQLModel):
     data: list[ItemPublic]
-    count: int
+    # None when the count is not requested
+    count: int | None = None
+    next_cursor: str | None = None
+
+
+# Batches of items to create, update or delete in one request
+class ItemsCreate(SQLModel):
+    data: list[ItemCreate]
+
+
+class ItemUpdateById(ItemUpdate):
+    id: uuid.UUID
+
+
+class ItemsUpdate(SQLModel):
+    data: list[ItemUpdateById]
+
+
+class ItemsDelete(SQLModel):
+    ids: list[uuid.UUID]
+
+
+# Outcome for one item of a batch, status_code is what the single item
+# endpoint would have answered
+class ItemBatchResult(SQLModel):
+    id: uuid.UUID
+    status_code: int = 200
+    detail: str | None = None
+    item: ItemPublic | None = None
+
+
+class ItemBatchResults(SQLModel):
+    data: list[ItemBatchResult]
 
 
 # Generic message
@@ -102,13 +189,39 @@ class Message(SQLModel):
 class Token(SQLModel):
     access_token: str
     token_type: str = "bearer"
+    refresh_token: str | None = None
 
 
 # Contents of JWT token
 class TokenPayload(SQLModel):
     sub: str | None = None
+    # "refresh" for refresh tokens
+    type: str | None = None
+    # Claims of stateless access tokens: is_superuser
+    su: bool | None = None
+    # Claims of refresh tokens: fingerprint of the password hash
+    pwd: str | None = None
+
+
+class TokenRefresh(SQLModel):
+    refresh_token: str
 
 
 class NewPassword(SQLModel):
     token: str
     new_password: str = Field(min_length=8, max_length=40)
+
+
+# Connection pool status of the worker process serving the request
+class DbPoolStatus(SQLModel):
+    pid: int
+    pool_class: str
+    pool_size: int | None = None
+    max_overflow: int | None = None
+    checked_out: int
+    idle: int
+    overflow: int
+    checkouts: int
+    checkout_timeouts: int
+    checkout_wait_seconds_total: float
+    checkout_wait_seconds_max: float
@@ -0,0 +1,245 @@
+import asyncio
+import contextlib
+import logging
+import smtplib
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core import metrics
+from app.core.config import settings
+from app.utils import build_email_message, get_smtp_options
+
+logger = logging.getLogger(__name__)
+
+
+class EmailOutboxFull(Exception):
+    """
+    Raised when the outbox already holds as many emails as it can.
+    """
+
+
+# Compared by identity, the same email can be queued twice
+@dataclass(eq=False)
+class OutgoingEmail:
+    email_to: str
+    subject: str
+    html_content: str
+    attempts: int = 0
+
+
+class EmailOutbox:
+    """
+    Queue of emails sent in the background, so that requests don't wait for
+    the mail server.
+
+    A few sender tasks drain the queue. Each keeps its own SMTP connection
+    open while there are emails to send, and closes it after idle_timeout
+    seconds without any. A sender takes up to batch_size emails at a time
+    and sends them on its connection from the threadpool. An email that
+    fails is queued again after a backoff doubling with each attempt, and
+    dropped after max_attempts.
+    """
+
+    def __init__(
+        self,
+        *,
+        senders: int,
+        maxsize: int,
+        batch_size: int,
+        max_attempts: int,
+        backoff: float,
+        idle_timeout: float,
+        smtp_options: Callable[[], dict[str, Any]] = get_smtp_options,
+    ) -> None:
+        self.senders = senders
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.smtp_options = smtp_options
+        self._queue: asyncio.Queue[OutgoingEmail] | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    def start(self) -> None:
+        """
+        Start the senders on the running event loop, if not started yet.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(self.maxsize)
+        self._tasks = set()
+        for _ in range(self.senders):
+            self._spawn(self._sender(self._queue))
+
+    async def stop(self, timeout: float = 0) -> None:
+        """
+        Wait up to timeout seconds for the queued emails, then stop the senders.
+        """
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"{self._queue.qsize()} queued emails not sent")
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._queue = None
+        self._loop = None
+        self._tasks = set()
+        metrics.EMAIL_OUTBOX_DEPTH.set(0)
+
+    async def join(self) -> None:
+        """
+        Wait until every queued email is sent or dropped.
+        """
+        if self._queue is not None:
+            await self._queue.join()
+
+    def enqueue(
+        self, *, email_to: str, subject: str = "", html_content: str = ""
+    ) -> None:
+        assert settings.emails_enabled, "no provided configuration for email variables"
+        self.start()
+        assert self._queue is not None
+        try:
+            self._queue.put_nowait(
+                OutgoingEmail(
+                    email_to=email_to, subject=subject, html_content=html_content
+                )
+            )
+        except asyncio.QueueFull:
+            metrics.EMAIL_OUTBOX_REJECTED.inc()
+            raise EmailOutboxFull(email_to)
+        metrics.EMAIL_OUTBOX_DEPTH.set(self._queue.qsize())
+
+    async def put(
+        self, *, email_to: str, subject: str = "", html_content: str = ""
+    ) -> None:
+        """
+        Queue an email, waiting for room when the outbox is full instead of
+        raising, for bulk jobs that can go at the pace of the senders.
+        """
+        assert settings.emails_enabled, "no provided configuration for email variables"
+        self.start()
+        assert self._queue is not None
+        await self._queue.put(
+            OutgoingEmail(email_to=email_to, subject=subject, html_content=html_content)
+        )
+        metrics.EMAIL_OUTBOX_DEPTH.set(self._queue.qsize())
+
+    def _spawn(self, coro: Any) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _sender(self, queue: asyncio.Queue[OutgoingEmail]) -> None:
+        backend: Any = None
+        try:
+            while True:
+                try:
+                    email = await asyncio.wait_for(queue.get(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    if backend is not None:
+                        await run_in_threadpool(_close, backend)
+                        backend = None
+                    continue
+                batch = [email]
+                while len(batch) < self.batch_size and not queue.empty():
+                    batch.append(queue.get_nowait())
+                metrics.EMAIL_OUTBOX_DEPTH.set(queue.qsize())
+                if backend is None:
+                    backend = _open_backend(self.smtp_options())
+                try:
+                    failed = await run_in_threadpool(_send_batch, backend, batch)
+                except BaseException:
+                    for _ in batch:
+                        queue.task_done()
+                    raise
+                for email in batch:
+                    if email in failed:
+                        # Marked done once it's queued again or dropped
+                        self._spawn(self._retry(queue, email))
+                    else:
+                        queue.task_done()
+        finally:
+            if backend is not None:
+                _close(backend)
+
+    async def _retry(
+        self, queue: asyncio.Queue[OutgoingEmail], email: OutgoingEmail
+    ) -> None:
+        try:
+            email.attempts += 1
+            if email.attempts >= self.max_attempts:
+                metrics.EMAIL_SEND_FAILURES.labels("dropped").inc()
+                logger.error(
+                    f"Dropping email to {email.email_to} after {email.attempts} attempts"
+                )
+                return
+            metrics.EMAIL_SEND_FAILURES.labels("retried").inc()
+            await asyncio.sleep(self.backoff * 2 ** (email.attempts - 1))
+            try:
+                queue.put_nowait(email)
+            except asyncio.QueueFull:
+                metrics.EMAIL_SEND_FAILURES.labels("dropped").inc()
+                logger.error(f"Dropping email to {email.email_to}, the outbox is full")
+        finally:
+            queue.task_done()
+
+
+def _open_backend(smtp_options: dict[str, Any]) -> Any:
+    # The email package is only imported with the first email, it's slow to
+    # import and most workers may never send one
+    from emails.backend.smtp import SMTPBackend  # type: ignore
+
+    return SMTPBackend(fail_silently=False, **smtp_options)
+
+
+def _close(backend: Any) -> None:
+    with contextlib.suppress(Exception):
+        backend.close()
+
+
+def _send_batch(backend: Any, batch: list[OutgoingEmail]) -> list[OutgoingEmail]:
+    """
+    Send emails on one SMTP connection, returning the ones to retry.
+    """
+    failed = []
+    for email in batch:
+        start = time.perf_counter()
+        try:
+            message = build_email_message(
+                subject=email.subject, html_content=email.html_content
+            )
+            message.send(to=email.email_to, smtp=backend)
+        except (smtplib.SMTPException, OSError):
+            logger.exception(f"Failed to send email to {email.email_to}")
+            # Start over with a new connection
+            _close(backend)
+            failed.append(email)
+        except Exception:
+            # Not something a retry would fix
+            metrics.EMAIL_SEND_FAILURES.labels("dropped").inc()
+            logger.exception(f"Dropping email to {email.email_to}")
+        else:
+            metrics.EMAIL_SEND_SECONDS.observe(time.perf_counter() - start)
+    return failed
+
+
+email_outbox = EmailOutbox(
+    senders=settings.EMAIL_SENDERS,
+    maxsize=settings.EMAIL_OUTBOX_SIZE,
+    batch_size=settings.EMAIL_BATCH_SIZE,
+    max_attempts=settings.EMAIL_MAX_ATTEMPTS,
+    backoff=settings.EMAIL_RETRY_BACKOFF_SECONDS,
+    idle_timeout=settings.EMAIL_SMTP_IDLE_SECONDS,
+)
@@ -1,10 +1,19 @@
+import csv
+import io
+import json
 import uuid
+from unittest.mock import patch
 
 from fastapi.testclient import TestClient
-from sqlmodel import Session
+from sqlmodel import Session, col, func, select
 
+from app import crud
+from app.core.admission import AdmissionGate
 from app.core.config import settings
+from app.models import Item, ItemCreate, ItemPublic, ItemsPublic, UserCreate
 from app.tests.utils.item import create_random_item
+from app.tests.utils.user import user_authentication_headers
+from app.tests.utils.utils import random_email, random_lower_string
 
 
 def test_create_item(
@@ -79,6 +88,225 @@ def test_read_items(
     assert len(content["data"]) >= 2
 
 
+def test_read_items_matches_response_models(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    item = create_random_item(db)
+    url = f"{settings.API_V1_STR}/items"
+    content = client.get(f"{url}/", headers=superuser_token_headers).json()
+    assert ItemsPublic.model_validate(content).model_dump(mode="json") == content
+    content = client.get(f"{url}/{item.id}", headers=superuser_token_headers).json()
+    assert content == ItemPublic.model_validate(item).model_dump(mode="json")
+
+
+def test_read_items_cursor_pagination(client: TestClient, db: Session) -> None:
+    password = random_lower_string()
+    user = crud.create_user(
+        session=db, user_create=UserCreate(email=random_email(), password=password)
+    )
+    item_ids = {
+        str(
+            crud.create_item(
+                session=db,
+                item_in=ItemCreate(title=random_lower_string()),
+                owner_id=user.id,
+            ).id
+        )
+        for _ in range(5)
+    }
+    headers = user_authentication_headers(
+        client=client, email=user.email, password=password
+    )
+
+    seen: list[str] = []
+    params: dict[str, str | int] = {"limit": 2}
+    for _ in range(3):
+        response = client.get(
+            f"{settings.API_V1_STR}/items/", headers=headers, params=params
+        )
+        assert response.status_code == 200
+        content = response.json()
+        assert content["count"] == 5
+        seen += [item["id"] for item in content["data"]]
+        if not content["next_cursor"]:
+            break
+        params = {"limit": 2, "cursor": content["next_cursor"]}
+    assert content["next_cursor"] is None
+    assert seen == sorted(item_ids)
+
+
+def test_read_items_count_follows_create_and_delete(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    def count() -> int:
+        response = client.get(
+            f"{settings.API_V1_STR}/items/", headers=normal_user_token_headers
+        )
+        return int(response.json()["count"])
+
+    before = count()
+    response = client.post(
+        f"{settings.API_V1_STR}/items/",
+        headers=normal_user_token_headers,
+        json={"title": "Counted"},
+    )
+    assert response.status_code == 200
+    assert count() == before + 1
+    response = client.delete(
+        f"{settings.API_V1_STR}/items/{response.json()['id']}",
+        headers=normal_user_token_headers,
+    )
+    assert response.status_code == 200
+    assert count() == before
+
+
+def test_search_items(client: TestClient, db: Session) -> None:
+    password = random_lower_string()
+    user = crud.create_user(
+        session=db, user_create=UserCreate(email=random_email(), password=password)
+    )
+    word = random_lower_string()
+    for title, description in [
+        (f"{word} in the title", None),
+        ("Other", f"{word} in the description"),
+        (f"{word} and {word}", f"{word} everywhere"),
+        ("Unrelated", "Nothing here"),
+    ]:
+        crud.create_item(
+            session=db,
+            item_in=ItemCreate(title=title, description=description),
+            owner_id=user.id,
+        )
+    # Matching, but not the user's
+    create_random_item(db, title=word)
+    headers = user_authentication_headers(
+        client=client, email=user.email, password=password
+    )
+
+    titles: list[str] = []
+    params: dict[str, str | int] = {"q": word, "limit": 1}
+    for _ in range(4):
+        response = client.get(
+            f"{settings.API_V1_STR}/items/search", headers=headers, params=params
+        )
+        assert response.status_code == 200
+        content = response.json()
+        assert content["count"] is None
+        titles += [item["title"] for item in content["data"]]
+        if not content["next_cursor"]:
+            break
+        params["cursor"] = content["next_cursor"]
+    assert titles == [f"{word} and {word}", f"{word} in the title", "Other"]
+
+    response = client.get(
+        f"{settings.API_V1_STR}/items/search",
+        headers=headers,
+        params={"q": f"{word} -description"},
+    )
+    assert {item["title"] for item in response.json()["data"]} == {
+        f"{word} and {word}",
+        f"{word} in the title",
+    }
+
+
+def test_search_items_superuser(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    word = random_lower_string()
+    item = create_random_item(db, title=word)
+    response = client.get(
+        f"{settings.API_V1_STR}/items/search",
+        headers=superuser_token_headers,
+        params={"q": word},
+    )
+    assert response.status_code == 200
+    assert [row["id"] for row in response.json()["data"]] == [str(item.id)]
+
+
+def test_search_items_max_candidates(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    word = random_lower_string()
+    for _ in range(5):
+        create_random_item(db, title=word)
+    url = f"{settings.API_V1_STR}/items/search"
+    with patch.object(settings, "SEARCH_MAX_CANDIDATES", 3):
+        response = client.get(
+            url, headers=superuser_token_headers, params={"q": word, "limit": 2}
+        )
+        assert response.status_code == 200
+        content = response.json()
+        assert len(content["data"]) == 2
+        # The next page could rank other candidates
+        assert content["next_cursor"] is None
+
+    # Under the cap the pages go through all the matches
+    ids: list[str] = []
+    params: dict[str, str | int] = {"q": word, "limit": 2}
+    with patch.object(settings, "SEARCH_MAX_CANDIDATES", 6):
+        for _ in range(5):
+            content = client.get(
+                url, headers=superuser_token_headers, params=params
+            ).json()
+            ids += [item["id"] for item in content["data"]]
+            if not content["next_cursor"]:
+                break
+            params["cursor"] = content["next_cursor"]
+    assert len(ids) == len(set(ids)) == 5
+
+
+def test_read_items_exact_count_superuser(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    create_random_item(db)
+    response = client.get(
+        f"{settings.API_V1_STR}/items/",
+        headers=superuser_token_headers,
+        params={"exact_count": True},
+    )
+    assert response.status_code == 200
+    total = db.exec(select(func.count()).select_from(Item)).one()
+    assert response.json()["count"] == total
+
+
+def test_read_items_without_count(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    create_random_item(db)
+    response = client.get(
+        f"{settings.API_V1_STR}/items/",
+        headers=superuser_token_headers,
+        params={"include_count": False, "limit": 1},
+    )
+    assert response.status_code == 200
+    content = response.json()
+    assert content["count"] is None
+    assert len(content["data"]) == 1
+
+
+def test_read_items_limit_too_large(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    response = client.get(
+        f"{settings.API_V1_STR}/items/",
+        headers=superuser_token_headers,
+        params={"limit": settings.MAX_PAGE_SIZE + 1},
+    )
+    assert response.status_code == 422
+
+
+def test_read_items_invalid_cursor(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    response = client.get(
+        f"{settings.API_V1_STR}/items/",
+        headers=superuser_token_headers,
+        params={"cursor": "not-a-cursor"},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
 def test_update_item(
     client: TestClient, superuser_token_headers: dict[str, str], db: Session
 ) -> None:
@@ -162,3 +390,241 @@ def test_delete_item_not_enough_permissions(
     assert response.status_code == 400
     content = response.json()
     assert content["detail"] == "Not enough permissions"
+
+
+def test_create_items_batch(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    def count() -> int:
+        response = client.get(
+            f"{settings.API_V1_STR}/items/", headers=normal_user_token_headers
+        )
+        return int(response.json()["count"])
+
+    before = count()
+    data = {"data": [{"title": f"Batch {i}"} for i in range(3)]}
+    response = client.post(
+        f"{settings.API_V1_STR}/items/batch",
+        headers=normal_user_token_headers,
+        json=data,
+    )
+    assert response.status_code == 200
+    results = response.json()["data"]
+    assert [result["item"]["title"] for result in results] == [
+        "Batch 0",
+        "Batch 1",
+        "Batch 2",
+    ]
+    assert all(result["status_code"] == 200 for result in results)
+    assert count() == before + 3
+
+
+def test_create_items_batch_too_large(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    data = {"data": [{"title": "Foo"}] * (settings.MAX_BATCH_SIZE + 1)}
+    response = client.post(
+        f"{settings.API_V1_STR}/items/batch",
+        headers=normal_user_token_headers,
+        json=data,
+    )
+    assert response.status_code == 400
+
+
+def test_update_items_batch(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    response = client.post(
+        f"{settings.API_V1_STR}/items/batch",
+        headers=normal_user_token_headers,
+        json={"data": [{"title": "Old"}, {"title": "Old"}]},
+    )
+    ids = [result["id"] for result in response.json()["data"]]
+    other = create_random_item(db)
+    missing = str(uuid.uuid4())
+    data = {
+        "data": [
+            {"id": ids[0], "title": "New"},
+            {"id": ids[1], "description": "Described"},
+            {"id": str(other.id), "title": "Stolen"},
+            {"id": missing, "title": "Nothing"},
+        ]
+    }
+    response = client.patch(
+        f"{settings.API_V1_STR}/items/batch",
+        headers=normal_user_token_headers,
+        json=data,
+    )
+    assert response.status_code == 200
+    results = response.json()["data"]
+    assert [result["status_code"] for result in results] == [200, 200, 400, 404]
+    assert results[0]["item"]["title"] == "New"
+    assert results[1]["item"]["title"] == "Old"
+    assert results[1]["item"]["description"] == "Described"
+    db.refresh(other)
+    assert other.title != "Stolen"
+
+
+def test_delete_items_batch(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    response = client.post(
+        f"{settings.API_V1_STR}/items/batch",
+        headers=normal_user_token_headers,
+        json={"data": [{"title": "Gone"}, {"title": "Gone"}]},
+    )
+    ids = [result["id"] for result in response.json()["data"]]
+    count_before = client.get(
+        f"{settings.API_V1_STR}/items/", headers=normal_user_token_headers
+    ).json()["count"]
+    other = create_random_item(db)
+    response = client.request(
+        "DELETE",
+        f"{settings.API_V1_STR}/items/batch",
+        headers=normal_user_token_headers,
+        json={"ids": [*ids, str(other.id)]},
+    )
+    assert response.status_code == 200
+    results = response.json()["data"]
+    assert [result["status_code"] for result in results] == [200, 200, 400]
+    assert db.exec(select(Item).where(col(Item.id).in_(ids))).all() == []
+    count_after = client.get(
+        f"{settings.API_V1_STR}/items/", headers=normal_user_token_headers
+    ).json()["count"]
+    assert count_after == count_before - 2
+
+
+def test_export_items_ndjson(client: TestClient, db: Session) -> None:
+    password = random_lower_string()
+    user = crud.create_user(
+        session=db, user_create=UserCreate(email=random_email(), password=password)
+    )
+    items = [
+        crud.create_item(
+            session=db,
+            item_in=ItemCreate(title=random_lower_string()),
+            owner_id=user.id,
+        )
+        for _ in range(3)
+    ]
+    headers = user_authentication_headers(
+        client=client, email=user.email, password=password
+    )
+    with patch("app.api.routes.items.EXPORT_BATCH_SIZE", 2):
+        response = client.get(f"{settings.API_V1_STR}/items/export", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows == [
+        {
+            "id": str(item.id),
+            "title": item.title,
+            "description": None,
+            "owner_id": str(user.id),
+        }
+        for item in sorted(items, key=lambda item: item.id)
+    ]
+
+
+def test_export_items_csv(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    client.post(
+        f"{settings.API_V1_STR}/items/",
+        headers=normal_user_token_headers,
+        json={"title": "Exported, with comma", "description": "Quoted"},
+    )
+    response = client.get(
+        f"{settings.API_V1_STR}/items/export",
+        headers=normal_user_token_headers,
+        params={"format": "csv"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert list(rows[0]) == ["id", "title", "description", "owner_id"]
+    assert any(
+        row["title"] == "Exported, with comma" and row["description"] == "Quoted"
+        for row in rows
+    )
+
+
+def test_export_items_takes_database_slot(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    # Not the gate get_db takes the slot of the request from
+    gate = AdmissionGate(limit=1, queue_size=0, timeout=1)
+    with (
+        patch("app.api.routes.items.db_admission", gate),
+        patch.object(gate, "admit", wraps=gate.admit) as admit,
+    ):
+        response = client.get(
+            f"{settings.API_V1_STR}/items/export", headers=normal_user_token_headers
+        )
+    assert response.status_code == 200
+    admit.assert_called_once()
+    assert gate.active == 0
+
+
+def test_read_item_etag(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    item = create_random_item(db)
+    url = f"{settings.API_V1_STR}/items/{item.id}"
+    response = client.get(url, headers=superuser_token_headers)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    response = client.get(
+        url, headers={**superuser_token_headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+    response = client.put(
+        url, headers=superuser_token_headers, json={"title": "Changed"}
+    )
+    assert response.headers["ETag"] != etag
+    response = client.get(
+        url, headers={**superuser_token_headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.json()["title"] == "Changed"
+
+
+def test_read_items_etag(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    url = f"{settings.API_V1_STR}/items/"
+    etag = client.get(url, headers=normal_user_token_headers).headers["ETag"]
+    response = client.get(
+        url, headers={**normal_user_token_headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    client.post(url, headers=normal_user_token_headers, json={"title": "New"})
+    response = client.get(
+        url, headers={**normal_user_token_headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+
+
+def test_update_item_if_match(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    item = create_random_item(db)
+    url = f"{settings.API_V1_STR}/items/{item.id}"
+    etag = client.get(url, headers=superuser_token_headers).headers["ETag"]
+    response = client.put(
+        url,
+        headers={**superuser_token_headers, "If-Match": etag},
+        json={"title": "First"},
+    )
+    assert response.status_code == 200
+    response = client.put(
+        url,
+        headers={**superuser_token_headers, "If-Match": etag},
+        json={"title": "Second"},
+    )
+    assert response.status_code == 412
+    db.refresh(item)
+    assert item.title == "First"
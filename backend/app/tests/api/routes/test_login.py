@@ -1,11 +1,17 @@
 from unittest.mock import patch
 
+import pytest
 from fastapi.testclient import TestClient
 from sqlmodel import Session, select
 
+from app import crud
+from app.core import ratelimit
 from app.core.config import settings
-from app.core.security import verify_password
-from app.models import User
+from app.core.replicas import READ_YOUR_WRITES_COOKIE
+from app.core.security import PasswordHashQueueFull, verify_password
+from app.models import User, UserCreate, UserUpdate
+from app.outbox import email_outbox
+from app.tests.utils.utils import random_email, random_lower_string
 from app.utils import generate_password_reset_token
 
 
@@ -19,6 +25,8 @@ def test_get_access_token(client: TestClient) -> None:
     assert r.status_code == 200
     assert "access_token" in tokens
     assert tokens["access_token"]
+    # The first reads go to the primary
+    assert READ_YOUR_WRITES_COOKIE in r.cookies
 
 
 def test_get_access_token_incorrect_password(client: TestClient) -> None:
@@ -30,6 +38,61 @@ def test_get_access_token_incorrect_password(client: TestClient) -> None:
     assert r.status_code == 400
 
 
+def test_get_access_token_hash_queue_full(client: TestClient) -> None:
+    login_data = {
+        "username": settings.FIRST_SUPERUSER,
+        "password": settings.FIRST_SUPERUSER_PASSWORD,
+    }
+    with patch(
+        "app.crud.verify_and_update_password_async",
+        side_effect=PasswordHashQueueFull("verify"),
+    ):
+        r = client.post(f"{settings.API_V1_STR}/login/access-token", data=login_data)
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "1"
+
+
+@pytest.fixture
+def rate_limits(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(
+        ratelimit, "rate_limit_backend", ratelimit.MemoryBackend(maxsize=100)
+    )
+
+
+@pytest.mark.usefixtures("rate_limits")
+def test_get_access_token_rate_limited(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "RATE_LIMIT_LOGIN_PER_ACCOUNT", "2/minute")
+    login_data = {"username": settings.FIRST_SUPERUSER, "password": "incorrect"}
+    for _ in range(2):
+        r = client.post(f"{settings.API_V1_STR}/login/access-token", data=login_data)
+        assert r.status_code == 400
+    with patch("app.crud.async_authenticate") as authenticate:
+        r = client.post(f"{settings.API_V1_STR}/login/access-token", data=login_data)
+    assert r.status_code == 429
+    assert 0 < int(r.headers["Retry-After"]) <= 30
+    # Rejected before looking up the user or hashing the password
+    authenticate.assert_not_called()
+    # Other accounts are not limited
+    login_data["username"] = random_email()
+    r = client.post(f"{settings.API_V1_STR}/login/access-token", data=login_data)
+    assert r.status_code == 400
+
+
+@pytest.mark.usefixtures("rate_limits")
+def test_recovery_password_rate_limited(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "RATE_LIMIT_PASSWORD_RECOVERY_PER_IP", "1/minute")
+    r = client.post(f"{settings.API_V1_STR}/password-recovery/{random_email()}")
+    assert r.status_code == 404
+    r = client.post(f"{settings.API_V1_STR}/password-recovery/{random_email()}")
+    assert r.status_code == 429
+    assert "Retry-After" in r.headers
+
+
 def test_use_access_token(
     client: TestClient, superuser_token_headers: dict[str, str]
 ) -> None:
@@ -48,6 +111,7 @@ def test_recovery_password(
     with (
         patch("app.core.config.settings.SMTP_HOST", "smtp.example.com"),
         patch("app.core.config.settings.SMTP_USER", "admin@example.com"),
+        patch.object(email_outbox, "enqueue") as enqueue,
     ):
         email = "test@example.com"
         r = client.post(
@@ -56,6 +120,7 @@ def test_recovery_password(
         )
         assert r.status_code == 200
         assert r.json() == {"message": "Password recovery email sent"}
+        assert enqueue.call_args.kwargs["email_to"] == email
 
 
 def test_recovery_password_user_not_exits(
@@ -102,3 +167,94 @@ def test_reset_password_invalid_token(
     assert "detail" in response
     assert r.status_code == 400
     assert response["detail"] == "Invalid token"
+
+
+def _stateless_login(client: TestClient, db: Session) -> tuple[User, dict[str, str]]:
+    email = random_email()
+    password = random_lower_string()
+    user = crud.create_user(
+        session=db, user_create=UserCreate(email=email, password=password)
+    )
+    with patch.object(settings, "STATELESS_ACCESS_TOKENS", True):
+        r = client.post(
+            f"{settings.API_V1_STR}/login/access-token",
+            data={"username": email, "password": password},
+        )
+    assert r.status_code == 200
+    return user, r.json()
+
+
+def test_stateless_access_token(client: TestClient, db: Session) -> None:
+    _, tokens = _stateless_login(client, db)
+    assert tokens["refresh_token"]
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    with patch("app.api.deps._get_user", side_effect=AssertionError("loaded user")):
+        r = client.get(f"{settings.API_V1_STR}/items/", headers=headers)
+    assert r.status_code == 200
+    r = client.get(f"{settings.API_V1_STR}/users/", headers=headers)
+    assert r.status_code == 403
+
+
+def test_stateless_access_token_deleted_user(client: TestClient, db: Session) -> None:
+    user, tokens = _stateless_login(client, db)
+    db.delete(user)
+    db.commit()
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    url = f"{settings.API_V1_STR}/items"
+    r = client.get(f"{url}/", headers=headers)
+    assert r.status_code == 404
+    r = client.post(f"{url}/", headers=headers, json={"title": "Foo"})
+    assert r.status_code == 404
+    r = client.post(f"{url}/batch", headers=headers, json={"data": [{"title": "Foo"}]})
+    assert r.status_code == 404
+    assert r.json() == {"detail": "User not found"}
+
+
+def test_refresh_token(client: TestClient, db: Session) -> None:
+    _, tokens = _stateless_login(client, db)
+    with patch.object(settings, "STATELESS_ACCESS_TOKENS", True):
+        r = client.post(
+            f"{settings.API_V1_STR}/login/refresh-token",
+            json={"refresh_token": tokens["refresh_token"]},
+        )
+    assert r.status_code == 200
+    new_tokens = r.json()
+    assert new_tokens["access_token"]
+    assert new_tokens["refresh_token"]
+    headers = {"Authorization": f"Bearer {new_tokens['access_token']}"}
+    r = client.get(f"{settings.API_V1_STR}/items/", headers=headers)
+    assert r.status_code == 200
+
+
+def test_refresh_token_not_access_token(client: TestClient, db: Session) -> None:
+    _, tokens = _stateless_login(client, db)
+    headers = {"Authorization": f"Bearer {tokens['refresh_token']}"}
+    r = client.get(f"{settings.API_V1_STR}/items/", headers=headers)
+    assert r.status_code == 403
+    r = client.post(
+        f"{settings.API_V1_STR}/login/refresh-token",
+        json={"refresh_token": tokens["access_token"]},
+    )
+    assert r.status_code == 403
+
+
+def test_refresh_token_after_password_change(client: TestClient, db: Session) -> None:
+    user, tokens = _stateless_login(client, db)
+    crud.update_user(
+        session=db, db_user=user, user_in=UserUpdate(password=random_lower_string())
+    )
+    r = client.post(
+        f"{settings.API_V1_STR}/login/refresh-token",
+        json={"refresh_token": tokens["refresh_token"]},
+    )
+    assert r.status_code == 403
+
+
+def test_refresh_token_inactive_user(client: TestClient, db: Session) -> None:
+    user, tokens = _stateless_login(client, db)
+    crud.update_user(session=db, db_user=user, user_in=UserUpdate(is_active=False))
+    r = client.post(
+        f"{settings.API_V1_STR}/login/refresh-token",
+        json={"refresh_token": tokens["refresh_token"]},
+    )
+    assert r.status_code == 400
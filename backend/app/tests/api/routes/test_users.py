@@ -5,9 +5,12 @@ from fastapi.testclient import TestClient
 from sqlmodel import Session, select
 
 from app import crud
+from app.core.cache import user_cache
 from app.core.config import settings
-from app.core.security import verify_password
-from app.models import User, UserCreate
+from app.core.security import get_password_hash, verify_password
+from app.models import User, UserCreate, UsersPublic
+from app.outbox import email_outbox
+from app.tests.utils.user import user_authentication_headers
 from app.tests.utils.utils import random_email, random_lower_string
 
 
@@ -33,11 +36,45 @@ def test_get_users_normal_user_me(
     assert current_user["email"] == settings.EMAIL_TEST_USER
 
 
+def test_get_users_me_cached(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    client.get(f"{settings.API_V1_STR}/users/me", headers=normal_user_token_headers)
+    hits = user_cache.hits
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=normal_user_token_headers)
+    assert r.status_code == 200
+    assert r.json()["email"] == settings.EMAIL_TEST_USER
+    assert user_cache.hits == hits + 1
+
+
+def test_deactivated_user_is_rejected(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    email = random_email()
+    password = random_lower_string()
+    user = crud.create_user(
+        session=db, user_create=UserCreate(email=email, password=password)
+    )
+    headers = user_authentication_headers(client=client, email=email, password=password)
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.status_code == 200
+
+    r = client.patch(
+        f"{settings.API_V1_STR}/users/{user.id}",
+        headers=superuser_token_headers,
+        json={"is_active": False},
+    )
+    assert r.status_code == 200
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.status_code == 400
+    assert r.json()["detail"] == "Inactive user"
+
+
 def test_create_user_new_email(
     client: TestClient, superuser_token_headers: dict[str, str], db: Session
 ) -> None:
     with (
-        patch("app.utils.send_email", return_value=None),
+        patch.object(email_outbox, "enqueue") as enqueue,
         patch("app.core.config.settings.SMTP_HOST", "smtp.example.com"),
         patch("app.core.config.settings.SMTP_USER", "admin@example.com"),
     ):
@@ -54,6 +91,82 @@ def test_create_user_new_email(
         user = crud.get_user_by_email(session=db, email=username)
         assert user
         assert user.email == created_user["email"]
+        assert enqueue.call_args.kwargs["email_to"] == username
+
+
+def test_import_users(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    existing = crud.create_user(
+        session=db,
+        user_create=UserCreate(email=random_email(), password=random_lower_string()),
+    )
+    new_email, other_email, password = random_email(), random_email(), "password123"
+    lines = [
+        "email,password,full_name,is_superuser",
+        f"{new_email},{password},New User,",
+        f"{existing.email},{password},,",
+        "not-an-email,password123,,",
+        f"{other_email},short,,",
+        f"{other_email},{password},,true",
+        f"{new_email},{password},,",
+    ]
+    with (
+        patch.object(email_outbox, "put") as put,
+        patch("app.core.config.settings.SMTP_HOST", "smtp.example.com"),
+        patch("app.core.config.settings.SMTP_USER", "admin@example.com"),
+        patch("app.core.config.settings.USER_IMPORT_BATCH_SIZE", 2),
+    ):
+        r = client.post(
+            f"{settings.API_V1_STR}/users/import",
+            headers=superuser_token_headers,
+            files={"file": ("users.csv", "\n".join(lines), "text/csv")},
+        )
+    assert r.status_code == 200
+    content = r.json()
+    assert content["created"] == 2
+    assert [(error["line"], error["email"]) for error in content["errors"]] == [
+        (3, existing.email),
+        (4, "not-an-email"),
+        (5, other_email),
+        (7, new_email),
+    ]
+    assert "password" in content["errors"][2]["detail"]
+    assert {call.kwargs["email_to"] for call in put.call_args_list} == {
+        new_email,
+        other_email,
+    }
+
+    user = crud.get_user_by_email(session=db, email=new_email)
+    assert user
+    assert user.full_name == "New User"
+    assert not user.is_superuser
+    assert verify_password(password, user.hashed_password)
+    user = crud.get_user_by_email(session=db, email=other_email)
+    assert user
+    assert user.is_superuser
+
+
+def test_import_users_invalid_header(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = client.post(
+        f"{settings.API_V1_STR}/users/import",
+        headers=superuser_token_headers,
+        files={"file": ("users.csv", "email,name\nuser@example.com,User", "text/csv")},
+    )
+    assert r.status_code == 400
+
+
+def test_import_users_normal_user(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    r = client.post(
+        f"{settings.API_V1_STR}/users/import",
+        headers=normal_user_token_headers,
+        files={"file": ("users.csv", "email,password\n", "text/csv")},
+    )
+    assert r.status_code == 403
 
 
 def test_get_existing_user(
@@ -168,6 +281,47 @@ def test_retrieve_users(
         assert "email" in item
 
 
+def test_retrieve_users_matches_response_model(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = client.get(f"{settings.API_V1_STR}/users/", headers=superuser_token_headers)
+    content = r.json()
+    assert UsersPublic.model_validate(content).model_dump(mode="json") == content
+
+
+def test_retrieve_users_cursor_pagination(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    for _ in range(3):
+        user_in = UserCreate(email=random_email(), password=random_lower_string())
+        crud.create_user(session=db, user_create=user_in)
+
+    r = client.get(
+        f"{settings.API_V1_STR}/users/",
+        headers=superuser_token_headers,
+        params={"limit": 2},
+    )
+    first_page = r.json()
+    assert len(first_page["data"]) == 2
+    assert first_page["next_cursor"]
+
+    r = client.get(
+        f"{settings.API_V1_STR}/users/",
+        headers=superuser_token_headers,
+        params={
+            "limit": 2,
+            "cursor": first_page["next_cursor"],
+            "include_count": False,
+        },
+    )
+    second_page = r.json()
+    assert second_page["count"] is None
+    first_ids = [user["id"] for user in first_page["data"]]
+    second_ids = [user["id"] for user in second_page["data"]]
+    assert second_ids
+    assert max(first_ids) < min(second_ids)
+
+
 def test_update_user_me(
     client: TestClient, normal_user_token_headers: dict[str, str], db: Session
 ) -> None:
@@ -245,6 +399,31 @@ def test_update_password_me_incorrect_password(
     assert updated_user["detail"] == "Incorrect password"
 
 
+def test_update_password_me_changed_elsewhere(client: TestClient, db: Session) -> None:
+    email = random_email()
+    password = random_lower_string()
+    user = crud.create_user(
+        session=db, user_create=UserCreate(email=email, password=password)
+    )
+    headers = user_authentication_headers(client=client, email=email, password=password)
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.status_code == 200
+    # Changed by another worker, this one still has the user cached
+    new_password = random_lower_string()
+    user.hashed_password = get_password_hash(new_password)
+    db.add(user)
+    db.commit()
+
+    url = f"{settings.API_V1_STR}/users/me/password"
+    data = {"current_password": password, "new_password": random_lower_string()}
+    r = client.patch(url, headers=headers, json=data)
+    assert r.status_code == 400
+    assert r.json()["detail"] == "Incorrect password"
+    data = {"current_password": new_password, "new_password": password}
+    r = client.patch(url, headers=headers, json=data)
+    assert r.status_code == 200
+
+
 def test_update_user_me_email_exists(
     client: TestClient, normal_user_token_headers: dict[str, str], db: Session
 ) -> None:
@@ -484,3 +663,65 @@ def test_delete_user_without_privileges(
     )
     assert r.status_code == 403
     assert r.json()["detail"] == "The user doesn't have enough privileges"
+
+
+def test_read_user_me_etag(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    url = f"{settings.API_V1_STR}/users/me"
+    r = client.get(url, headers=normal_user_token_headers)
+    etag = r.headers["ETag"]
+    r = client.get(url, headers={**normal_user_token_headers, "If-None-Match": etag})
+    assert r.status_code == 304
+    r = client.get(
+        url, headers={**normal_user_token_headers, "If-None-Match": f"W/{etag}"}
+    )
+    assert r.status_code == 304
+    r = client.get(url, headers={**normal_user_token_headers, "If-None-Match": '"x"'})
+    assert r.status_code == 200
+
+
+def test_update_user_me_if_match(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    url = f"{settings.API_V1_STR}/users/me"
+    etag = client.get(url, headers=normal_user_token_headers).headers["ETag"]
+    r = client.patch(
+        url,
+        headers={**normal_user_token_headers, "If-Match": etag},
+        json={"full_name": "First"},
+    )
+    assert r.status_code == 200
+    assert r.headers["ETag"] != etag
+    r = client.patch(
+        url,
+        headers={**normal_user_token_headers, "If-Match": etag},
+        json={"full_name": "Second"},
+    )
+    assert r.status_code == 412
+    r = client.get(url, headers=normal_user_token_headers)
+    assert r.json()["full_name"] == "First"
+
+
+def test_update_user_if_match(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    user = crud.create_user(
+        session=db,
+        user_create=UserCreate(email=random_email(), password=random_lower_string()),
+    )
+    url = f"{settings.API_V1_STR}/users/{user.id}"
+    etag = client.get(url, headers=superuser_token_headers).headers["ETag"]
+    r = client.patch(
+        url,
+        headers={**superuser_token_headers, "If-Match": '"stale"'},
+        json={"full_name": "Rejected"},
+    )
+    assert r.status_code == 412
+    r = client.patch(
+        url,
+        headers={**superuser_token_headers, "If-Match": etag},
+        json={"full_name": "Accepted"},
+    )
+    assert r.status_code == 200
+    assert r.json()["full_name"] == "Accepted"
@@ -0,0 +1,31 @@
+import os
+
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+
+
+def test_db_pool_status(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/db-pool/", headers=superuser_token_headers
+    )
+    assert r.status_code == 200
+    status = r.json()
+    assert status["pid"] == os.getpid()
+    assert status["pool_class"] == "TimedAsyncAdaptedQueuePool"
+    assert status["pool_size"] == settings.POSTGRES_POOL_SIZE
+    assert status["max_overflow"] == settings.POSTGRES_MAX_OVERFLOW
+    # The request itself checked out a connection to authenticate the user
+    assert status["checkouts"] >= 1
+    assert status["checkout_wait_seconds_total"] >= 0
+
+
+def test_db_pool_status_normal_user(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/db-pool/", headers=normal_user_token_headers
+    )
+    assert r.status_code == 403
@@ -0,0 +1,129 @@
+import logging
+import re
+import subprocess
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.db import _log_plan, engine
+
+
+def test_metrics_per_route(client: TestClient) -> None:
+    client.get(f"{settings.API_V1_STR}/utils/health-check/")
+    client.get(f"{settings.API_V1_STR}/items/not-a-uuid")
+    client.get("/no/such/path")
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain")
+    assert (
+        'http_requests_total{method="GET",route="utils-health_check",status="200"}'
+        in r.text
+    )
+    assert 'route="items-read_item",status="401"' in r.text
+    assert 'http_requests_total{method="GET",route="unmatched",status="404"}' in r.text
+    assert 'http_request_seconds_bucket{le="0.005",route="utils-health_check"}' in (
+        r.text
+    )
+    assert "items/not-a-uuid" not in r.text
+
+
+def test_metrics_across_processes(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    code = (
+        "from app.core import metrics; "
+        "metrics.HTTP_REQUESTS.labels('utils-health_check', 'GET', 200).inc()"
+    )
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", code], check=True)
+    content, _ = metrics.render_metrics()
+    assert (
+        b'http_requests_total{method="GET",route="utils-health_check",status="200"} 2.0'
+        in content
+    )
+
+
+def test_query_stats_headers(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    r = client.get(f"{settings.API_V1_STR}/items/", headers=normal_user_token_headers)
+    assert r.status_code == 200
+    assert int(r.headers["X-DB-Statements"]) >= 2
+    assert float(r.headers["X-DB-Slowest-Statement-Ms"]) > 0
+    assert r.headers["Server-Timing"].startswith("db;dur=")
+
+    with patch.object(settings, "ENVIRONMENT", "production"):
+        r = client.get(
+            f"{settings.API_V1_STR}/items/", headers=normal_user_token_headers
+        )
+    assert "X-DB-Statements" not in r.headers
+
+
+def test_query_stats_repeated_statements(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    with (
+        patch.object(settings, "SQL_REPEATED_STATEMENT_THRESHOLD", 1),
+        caplog.at_level(logging.WARNING, logger="app.api.middleware"),
+    ):
+        client.get(f"{settings.API_V1_STR}/items/", headers=normal_user_token_headers)
+    assert "Likely N+1 query in items-read_items" in caplog.text
+    r = client.get("/metrics")
+    assert 'db_repeated_statements_total{route="items-read_items"}' in r.text
+
+
+def test_slow_statement_plan(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    with (
+        patch.object(settings, "SQL_SLOW_STATEMENT_SECONDS", 1e-9),
+        caplog.at_level(logging.WARNING, logger="app.core.db"),
+    ):
+        r = client.get(
+            f"{settings.API_V1_STR}/items/", headers=normal_user_token_headers
+        )
+    assert r.status_code == 200
+    assert "Slow statement" in caplog.text
+    # Seq Scan on item, or Index Only Scan using ... on item
+    assert re.search(r"Scan .*on item", caplog.text)
+
+
+def test_slow_statement_plan_failure_keeps_transaction(
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    with (
+        engine.connect() as conn,
+        caplog.at_level(logging.WARNING, logger="app.core.db"),
+    ):
+        conn.execute(text("SELECT 1"))
+        _log_plan(conn, "SELECT * FROM no_such_table", None, 1.0)
+        assert conn.execute(text("SELECT 2")).scalar() == 2
+    assert "Could not get the plan of a slow statement" in caplog.text
+
+
+def test_metrics_token(client: TestClient) -> None:
+    with patch.object(settings, "METRICS_TOKEN", "scrape-token"):
+        r = client.get("/metrics")
+        assert r.status_code == 401
+        r = client.get("/metrics", headers={"Authorization": "Bearer wrong"})
+        assert r.status_code == 401
+        r = client.get("/metrics", headers={"Authorization": "Bearer scrape-token"})
+        assert r.status_code == 200
+        assert "http_requests_total" in r.text
+
+
+def test_metrics_not_served_without_token(client: TestClient) -> None:
+    with patch.object(settings, "ENVIRONMENT", "production"):
+        r = client.get("/metrics")
+    assert r.status_code == 404
@@ -0,0 +1,260 @@
+"""
+Query plans of the statements the routes send. With sequential scans
+disabled, a statement still planned as one has no index it can use. An index
+scan with a filter reads rows only to discard them, the index only gives the
+order, which is no better on a large table.
+"""
+
+from collections.abc import Generator
+from typing import Any
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import Session
+
+from app import crud
+from app.core.config import settings
+from app.core.db import async_engine, engine
+from app.models import ItemCreate, UserCreate
+from app.tests.utils.user import user_authentication_headers
+from app.tests.utils.utils import random_email, random_lower_string
+
+Statements = list[tuple[str, Any]]
+
+
+@pytest.fixture
+def statements() -> Generator[Statements, None, None]:
+    captured: Statements = []
+
+    def capture(
+        _conn: Any,
+        _cursor: Any,
+        statement: str,
+        parameters: Any,
+        _context: Any,
+        executemany: bool,
+    ) -> None:
+        if not executemany and statement.lstrip().upper().startswith(
+            ("SELECT", "UPDATE", "DELETE")
+        ):
+            captured.append((statement, parameters))
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", capture)
+    yield captured
+    event.remove(async_engine.sync_engine, "before_cursor_execute", capture)
+
+
+def _plan_nodes(plan: dict[str, Any]) -> Generator[dict[str, Any], None, None]:
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+def _is_full_scan(node: dict[str, Any]) -> bool:
+    if node["Node Type"] == "Seq Scan":
+        return True
+    return node["Node Type"] == "Index Scan" and "Filter" in node
+
+
+def sequential_scans(statements: Statements) -> list[str]:
+    """
+    The statements planned with a scan of a whole table.
+    """
+    found = []
+    with engine.connect() as connection:
+        connection.exec_driver_sql("SET enable_seqscan = off")
+        # On the small test tables a full scan of the covering index can
+        # look cheaper than using the right index
+        connection.exec_driver_sql("SET enable_indexonlyscan = off")
+        for statement, parameters in statements:
+            if statement.startswith("SELECT count(*)") and "WHERE" not in statement:
+                # Counting a whole table reads all of it whatever the indexes
+                continue
+            result = connection.exec_driver_sql(
+                f"EXPLAIN (FORMAT JSON) {statement}", parameters
+            )
+            plan = result.scalar_one()[0]["Plan"]
+            tables = [
+                node["Relation Name"]
+                for node in _plan_nodes(plan)
+                if _is_full_scan(node)
+            ]
+            if tables:
+                found.append(f"{', '.join(tables)}: {statement}")
+        connection.rollback()
+    return found
+
+
+def test_item_routes_use_indexes(
+    client: TestClient, db: Session, statements: Statements
+) -> None:
+    password = random_lower_string()
+    user = crud.create_user(
+        session=db, user_create=UserCreate(email=random_email(), password=password)
+    )
+    headers = user_authentication_headers(
+        client=client, email=user.email, password=password
+    )
+    url = f"{settings.API_V1_STR}/items"
+
+    r = client.post(f"{url}/", headers=headers, json={"title": "Foo"})
+    item_id = r.json()["id"]
+    r = client.post(
+        f"{url}/batch", headers=headers, json={"data": [{"title": "Bar"}] * 3}
+    )
+    batch_ids = [result["id"] for result in r.json()["data"]]
+    r = client.get(f"{url}/", headers=headers, params={"limit": 2})
+    client.get(
+        f"{url}/",
+        headers=headers,
+        params={"limit": 2, "cursor": r.json()["next_cursor"]},
+    )
+    client.get(f"{url}/{item_id}", headers=headers)
+    client.put(f"{url}/{item_id}", headers=headers, json={"title": "Baz"})
+    client.patch(
+        f"{url}/batch", headers=headers, json={"data": [{"id": item_id, "title": "X"}]}
+    )
+    client.get(f"{url}/export", headers=headers)
+    client.request("DELETE", f"{url}/batch", headers=headers, json={"ids": batch_ids})
+    client.delete(f"{url}/{item_id}", headers=headers)
+
+    assert statements
+    assert sequential_scans(statements) == []
+
+
+def test_item_search_uses_index(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    db: Session,
+    statements: Statements,
+) -> None:
+    owner = crud.get_user_by_email(session=db, email=settings.FIRST_SUPERUSER)
+    assert owner
+    for _ in range(2):
+        crud.create_item(session=db, item_in=ItemCreate(title="Foo"), owner_id=owner.id)
+    # Searches of a user can also go through the items of the owner, the ones
+    # of a superuser have only the search index to use
+    url = f"{settings.API_V1_STR}/items/search"
+    r = client.get(
+        url, headers=superuser_token_headers, params={"q": "foo", "limit": 1}
+    )
+    client.get(
+        url,
+        headers=superuser_token_headers,
+        params={"q": "foo", "limit": 1, "cursor": r.json()["next_cursor"]},
+    )
+
+    assert statements
+    assert sequential_scans(statements) == []
+
+
+def test_item_search_ranks_limited_candidates(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    statements: Statements,
+) -> None:
+    client.get(
+        f"{settings.API_V1_STR}/items/search",
+        headers=superuser_token_headers,
+        params={"q": "foo"},
+    )
+    [(statement, parameters)] = [
+        (statement, parameters)
+        for statement, parameters in statements
+        if "ts_rank" in statement
+    ]
+    with engine.connect() as connection:
+        result = connection.exec_driver_sql(
+            f"EXPLAIN (FORMAT JSON) {statement}", parameters
+        )
+        plan = result.scalar_one()[0]["Plan"]
+        connection.rollback()
+    # The matches are limited before they are ranked and sorted
+    [sort] = [node for node in _plan_nodes(plan) if node["Node Type"] == "Sort"]
+    assert any(node["Node Type"] == "Limit" for node in _plan_nodes(sort))
+
+
+def item_partitions(statement: str, parameters: Any) -> set[str]:
+    """
+    The partitions of item the statement is planned to read.
+    """
+    with engine.connect() as connection:
+        result = connection.exec_driver_sql(
+            f"EXPLAIN (FORMAT JSON) {statement}", parameters
+        )
+        plan = result.scalar_one()[0]["Plan"]
+        connection.rollback()
+    return {
+        node["Relation Name"]
+        for node in _plan_nodes(plan)
+        if node.get("Relation Name", "").startswith("item_p")
+    }
+
+
+def test_owner_item_queries_read_one_partition(
+    client: TestClient, db: Session, statements: Statements
+) -> None:
+    password = random_lower_string()
+    user = crud.create_user(
+        session=db, user_create=UserCreate(email=random_email(), password=password)
+    )
+    headers = user_authentication_headers(
+        client=client, email=user.email, password=password
+    )
+    client.post(
+        f"{settings.API_V1_STR}/items/batch",
+        headers=headers,
+        json={"data": [{"title": "Foo"}] * 3},
+    )
+    r = client.get(
+        f"{settings.API_V1_STR}/items/", headers=headers, params={"limit": 2}
+    )
+    client.get(
+        f"{settings.API_V1_STR}/items/",
+        headers=headers,
+        params={"limit": 2, "cursor": r.json()["next_cursor"]},
+    )
+    client.get(f"{settings.API_V1_STR}/items/export", headers=headers)
+    client.get(
+        f"{settings.API_V1_STR}/items/search", headers=headers, params={"q": "foo"}
+    )
+    client.delete(f"{settings.API_V1_STR}/users/me", headers=headers)
+
+    owner_statements = [
+        (statement, parameters)
+        for statement, parameters in statements
+        if "item.owner_id = " in statement
+    ]
+    assert len(owner_statements) >= 5
+    for statement, parameters in owner_statements:
+        assert len(item_partitions(statement, parameters)) == 1, statement
+
+
+def test_user_routes_use_indexes(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    db: Session,
+    statements: Statements,
+) -> None:
+    user = crud.create_user(
+        session=db,
+        user_create=UserCreate(email=random_email(), password=random_lower_string()),
+    )
+    url = f"{settings.API_V1_STR}/users"
+
+    r = client.get(f"{url}/", headers=superuser_token_headers, params={"limit": 1})
+    client.get(
+        f"{url}/",
+        headers=superuser_token_headers,
+        params={"limit": 1, "cursor": r.json()["next_cursor"]},
+    )
+    client.get(f"{url}/{user.id}", headers=superuser_token_headers)
+    client.patch(
+        f"{url}/{user.id}", headers=superuser_token_headers, json={"full_name": "Foo"}
+    )
+    client.get(f"{url}/me", headers=superuser_token_headers)
+    client.delete(f"{url}/{user.id}", headers=superuser_token_headers)
+
+    assert statements
+    assert sequential_scans(statements) == []
@@ -1,11 +1,13 @@
-from collections.abc import Generator
+from collections.abc import AsyncGenerator, Generator
+from unittest.mock import patch
 
 import pytest
 from fastapi.testclient import TestClient
 from sqlmodel import Session, delete
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.core.config import settings
-from app.core.db import engine, init_db
+from app.core.db import async_engine, engine, init_db
 from app.main import app
 from app.models import Item, User
 from app.tests.utils.user import authentication_token_from_email
@@ -24,6 +26,28 @@ def db() -> Generator[Session, None, None]:
         session.commit()
 
 
+@pytest.fixture(scope="session", autouse=True)
+def rate_limits_disabled() -> Generator[None, None, None]:
+    # The tests log in far more often than the limits allow, the rate limit
+    # tests enable them
+    with patch.object(settings, "RATE_LIMIT_ENABLED", False):
+        yield
+
+
+@pytest.fixture(scope="session")
+def anyio_backend() -> str:
+    # psycopg's async connections run on asyncio
+    return "asyncio"
+
+
+@pytest.fixture
+async def async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+    # Don't leave connections bound to this test's event loop in the pool
+    await async_engine.dispose()
+
+
 @pytest.fixture(scope="module")
 def client() -> Generator[TestClient, None, None]:
     with TestClient(app) as c:
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import deps
+from app.core.admission import AdmissionGate, AdmissionRejected
+from app.core.config import settings
+
+
+@pytest.mark.anyio
+async def test_admission_gate_queues_in_order() -> None:
+    gate = AdmissionGate(limit=2, queue_size=2, timeout=5)
+    release = asyncio.Event()
+    admitted: list[int] = []
+
+    async def request(i: int) -> None:
+        async with gate.admit():
+            admitted.append(i)
+            await release.wait()
+
+    tasks = [asyncio.create_task(request(i)) for i in range(4)]
+    await asyncio.sleep(0.01)
+    assert admitted == [0, 1]
+    assert (gate.active, gate.waiting) == (2, 2)
+    with pytest.raises(AdmissionRejected) as exc_info:
+        async with gate.admit():
+            pass
+    assert exc_info.value.reason == "queue_full"
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert admitted == [0, 1, 2, 3]
+    assert (gate.active, gate.waiting) == (0, 0)
+
+
+@pytest.mark.anyio
+async def test_admission_gate_timeout() -> None:
+    gate = AdmissionGate(limit=1, queue_size=5, timeout=0.01)
+    async with gate.admit():
+        with pytest.raises(AdmissionRejected) as exc_info:
+            async with gate.admit():
+                pass
+        assert exc_info.value.reason == "timeout"
+        assert gate.waiting == 0
+    assert gate.active == 0
+
+
+@pytest.mark.anyio
+async def test_admission_gate_cancelled_waiter() -> None:
+    gate = AdmissionGate(limit=1, queue_size=5, timeout=5)
+
+    async def wait() -> None:
+        async with gate.admit():
+            pass
+
+    async with gate.admit():
+        task = asyncio.create_task(wait())
+        await asyncio.sleep(0.01)
+        assert gate.waiting == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert gate.waiting == 0
+    assert gate.active == 0
+
+
+def test_admission_rejected_response(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(
+        deps, "db_admission", AdmissionGate(limit=0, queue_size=0, timeout=1)
+    )
+    r = client.get(f"{settings.API_V1_STR}/items/", headers=normal_user_token_headers)
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "1"
+    # Routes without the database are not gated
+    r = client.get(f"{settings.API_V1_STR}/utils/health-check/")
+    assert r.status_code == 200
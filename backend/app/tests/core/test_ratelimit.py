@@ -0,0 +1,44 @@
+from unittest.mock import patch
+
+import pytest
+
+from app.core.ratelimit import MemoryBackend, Rate
+
+
+def test_parse_rate() -> None:
+    assert Rate.parse("5/minute") == Rate(capacity=5, period=60)
+    assert Rate.parse("100 / hour") == Rate(capacity=100, period=3600)
+    assert Rate.parse("10/30s") == Rate(capacity=10, period=30)
+    for value in ("5", "5/fortnight", "/minute", "five/minute"):
+        with pytest.raises(ValueError):
+            Rate.parse(value)
+
+
+@pytest.mark.anyio
+async def test_memory_backend_token_bucket() -> None:
+    backend = MemoryBackend(maxsize=10)
+    rate = Rate(capacity=2, period=10)
+    with patch("app.core.ratelimit.time.monotonic", return_value=100.0) as clock:
+        assert await backend.hit("a", rate) == 0
+        assert await backend.hit("a", rate) == 0
+        # Empty, a token comes back every 5 seconds
+        assert await backend.hit("a", rate) == pytest.approx(5)
+        # Other keys have their own bucket
+        assert await backend.hit("b", rate) == 0
+        clock.return_value = 103.0
+        assert await backend.hit("a", rate) == pytest.approx(2)
+        clock.return_value = 105.0
+        assert await backend.hit("a", rate) == 0
+        assert await backend.hit("a", rate) > 0
+
+
+@pytest.mark.anyio
+async def test_memory_backend_drops_least_recently_used() -> None:
+    backend = MemoryBackend(maxsize=2)
+    rate = Rate(capacity=1, period=60)
+    await backend.hit("a", rate)
+    await backend.hit("b", rate)
+    await backend.hit("c", rate)
+    # The bucket of a was dropped and starts full again
+    assert await backend.hit("a", rate) == 0
+    assert await backend.hit("c", rate) > 0
@@ -0,0 +1,187 @@
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.api import deps
+from app.core import replicas
+from app.core.config import settings
+from app.core.db import TimedNullPool, pool_checkout_stats
+from app.core.replicas import (
+    READ_YOUR_WRITES_COOKIE,
+    Replica,
+    ReplicaSet,
+    wrote_recently,
+)
+
+
+def _replica_set(url: str, *, name: str, max_lag: float = 5) -> ReplicaSet:
+    # The primary stands in for the replica, its lag is 0
+    engine = create_async_engine(url, poolclass=TimedNullPool, pool_logging_name=name)
+    return ReplicaSet(
+        [Replica(name=name, engine=engine)], max_lag=max_lag, check_interval=5
+    )
+
+
+@pytest.mark.anyio
+async def test_replica_set_check() -> None:
+    replica_set = _replica_set(
+        str(settings.SQLALCHEMY_DATABASE_URI), name="replica-check"
+    )
+    assert replica_set.choose() is None
+    await replica_set.check()
+    replica = replica_set.replicas[0]
+    assert replica.healthy
+    assert replica.lag_seconds == 0
+    assert replica_set.choose() is replica.engine
+    await replica_set.stop()
+
+
+@pytest.mark.anyio
+async def test_replica_set_out_of_rotation() -> None:
+    lagging = _replica_set(
+        str(settings.SQLALCHEMY_DATABASE_URI), name="replica-lagging", max_lag=-1
+    )
+    await lagging.check()
+    assert not lagging.replicas[0].healthy
+    assert lagging.choose() is None
+
+    unreachable = _replica_set(
+        "postgresql+psycopg://postgres@127.0.0.1:1/app", name="replica-unreachable"
+    )
+    unreachable.replicas[0].healthy = True
+    await unreachable.check()
+    assert not unreachable.replicas[0].healthy
+    assert unreachable.replicas[0].lag_seconds is None
+    assert unreachable.choose() is None
+
+
+@pytest.mark.anyio
+async def test_replica_not_streaming(monkeypatch: pytest.MonkeyPatch) -> None:
+    # The primary taken for a replica in recovery that replayed all it
+    # received, it has no WAL receiver as a replica disconnected from the
+    # primary
+    query = replicas._LAG_QUERY.text.replace("NOT pg_is_in_recovery()", "false")
+    for function in ("pg_last_wal_receive_lsn()", "pg_last_wal_replay_lsn()"):
+        query = query.replace(function, "pg_current_wal_lsn()")
+    monkeypatch.setattr(replicas, "_LAG_QUERY", text(query))
+    replica_set = _replica_set(
+        str(settings.SQLALCHEMY_DATABASE_URI), name="replica-not-streaming"
+    )
+    replica_set.replicas[0].healthy = True
+    await replica_set.check()
+    assert not replica_set.replicas[0].healthy
+    assert replica_set.replicas[0].lag_seconds is None
+    assert replica_set.choose() is None
+    await replica_set.stop()
+
+
+def test_reads_routed_to_replica(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    replica_set = _replica_set(
+        str(settings.SQLALCHEMY_DATABASE_URI), name="replica-routing"
+    )
+    replica_set.replicas[0].healthy = True
+    monkeypatch.setattr(deps, "replicas", replica_set)
+    stats = pool_checkout_stats["replica-routing"]
+    client.cookies.clear()
+
+    r = client.get(f"{settings.API_V1_STR}/items/", headers=normal_user_token_headers)
+    assert r.status_code == 200
+    assert stats.checkouts == 1
+
+    # After writing, the user reads from the primary
+    r = client.post(
+        f"{settings.API_V1_STR}/items/",
+        headers=normal_user_token_headers,
+        json={"title": "Foo"},
+    )
+    assert r.status_code == 200
+    assert READ_YOUR_WRITES_COOKIE in r.cookies
+    r = client.get(
+        f"{settings.API_V1_STR}/items/{r.json()['id']}",
+        headers=normal_user_token_headers,
+    )
+    assert r.status_code == 200
+    assert stats.checkouts == 1
+
+    # Until the window is over, when the browser drops the cookie
+    client.cookies.clear()
+    r = client.get(f"{settings.API_V1_STR}/items/", headers=normal_user_token_headers)
+    assert r.status_code == 200
+    assert stats.checkouts == 2
+
+
+def test_read_your_writes_across_workers(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    replica_set = _replica_set(
+        str(settings.SQLALCHEMY_DATABASE_URI), name="replica-read-your-writes"
+    )
+    replica_set.replicas[0].healthy = True
+    monkeypatch.setattr(deps, "replicas", replica_set)
+    stats = pool_checkout_stats["replica-read-your-writes"]
+    url = f"{settings.API_V1_STR}/items/"
+
+    r = client.post(url, headers=normal_user_token_headers, json={"title": "Foo"})
+    cookie = r.cookies[READ_YOUR_WRITES_COOKIE]
+    client.cookies.clear()
+
+    # Nothing is kept by the worker, another one reads the cookie as well
+    r = client.get(
+        url,
+        headers=normal_user_token_headers,
+        cookies={READ_YOUR_WRITES_COOKIE: cookie},
+    )
+    assert r.status_code == 200
+    assert stats.checkouts == 0
+
+    # A cookie set for another user, altered or too old isn't taken
+    assert not wrote_recently(str(uuid.uuid4()), cookie)
+    wrote_at, _, signature = cookie.rpartition(".")
+    for forged in (f"{float(wrote_at) + 60:.3f}.{signature}", f"0.{signature}"):
+        client.cookies.clear()
+        r = client.get(
+            url,
+            headers=normal_user_token_headers,
+            cookies={READ_YOUR_WRITES_COOKIE: forged},
+        )
+        assert r.status_code == 200
+    assert stats.checkouts == 2
+    client.cookies.clear()
+
+
+def test_export_routed_like_reads(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    replica_set = _replica_set(
+        str(settings.SQLALCHEMY_DATABASE_URI), name="replica-export"
+    )
+    replica_set.replicas[0].healthy = True
+    monkeypatch.setattr(deps, "replicas", replica_set)
+    stats = pool_checkout_stats["replica-export"]
+    url = f"{settings.API_V1_STR}/items"
+    client.cookies.clear()
+
+    # The rows stream from the replica, the session of the request only
+    # connects when the user isn't cached
+    r = client.get(f"{url}/export", headers=normal_user_token_headers)
+    assert r.status_code == 200
+    checkouts = stats.checkouts
+    assert checkouts >= 1
+
+    client.post(f"{url}/", headers=normal_user_token_headers, json={"title": "Foo"})
+    r = client.get(f"{url}/export", headers=normal_user_token_headers)
+    assert r.status_code == 200
+    assert "Foo" in r.text
+    assert stats.checkouts == checkouts
+    client.cookies.clear()
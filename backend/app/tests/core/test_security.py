@@ -0,0 +1,60 @@
+import asyncio
+from typing import Any
+
+import pytest
+
+from app.core import security
+from app.core.config import settings
+
+
+@pytest.mark.anyio
+async def test_password_hash_async() -> None:
+    hashed_password = await security.get_password_hash_async("secret-password")
+    assert await security.verify_password_async("secret-password", hashed_password)
+    assert not await security.verify_password_async("wrong-password", hashed_password)
+    security.shutdown_hash_pool()
+
+
+@pytest.mark.anyio
+async def test_password_hash_queue_full(monkeypatch: pytest.MonkeyPatch) -> None:
+    # One call in the threadpool and no room to queue another one
+    monkeypatch.setattr(settings, "PASSWORD_HASH_WORKERS", 0)
+    monkeypatch.setattr(settings, "PASSWORD_HASH_QUEUE_SIZE", 0)
+    results = await asyncio.gather(
+        security.get_password_hash_async("secret-password"),
+        security.get_password_hash_async("secret-password"),
+        return_exceptions=True,
+    )
+    assert isinstance(results[0], str)
+    assert isinstance(results[1], security.PasswordHashQueueFull)
+
+
+@pytest.mark.anyio
+async def test_password_hashes_async(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "PASSWORD_HASH_WORKERS", 3)
+    calls: list[list[str]] = []
+    in_flight = max_in_flight = 0
+
+    async def run_hash_call(_operation: str, _func: Any, chunk: list[str]) -> Any:
+        nonlocal in_flight, max_in_flight
+        calls.append(chunk)
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return [f"hashed {password}" for password in chunk]
+
+    monkeypatch.setattr(security, "_run_hash_call", run_hash_call)
+    passwords = [f"password {i}" for i in range(9)]
+    hashed = await security.get_password_hashes_async(passwords)
+    assert hashed == [f"hashed {password}" for password in passwords]
+    # A few per call, a process is left to the logins
+    assert max(len(chunk) for chunk in calls) == security.HASH_MANY_CHUNK_SIZE
+    assert max_in_flight == 2
+
+
+def test_calibrate_bcrypt_rounds() -> None:
+    # No cost is cheap enough, the floor is kept
+    rounds, seconds = security.calibrate_bcrypt_rounds(0)
+    assert rounds == security.MIN_BCRYPT_ROUNDS
+    assert seconds > 0
@@ -0,0 +1,26 @@
+import pytest
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud
+from app.models import ItemCreate, UserCreate
+from app.tests.utils.utils import random_email, random_lower_string
+
+
+@pytest.mark.anyio
+async def test_async_delete_items_twice(async_db: AsyncSession) -> None:
+    user = await crud.async_create_user(
+        session=async_db,
+        user_create=UserCreate(email=random_email(), password=random_lower_string()),
+    )
+    items = await crud.async_create_items(
+        session=async_db,
+        items_in=[ItemCreate(title=random_lower_string()) for _ in range(3)],
+        owner_id=user.id,
+    )
+    # As two requests deleting the same items would
+    await crud.async_delete_items(session=async_db, db_items=items[:2])
+    await crud.async_delete_items(session=async_db, db_items=items[:2])
+    await crud.async_delete_item(session=async_db, db_item=items[2])
+    await crud.async_delete_item(session=async_db, db_item=items[2])
+
+    assert await crud.async_count_items(session=async_db, owner_id=user.id) == 0
@@ -1,8 +1,11 @@
+import pytest
 from fastapi.encoders import jsonable_encoder
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app import crud
-from app.core.security import verify_password
+from app.core.config import settings
+from app.core.security import pwd_context, verify_password
 from app.models import User, UserCreate, UserUpdate
 from app.tests.utils.utils import random_email, random_lower_string
 
@@ -26,6 +29,27 @@ def test_authenticate_user(db: Session) -> None:
     assert user.email == authenticated_user.email
 
 
+def test_authenticate_rehashes_outdated_hash(db: Session) -> None:
+    email = random_email()
+    password = random_lower_string()
+    user = crud.create_user(
+        session=db, user_create=UserCreate(email=email, password=password)
+    )
+    user.hashed_password = pwd_context.handler("bcrypt").using(rounds=4).hash(password)
+    db.add(user)
+    db.commit()
+
+    authenticated_user = crud.authenticate(session=db, email=email, password=password)
+    assert authenticated_user
+    new_hash = authenticated_user.hashed_password
+    assert new_hash.startswith(f"$2b${settings.PASSWORD_BCRYPT_ROUNDS:02d}$")
+    assert verify_password(password, new_hash)
+    # Up to date now
+    authenticated_user = crud.authenticate(session=db, email=email, password=password)
+    assert authenticated_user
+    assert authenticated_user.hashed_password == new_hash
+
+
 def test_not_authenticate_user(db: Session) -> None:
     email = random_email()
     password = random_lower_string()
@@ -89,3 +113,51 @@ def test_update_user(db: Session) -> None:
     assert user_2
     assert user.email == user_2.email
     assert verify_password(new_password, user_2.hashed_password)
+
+
+@pytest.mark.anyio
+async def test_async_create_and_authenticate_user(async_db: AsyncSession) -> None:
+    email = random_email()
+    password = random_lower_string()
+    user_in = UserCreate(email=email, password=password)
+    user = await crud.async_create_user(session=async_db, user_create=user_in)
+    assert user.email == email
+    authenticated_user = await crud.async_authenticate(
+        session=async_db, email=email, password=password
+    )
+    assert authenticated_user
+    assert authenticated_user.id == user.id
+
+
+@pytest.mark.anyio
+async def test_async_authenticate_rehashes_outdated_hash(
+    async_db: AsyncSession,
+) -> None:
+    email = random_email()
+    password = random_lower_string()
+    user = await crud.async_create_user(
+        session=async_db, user_create=UserCreate(email=email, password=password)
+    )
+    user.hashed_password = pwd_context.handler("bcrypt").using(rounds=4).hash(password)
+    async_db.add(user)
+    await async_db.commit()
+
+    authenticated_user = await crud.async_authenticate(
+        session=async_db, email=email, password=password
+    )
+    assert authenticated_user
+    assert authenticated_user.hashed_password.startswith(
+        f"$2b${settings.PASSWORD_BCRYPT_ROUNDS:02d}$"
+    )
+
+
+@pytest.mark.anyio
+async def test_async_update_user(async_db: AsyncSession) -> None:
+    user_in = UserCreate(email=random_email(), password=random_lower_string())
+    user = await crud.async_create_user(session=async_db, user_create=user_in)
+    new_password = random_lower_string()
+    user_in_update = UserUpdate(password=new_password)
+    await crud.async_update_user(session=async_db, db_user=user, user_in=user_in_update)
+    user_2 = await async_db.get(User, user.id)
+    assert user_2
+    assert verify_password(new_password, user_2.hashed_password)
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+from benchmarks.import_profile import (
+    IMPORT_TIME_BUDGET_SECONDS,
+    LAZY_MODULES,
+    import_profile,
+    import_seconds,
+)
+
+
+# A wall clock budget, with little margin on a loaded machine. Run it on its
+# own, with IMPORT_TIME_BUDGET_TEST=1
+@pytest.mark.skipif(
+    not os.environ.get("IMPORT_TIME_BUDGET_TEST"),
+    reason="IMPORT_TIME_BUDGET_TEST is not set",
+)
+def test_import_time_within_budget() -> None:
+    seconds, _ = import_seconds("app.main")
+    assert seconds <= IMPORT_TIME_BUDGET_SECONDS, (
+        f"Importing app.main took {seconds:.2f} s, over the budget of "
+        f"{IMPORT_TIME_BUDGET_SECONDS:.2f} s, see python -m benchmarks.import_profile"
+    )
+
+
+def test_lazy_modules_not_imported() -> None:
+    _, loaded = import_seconds("app.main", runs=1)
+    assert not loaded.intersection(LAZY_MODULES)
+
+
+def test_import_profile() -> None:
+    profile = import_profile("app.core.config")
+    assert profile["pydantic_settings"] > 0
+    assert "sqlalchemy" not in profile
@@ -0,0 +1,81 @@
+from collections.abc import Generator
+from unittest.mock import patch
+
+import pytest
+
+from app.core.config import settings
+from app.outbox import EmailOutbox, EmailOutboxFull
+from app.tests.utils.smtp import SMTPStandIn, smtp_stand_in
+
+
+@pytest.fixture
+def smtp() -> Generator[SMTPStandIn, None, None]:
+    with (
+        smtp_stand_in() as stand_in,
+        patch.object(settings, "SMTP_HOST", stand_in.host),
+        patch.object(settings, "EMAILS_FROM_EMAIL", "info@example.com"),
+    ):
+        yield stand_in
+
+
+def make_outbox(smtp: SMTPStandIn, **kwargs: float) -> EmailOutbox:
+    options: dict[str, float] = {
+        "senders": 1,
+        "maxsize": 100,
+        "batch_size": 10,
+        "max_attempts": 3,
+        "backoff": 0.01,
+        "idle_timeout": 5,
+        **kwargs,
+    }
+    return EmailOutbox(
+        **options,  # type: ignore[arg-type]
+        smtp_options=lambda: {"host": smtp.host, "port": smtp.port},
+    )
+
+
+@pytest.mark.anyio
+async def test_outbox_reuses_connection(smtp: SMTPStandIn) -> None:
+    outbox = make_outbox(smtp)
+    for i in range(5):
+        outbox.enqueue(
+            email_to=f"user{i}@example.com", subject="Hi", html_content="<p>Hi</p>"
+        )
+    await outbox.join()
+    await outbox.stop()
+    assert sorted(recipients[0] for recipients, _ in smtp.messages) == [
+        f"user{i}@example.com" for i in range(5)
+    ]
+    assert smtp.connections == 1
+
+
+@pytest.mark.anyio
+async def test_outbox_retries_failed_email(smtp: SMTPStandIn) -> None:
+    smtp.fail_next = 2
+    outbox = make_outbox(smtp)
+    outbox.enqueue(email_to="retry@example.com", subject="Hi", html_content="<p>Hi</p>")
+    await outbox.join()
+    await outbox.stop()
+    assert [recipients for recipients, _ in smtp.messages] == [["retry@example.com"]]
+
+
+@pytest.mark.anyio
+async def test_outbox_drops_email_after_max_attempts(smtp: SMTPStandIn) -> None:
+    smtp.fail_next = 10
+    outbox = make_outbox(smtp, max_attempts=2)
+    outbox.enqueue(
+        email_to="dropped@example.com", subject="Hi", html_content="<p>Hi</p>"
+    )
+    await outbox.join()
+    await outbox.stop()
+    assert smtp.messages == []
+    assert smtp.fail_next == 8
+
+
+@pytest.mark.anyio
+async def test_outbox_full(smtp: SMTPStandIn) -> None:
+    outbox = make_outbox(smtp, senders=0, maxsize=1)
+    outbox.enqueue(email_to="first@example.com", html_content="<p>Hi</p>")
+    with pytest.raises(EmailOutboxFull):
+        outbox.enqueue(email_to="second@example.com", html_content="<p>Hi</p>")
+    await outbox.stop()
@@ -0,0 +1,29 @@
+from app.utils import (
+    get_email_templates,
+    preload_email_templates,
+    render_email_template,
+    render_email_templates,
+)
+
+
+def test_preload_email_templates() -> None:
+    email_templates = get_email_templates()
+    email_templates.cache.clear()  # type: ignore[union-attr]
+    preload_email_templates()
+    assert len(email_templates.cache) == len(  # type: ignore[arg-type]
+        email_templates.list_templates(extensions=["html"])
+    )
+
+
+def test_render_email_templates() -> None:
+    contexts = [
+        {"project_name": "Project", "email": f"user{i}@example.com"} for i in range(3)
+    ]
+    html_contents = render_email_templates(
+        template_name="test_email.html", contexts=contexts
+    )
+    assert html_contents == [
+        render_email_template(template_name="test_email.html", context=context)
+        for context in contexts
+    ]
+    assert "user2@example.com" in html_contents[2]
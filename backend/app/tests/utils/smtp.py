@@ -0,0 +1,87 @@
+import socketserver
+import threading
+from collections.abc import Generator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+
+@dataclass
+class SMTPStandIn:
+    """
+    What a local SMTP server received, and how it should answer.
+    """
+
+    host: str = "127.0.0.1"
+    port: int = 0
+    connections: int = 0
+    messages: list[tuple[list[str], str]] = field(default_factory=list)
+    # Answer to this many DATA commands with a temporary failure first
+    fail_next: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    server: "_SMTPServer"
+
+    def reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self) -> None:
+        stand_in = self.server.stand_in
+        with stand_in.lock:
+            stand_in.connections += 1
+        self.reply("220 localhost ESMTP stand-in")
+        recipients: list[str] = []
+        while line := self.rfile.readline():
+            command = line.decode().strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 localhost")
+            elif verb == "MAIL":
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.split(":", 1)[1].strip(" <>"))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while (data_line := self.rfile.readline()) not in (b".\r\n", b""):
+                    data.append(data_line.decode())
+                with stand_in.lock:
+                    if stand_in.fail_next > 0:
+                        stand_in.fail_next -= 1
+                        self.reply("451 Try again later")
+                        continue
+                    stand_in.messages.append((recipients, "".join(data)))
+                self.reply("250 OK")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class _SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    stand_in: SMTPStandIn
+
+
+@contextmanager
+def smtp_stand_in() -> Generator[SMTPStandIn, None, None]:
+    """
+    Run a minimal SMTP server on a free local port while the context is open.
+    """
+    stand_in = SMTPStandIn()
+    with _SMTPServer((stand_in.host, 0), _SMTPHandler) as server:
+        server.stand_in = stand_in
+        stand_in.port = server.server_address[1]
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield stand_in
+        finally:
+            server.shutdown()
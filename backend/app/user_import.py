@@ -0,0 +1,147 @@
+import csv
+import io
+import itertools
+from collections.abc import Iterator
+from typing import IO
+
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud
+from app.core.config import settings
+from app.core.security import get_password_hashes_async
+from app.models import UserCreate, UserImportError, UserImportResults
+from app.outbox import email_outbox
+from app.utils import generate_new_account_email
+
+REQUIRED_COLUMNS = {"email", "password"}
+COLUMNS = set(UserCreate.model_fields)
+
+
+class InvalidUserImport(Exception):
+    """
+    Raised when the file itself can't be read as a user CSV.
+    """
+
+
+def _read_rows(reader: "csv.DictReader[str]") -> Iterator[tuple[int, dict[str, str]]]:
+    try:
+        for row in reader:
+            yield reader.line_num, row
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise InvalidUserImport(f"Line {reader.line_num + 1}: {e}")
+
+
+def _validation_detail(e: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}"
+        for error in e.errors()
+    )
+
+
+async def import_users(
+    *, session: AsyncSession, file: IO[bytes], batch_size: int
+) -> UserImportResults:
+    """
+    Create the users of a CSV file, batch_size rows at a time.
+
+    The rows of a batch are validated, checked against the existing emails in
+    one query, hashed on the password hash processes and inserted in one
+    statement. Each batch is committed on its own, so when the file turns out
+    to be malformed the batches before stay imported. Welcome emails go
+    through the outbox, waiting for room in it when it's full.
+    """
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(text)
+    try:
+        header = await run_in_threadpool(lambda: reader.fieldnames)
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise InvalidUserImport(f"Line 1: {e}")
+    if header is None or not REQUIRED_COLUMNS <= set(header):
+        raise InvalidUserImport("The header must name the email and password columns")
+    if unknown := set(header) - COLUMNS:
+        raise InvalidUserImport(f"Unknown columns: {', '.join(sorted(unknown))}")
+
+    rows = _read_rows(reader)
+    seen: set[str] = set()
+    created = 0
+    errors: list[UserImportError] = []
+    while batch := await run_in_threadpool(
+        lambda: list(itertools.islice(rows, batch_size))
+    ):
+        valid: list[tuple[int, UserCreate]] = []
+        for line, row in batch:
+            email = row.get("email") or None
+            if None in row:
+                errors.append(
+                    UserImportError(line=line, email=email, detail="Too many fields")
+                )
+                continue
+            try:
+                # Empty cells take the default
+                user_create = UserCreate.model_validate(
+                    {key: value for key, value in row.items() if value}
+                )
+            except ValidationError as e:
+                errors.append(
+                    UserImportError(
+                        line=line, email=email, detail=_validation_detail(e)
+                    )
+                )
+                continue
+            if user_create.email in seen:
+                errors.append(
+                    UserImportError(
+                        line=line,
+                        email=user_create.email,
+                        detail="Duplicate email in the file",
+                    )
+                )
+                continue
+            seen.add(user_create.email)
+            valid.append((line, user_create))
+
+        existing = await crud.async_get_existing_emails(
+            session=session, emails=[user_create.email for _, user_create in valid]
+        )
+        new = [(line, user) for line, user in valid if user.email not in existing]
+        # Ends the transaction, the connection isn't left idle in it while
+        # the passwords are hashed
+        await session.commit()
+        hashed_passwords = await get_password_hashes_async(
+            [user_create.password for _, user_create in new]
+        )
+        db_users = await crud.async_create_users(
+            session=session,
+            users_create=[user_create for _, user_create in new],
+            hashed_passwords=hashed_passwords,
+        )
+        created_emails = {db_user.email for db_user in db_users}
+        created += len(db_users)
+        errors.extend(
+            UserImportError(
+                line=line,
+                email=user_create.email,
+                detail="The user with this email already exists in the system",
+            )
+            for line, user_create in valid
+            if user_create.email not in created_emails
+        )
+
+        if settings.emails_enabled:
+            for _, user_create in new:
+                if user_create.email in created_emails:
+                    email_data = generate_new_account_email(
+                        email_to=user_create.email,
+                        username=user_create.email,
+                        password=user_create.password,
+                    )
+                    await email_outbox.put(
+                        email_to=user_create.email,
+                        subject=email_data.subject,
+                        html_content=email_data.html_content,
+                    )
+
+    errors.sort(key=lambda error: error.line)
+    return UserImportResults(created=created, errors=errors)
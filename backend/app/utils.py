@@ -1,17 +1,20 @@
+import functools
 import logging
+from collections.abc import Iterable
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
-import emails  # type: ignore
 import jwt
-from jinja2 import Template
 from jwt.exceptions import InvalidTokenError
 
 from app.core import security
 from app.core.config import settings
 
+if TYPE_CHECKING:
+    from jinja2 import Environment
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -22,27 +25,49 @@ class EmailData:
     subject: str
 
 
+# Templates are compiled on first use and kept, in local development they are
+# compiled again when the file changes. Jinja is only imported with the first
+# email, like the email package, so that workers that send none start faster.
+@functools.cache
+def get_email_templates() -> "Environment":
+    from jinja2 import Environment, FileSystemLoader
+
+    return Environment(
+        loader=FileSystemLoader(Path(__file__).parent / "email-templates" / "build"),
+        auto_reload=settings.ENVIRONMENT == "local",
+        cache_size=-1,
+    )
+
+
+def preload_email_templates() -> None:
+    """
+    Compile all the email templates, so that no request pays for it.
+    """
+    email_templates = get_email_templates()
+    for template_name in email_templates.list_templates(extensions=["html"]):
+        email_templates.get_template(template_name)
+
+
 def render_email_template(*, template_name: str, context: dict[str, Any]) -> str:
-    template_str = (
-        Path(__file__).parent / "email-templates" / "build" / template_name
-    ).read_text()
-    html_content = Template(template_str).render(context)
+    html_content = get_email_templates().get_template(template_name).render(context)
     return html_content
 
 
-def send_email(
-    *,
-    email_to: str,
-    subject: str = "",
-    html_content: str = "",
-) -> None:
-    assert settings.emails_enabled, "no provided configuration for email variables"
-    message = emails.Message(
-        subject=subject,
-        html=html_content,
-        mail_from=(settings.EMAILS_FROM_NAME, settings.EMAILS_FROM_EMAIL),
-    )
-    smtp_options = {"host": settings.SMTP_HOST, "port": settings.SMTP_PORT}
+def render_email_templates(
+    *, template_name: str, contexts: Iterable[dict[str, Any]]
+) -> list[str]:
+    """
+    Render one template with many contexts, for bulk notifications.
+    """
+    template = get_email_templates().get_template(template_name)
+    return [template.render(context) for context in contexts]
+
+
+def get_smtp_options() -> dict[str, Any]:
+    smtp_options: dict[str, Any] = {
+        "host": settings.SMTP_HOST,
+        "port": settings.SMTP_PORT,
+    }
     if settings.SMTP_TLS:
         smtp_options["tls"] = True
     elif settings.SMTP_SSL:
@@ -51,7 +76,28 @@ def send_email(
         smtp_options["user"] = settings.SMTP_USER
     if settings.SMTP_PASSWORD:
         smtp_options["password"] = settings.SMTP_PASSWORD
-    response = message.send(to=email_to, smtp=smtp_options)
+    return smtp_options
+
+
+def build_email_message(*, subject: str = "", html_content: str = "") -> Any:
+    import emails  # type: ignore
+
+    return emails.Message(
+        subject=subject,
+        html=html_content,
+        mail_from=(settings.EMAILS_FROM_NAME, settings.EMAILS_FROM_EMAIL),
+    )
+
+
+def send_email(
+    *,
+    email_to: str,
+    subject: str = "",
+    html_content: str = "",
+) -> None:
+    assert settings.emails_enabled, "no provided configuration for email variables"
+    message = build_email_message(subject=subject, html_content=html_content)
+    response = message.send(to=email_to, smtp=get_smtp_options())
     logger.info(f"send email result: {response}")
 
 
@@ -0,0 +1,71 @@
+"""
+Per-render cost of the email templates, reading and compiling the template on
+every call as before, against the compiled template registry.
+
+Run from the backend directory with `python -m benchmarks.email_templates`.
+"""
+
+import argparse
+import timeit
+from pathlib import Path
+from typing import Any
+
+from jinja2 import Template
+
+from app import utils
+
+TEMPLATES_DIR = Path(utils.__file__).parent / "email-templates" / "build"
+
+CONTEXT = {
+    "project_name": "TaxMateFlow",
+    "username": "user@example.com",
+    "email": "user@example.com",
+    "valid_hours": 48,
+    "link": "http://localhost:5173/reset-password?token=token",
+}
+
+
+def render_uncached(*, template_name: str, context: dict[str, Any]) -> str:
+    template_str = (TEMPLATES_DIR / template_name).read_text()
+    return Template(template_str).render(context)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--template", default="reset_password.html")
+    parser.add_argument("--number", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    assert render_uncached(
+        template_name=args.template, context=CONTEXT
+    ) == utils.render_email_template(template_name=args.template, context=CONTEXT)
+    utils.preload_email_templates()
+
+    cases = {
+        "uncached": lambda: render_uncached(
+            template_name=args.template, context=CONTEXT
+        ),
+        "registry": lambda: utils.render_email_template(
+            template_name=args.template, context=CONTEXT
+        ),
+    }
+    for name, render in cases.items():
+        seconds = min(timeit.repeat(render, number=args.number, repeat=3))
+        print(f"{name:>10}: {seconds / args.number * 1e6:9.1f} us per render")
+
+    contexts = [CONTEXT] * args.batch
+    seconds = min(
+        timeit.repeat(
+            lambda: utils.render_email_templates(
+                template_name=args.template, contexts=contexts
+            ),
+            number=1,
+            repeat=3,
+        )
+    )
+    print(f"{'batch':>10}: {seconds / args.batch * 1e6:9.1f} us per render")
+
+
+if __name__ == "__main__":
+    main()
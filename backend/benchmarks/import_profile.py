@@ -0,0 +1,104 @@
+"""
+Cold import time of app.main, what every worker process pays when it starts.
+
+Imports it in fresh interpreters and reports the best wall time, then the
+packages taking the longest to import from `python -X importtime`. Exits with
+1 when the import takes longer than the budget, or when it loads a module
+meant to be imported only when it's used.
+
+Run from the backend directory with `python -m benchmarks.import_profile`.
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+from collections import Counter
+from pathlib import Path
+
+# The best of 3 runs takes 1.3 to 1.5 s, it took 1.8 to 2.0 s before Sentry
+# and the email packages were imported lazily. About a third on top of it for
+# slower machines, lower it as the import gets faster.
+IMPORT_TIME_BUDGET_SECONDS = 2.0
+# Imported on first use, see app.main, app.utils and app.outbox
+LAZY_MODULES = ("sentry_sdk", "emails", "jinja2")
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+_MEASURE = """
+import sys
+import time
+
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(" ".join(sys.modules))
+"""
+
+
+def _python(*args: str) -> subprocess.CompletedProcess[str]:
+    return subprocess.run(
+        [sys.executable, *args],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def import_seconds(module: str, runs: int = 3) -> tuple[float, set[str]]:
+    """
+    Best wall time of importing the module in a fresh interpreter, over a
+    few runs, and the modules the import loaded.
+    """
+    best = float("inf")
+    loaded: set[str] = set()
+    for _ in range(runs):
+        *_, seconds, modules = _python(
+            "-c", _MEASURE.format(module=module)
+        ).stdout.splitlines()
+        best = min(best, float(seconds))
+        loaded = set(modules.split())
+    return best, loaded
+
+
+def import_profile(module: str) -> Counter[str]:
+    """
+    Microseconds spent importing each top level package, not counting the
+    packages it imports in turn.
+    """
+    stderr = _python("-X", "importtime", "-c", f"import {module}").stderr
+    profile: Counter[str] = Counter()
+    for line in stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)", line)
+        if match:
+            profile[match[2].split(".")[0]] += int(match[1])
+    return profile
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    seconds, loaded = import_seconds(args.module, args.runs)
+    print(
+        f"{args.module} imported in {seconds:.3f} s, "
+        f"budget {IMPORT_TIME_BUDGET_SECONDS:.3f} s"
+    )
+    # Under -X importtime the import is slower, the shares are what matters
+    profile = import_profile(args.module)
+    total = sum(profile.values())
+    for package, microseconds in profile.most_common(args.top):
+        print(f"{package:30} {microseconds / 1000:8.1f} ms {microseconds / total:6.1%}")
+    eager = sorted(loaded.intersection(LAZY_MODULES))
+    if eager:
+        print(f"Imported eagerly: {', '.join(eager)}")
+    if seconds > IMPORT_TIME_BUDGET_SECONDS or eager:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
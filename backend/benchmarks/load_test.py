@@ -0,0 +1,351 @@
+"""
+Load test of a running backend: latency percentiles and throughput per route.
+
+Seeds users with items through the API as the first superuser, then runs
+virtual users concurrently, each logging in and going through the item flow
+(create, read, update, list, delete) in a loop. A share of the virtual users
+are superusers going through the user admin flow instead.
+
+Run from the backend directory, against a running app:
+
+    python -m benchmarks.load_test --base-url http://localhost:8000 \\
+        --concurrency 50 --duration 60 --output results.json
+
+With --baseline, the results are compared with an earlier run and the exit
+status is 1 when the p95 latency of a route regressed more than allowed.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import string
+import sys
+import time
+from collections import defaultdict
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+import httpx
+
+from app.core.config import settings
+
+API = settings.API_V1_STR
+LOGIN_RETRY_DELAY = 1.0  # seconds
+
+
+def random_string(length: int = 16) -> str:
+    return "".join(random.choices(string.ascii_lowercase, k=length))
+
+
+@dataclass
+class Recorder:
+    latencies: defaultdict[str, list[float]] = field(
+        default_factory=lambda: defaultdict(list)
+    )
+    errors: defaultdict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+    async def request(
+        self,
+        client: httpx.AsyncClient,
+        method: str,
+        route: str,
+        url: str,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """
+        Make a request, recording its latency under the route template.
+        """
+        key = f"{method} {route}"
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies[key].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[key] += 1
+        return response
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Nearest-rank percentile of sorted values.
+    """
+    rank = max(math.ceil(q / 100 * len(values)) - 1, 0)
+    return values[rank]
+
+
+def summarize(recorder: Recorder, elapsed: float) -> dict[str, Any]:
+    routes = {}
+    for key, latencies in sorted(recorder.latencies.items()):
+        latencies = sorted(latencies)
+        routes[key] = {
+            "requests": len(latencies),
+            "errors": recorder.errors[key],
+            "rps": len(latencies) / elapsed,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": latencies[-1] * 1000,
+        }
+    total = sum(route["requests"] for route in routes.values())
+    return {
+        "elapsed_seconds": elapsed,
+        "requests": total,
+        "rps": total / elapsed,
+        "routes": routes,
+    }
+
+
+async def login(
+    recorder: Recorder, client: httpx.AsyncClient, email: str, password: str
+) -> dict[str, str]:
+    response = await recorder.request(
+        client,
+        "POST",
+        f"{API}/login/access-token",
+        f"{API}/login/access-token",
+        data={"username": email, "password": password},
+    )
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def seed(
+    client: httpx.AsyncClient, users: int, items_per_user: int
+) -> list[tuple[str, str]]:
+    """
+    Create users with items, returning their credentials.
+    """
+    recorder = Recorder()
+    headers = await login(
+        recorder, client, settings.FIRST_SUPERUSER, settings.FIRST_SUPERUSER_PASSWORD
+    )
+    credentials = []
+    for _ in range(users):
+        email = f"load-{random_string()}@example.com"
+        password = random_string()
+        response = await client.post(
+            f"{API}/users/",
+            headers=headers,
+            json={"email": email, "password": password},
+        )
+        response.raise_for_status()
+        credentials.append((email, password))
+        user_headers = await login(recorder, client, email, password)
+        for start in range(0, items_per_user, settings.MAX_BATCH_SIZE):
+            count = min(settings.MAX_BATCH_SIZE, items_per_user - start)
+            response = await client.post(
+                f"{API}/items/batch",
+                headers=user_headers,
+                json={"data": [{"title": random_string()} for _ in range(count)]},
+            )
+            response.raise_for_status()
+    return credentials
+
+
+async def item_flow(
+    recorder: Recorder, client: httpx.AsyncClient, headers: dict[str, str]
+) -> None:
+    response = await recorder.request(
+        client,
+        "POST",
+        f"{API}/items/",
+        f"{API}/items/",
+        headers=headers,
+        json={"title": random_string(), "description": random_string(64)},
+    )
+    item_id = response.json()["id"]
+    await recorder.request(
+        client, "GET", f"{API}/items/{{id}}", f"{API}/items/{item_id}", headers=headers
+    )
+    await recorder.request(
+        client,
+        "PUT",
+        f"{API}/items/{{id}}",
+        f"{API}/items/{item_id}",
+        headers=headers,
+        json={"title": random_string()},
+    )
+    response = await recorder.request(
+        client,
+        "GET",
+        f"{API}/items/",
+        f"{API}/items/",
+        headers=headers,
+        params={"limit": 50},
+    )
+    next_cursor = response.json().get("next_cursor")
+    if next_cursor:
+        await recorder.request(
+            client,
+            "GET",
+            f"{API}/items/",
+            f"{API}/items/",
+            headers=headers,
+            params={"limit": 50, "cursor": next_cursor, "include_count": False},
+        )
+    await recorder.request(
+        client,
+        "DELETE",
+        f"{API}/items/{{id}}",
+        f"{API}/items/{item_id}",
+        headers=headers,
+    )
+
+
+async def admin_flow(
+    recorder: Recorder, client: httpx.AsyncClient, headers: dict[str, str]
+) -> None:
+    response = await recorder.request(
+        client,
+        "GET",
+        f"{API}/users/",
+        f"{API}/users/",
+        headers=headers,
+        params={"limit": 50},
+    )
+    users = response.json()["data"]
+    if users:
+        user_id = random.choice(users)["id"]
+        await recorder.request(
+            client,
+            "GET",
+            f"{API}/users/{{user_id}}",
+            f"{API}/users/{user_id}",
+            headers=headers,
+        )
+    await recorder.request(
+        client, "GET", f"{API}/users/me", f"{API}/users/me", headers=headers
+    )
+
+
+async def virtual_user(
+    recorder: Recorder,
+    client: httpx.AsyncClient,
+    credentials: tuple[str, str],
+    flow: Callable[[Recorder, httpx.AsyncClient, dict[str, str]], Awaitable[None]],
+    deadline: float,
+) -> None:
+    headers = None
+    while time.monotonic() < deadline:
+        try:
+            # A login rejected under load, with a 429 or a 503, is retried
+            # rather than ending the run of every virtual user
+            if headers is None:
+                headers = await login(recorder, client, *credentials)
+            await flow(recorder, client, headers)
+        except (httpx.HTTPError, KeyError, ValueError) as e:
+            name = flow.__name__ if headers else "login"
+            recorder.errors[f"{name} aborted"] += 1
+            print(f"{name}: {e!r}", file=sys.stderr)
+            if headers is None:
+                await asyncio.sleep(LOGIN_RETRY_DELAY)
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=args.base_url, limits=limits, timeout=args.timeout
+    ) as client:
+        credentials = await seed(client, args.users, args.items_per_user)
+        admin = (settings.FIRST_SUPERUSER, settings.FIRST_SUPERUSER_PASSWORD)
+        recorder = Recorder()
+        admins = round(args.concurrency * args.admin_share)
+        start = time.monotonic()
+        deadline = start + args.duration
+        await asyncio.gather(
+            *(
+                virtual_user(
+                    recorder,
+                    client,
+                    admin if i < admins else credentials[i % len(credentials)],
+                    admin_flow if i < admins else item_flow,
+                    deadline,
+                )
+                for i in range(args.concurrency)
+            )
+        )
+        results = summarize(recorder, time.monotonic() - start)
+    results["config"] = {
+        "base_url": args.base_url,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "users": args.users,
+        "items_per_user": args.items_per_user,
+        "admin_share": args.admin_share,
+    }
+    return results
+
+
+def regressions(
+    results: dict[str, Any], baseline: dict[str, Any], max_regression: float
+) -> list[str]:
+    """
+    Routes whose p95 latency grew more than max_regression over the baseline.
+    """
+    found = []
+    for key, route in results["routes"].items():
+        before = baseline["routes"].get(key)
+        if before and route["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+            found.append(
+                f"{key}: p95 {before['p95_ms']:.1f} ms -> {route['p95_ms']:.1f} ms"
+            )
+    return found
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return number
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--users", type=positive_int, default=10)
+    parser.add_argument("--items-per-user", type=int, default=200)
+    parser.add_argument(
+        "--admin-share",
+        type=float,
+        default=0.1,
+        help="share of virtual users going through the admin flow",
+    )
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="allowed p95 growth over the baseline, 0.2 is 20%%",
+    )
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    for key, route in results["routes"].items():
+        print(
+            f"{key:45} {route['requests']:7d} req {route['rps']:8.1f} rps "
+            f"p50 {route['p50_ms']:7.1f} p95 {route['p95_ms']:7.1f} "
+            f"p99 {route['p99_ms']:7.1f} ms {route['errors']:5d} errors"
+        )
+    print(f"{'total':45} {results['requests']:7d} req {results['rps']:8.1f} rps")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.max_regression)
+        for regression in found:
+            print(f"regression: {regression}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
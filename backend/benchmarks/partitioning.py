@@ -0,0 +1,224 @@
+"""
+Queries of an owner's items and table maintenance, with the item table hash
+partitioned by owner_id as it is now, against a single unpartitioned table.
+
+Both layouts are created in a scratch schema with the same rows, --rows items
+spread over --owners owners, and dropped at the end. The queries are timed
+for random owners, the median is reported. The vacuum is timed after
+deleting the items of a few owners, it goes through the whole table and its
+indexes when unpartitioned, through the partitions of those owners otherwise.
+
+Run from the backend directory with `python -m benchmarks.partitioning`, it
+takes a few minutes with the default 2 000 000 rows.
+"""
+
+import argparse
+import random
+import statistics
+import time
+from collections.abc import Callable
+from functools import partial
+from typing import Any
+
+from sqlalchemy import Connection, Executable, text
+
+from app.core.config import settings
+from app.core.db import engine
+
+SCHEMA = "bench_partitioning"
+
+COLUMNS = """
+    id uuid NOT NULL,
+    title varchar(255) NOT NULL,
+    description varchar(255),
+    owner_id uuid NOT NULL
+"""
+
+QUERIES = {
+    "list page": (
+        "SELECT id, title, description FROM {table} WHERE owner_id = :owner_id "
+        "ORDER BY id LIMIT 100"
+    ),
+    "count": "SELECT count(*) FROM {table} WHERE owner_id = :owner_id",
+    # Without the owner, every partition is looked up
+    "get by id": "SELECT id, title, description FROM {table} WHERE id = :id",
+}
+
+
+def create_tables(conn: Connection, partitions: int) -> None:
+    conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    conn.execute(text(f"CREATE TABLE {SCHEMA}.plain ({COLUMNS}, PRIMARY KEY (id))"))
+    conn.execute(
+        text(
+            f"CREATE TABLE {SCHEMA}.partitioned ({COLUMNS}, PRIMARY KEY (id, owner_id)) "
+            "PARTITION BY HASH (owner_id)"
+        )
+    )
+    for remainder in range(partitions):
+        conn.execute(
+            text(
+                f"CREATE TABLE {SCHEMA}.partitioned_p{remainder} "
+                f"PARTITION OF {SCHEMA}.partitioned "
+                f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+            )
+        )
+    for table in ("plain", "partitioned"):
+        conn.execute(
+            text(
+                f"CREATE INDEX ON {SCHEMA}.{table} (owner_id, id) "
+                "INCLUDE (title, description)"
+            )
+        )
+
+
+def seed(conn: Connection, rows: int, owners: int) -> float:
+    """
+    Fill both tables with the same rows, returns the seconds the copy into
+    the partitioned table took.
+    """
+    conn.execute(
+        text(
+            f"""
+            INSERT INTO {SCHEMA}.plain (id, title, description, owner_id)
+            SELECT gen_random_uuid(), 'Item ' || i, repeat('Description ', 10),
+                owner_ids[1 + i % :owners]
+            FROM generate_series(1, :rows) AS i,
+                (SELECT array_agg(gen_random_uuid()) AS owner_ids
+                 FROM generate_series(1, :owners)) AS o
+            """
+        ),
+        {"rows": rows, "owners": owners},
+    )
+    start = time.perf_counter()
+    conn.execute(text(f"INSERT INTO {SCHEMA}.partitioned SELECT * FROM {SCHEMA}.plain"))
+    seconds = time.perf_counter() - start
+    conn.execute(text(f"VACUUM ANALYZE {SCHEMA}.plain"))
+    conn.execute(text(f"VACUUM ANALYZE {SCHEMA}.partitioned"))
+    return seconds
+
+
+def median_ms(
+    run: Callable[[dict[str, Any]], Any], params: list[dict[str, Any]]
+) -> float:
+    durations = []
+    for param in params:
+        start = time.perf_counter()
+        run(param)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1000
+
+
+def fetch_all(conn: Connection, statement: Executable, param: dict[str, Any]) -> Any:
+    return conn.execute(statement, param).all()
+
+
+def time_queries(
+    conn: Connection, table: str, samples: list[dict[str, Any]]
+) -> dict[str, float]:
+    results = {}
+    for name, query in QUERIES.items():
+        statement = text(query.format(table=f"{SCHEMA}.{table}"))
+        results[name] = median_ms(partial(fetch_all, conn, statement), samples)
+    conn.rollback()
+
+    # Rolled back, so that every owner still has their items
+    delete = text(f"DELETE FROM {SCHEMA}.{table} WHERE owner_id = :owner_id")
+
+    def delete_owner(param: dict[str, Any]) -> None:
+        conn.execute(delete, param)
+        conn.rollback()
+
+    results["delete owner"] = median_ms(delete_owner, samples)
+    return results
+
+
+def time_vacuum(conn: Connection, table: str, owner_ids: list[Any]) -> float:
+    """
+    Delete the items of the owners and time the vacuum of the tables that
+    held them, the whole table or the partitions of the owners.
+    """
+    tables = (
+        conn.execute(
+            text(
+                f"SELECT DISTINCT tableoid::regclass::text FROM {SCHEMA}.{table} "
+                "WHERE owner_id = ANY(:owner_ids)"
+            ),
+            {"owner_ids": owner_ids},
+        )
+        .scalars()
+        .all()
+    )
+    conn.execute(
+        text(f"DELETE FROM {SCHEMA}.{table} WHERE owner_id = ANY(:owner_ids)"),
+        {"owner_ids": owner_ids},
+    )
+    start = time.perf_counter()
+    for name in tables:
+        conn.execute(text(f"VACUUM {name}"))
+    return (time.perf_counter() - start) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--owners", type=int, default=2_000)
+    parser.add_argument("--partitions", type=int, default=settings.ITEM_PARTITIONS)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument(
+        "--vacuum-owners",
+        type=int,
+        default=1,
+        help="owners whose items are deleted before the vacuum",
+    )
+    args = parser.parse_args()
+
+    # DDL and vacuums run in autocommit, the timed queries in transactions
+    with engine.connect() as admin, engine.connect() as conn:
+        admin.execution_options(isolation_level="AUTOCOMMIT")
+        admin.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        try:
+            create_tables(admin, args.partitions)
+            copy_seconds = seed(admin, args.rows, args.owners)
+            print(
+                f"{args.rows} rows, {args.owners} owners, {args.partitions} "
+                f"partitions, copied into the partitioned table in {copy_seconds:.1f} s"
+            )
+            owner_ids = list(
+                admin.execute(
+                    text(f"SELECT DISTINCT owner_id FROM {SCHEMA}.plain")
+                ).scalars()
+            )
+            ids = list(
+                admin.execute(
+                    text(
+                        f"SELECT id FROM {SCHEMA}.plain TABLESAMPLE SYSTEM (1) "
+                        "LIMIT :n"
+                    ),
+                    {"n": args.samples},
+                ).scalars()
+            )
+            samples = [
+                {"owner_id": random.choice(owner_ids), "id": random.choice(ids)}
+                for _ in range(args.samples)
+            ]
+            results = {
+                table: time_queries(conn, table, samples)
+                for table in ("plain", "partitioned")
+            }
+            deleted = random.sample(owner_ids, args.vacuum_owners)
+            for table in ("plain", "partitioned"):
+                results[table]["vacuum"] = time_vacuum(admin, table, deleted)
+
+            print(f"{'':15} {'unpartitioned':>15} {'partitioned':>15}")
+            for name in results["plain"]:
+                print(
+                    f"{name:15} {results['plain'][name]:12.2f} ms "
+                    f"{results['partitioned'][name]:12.2f} ms"
+                )
+        finally:
+            conn.rollback()
+            admin.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+CPU time to serialize a page of the /items/ and /users/ responses, through the
+response model as before, against the rows serialized as they are.
+
+The page is read from the database, with rows created for the run in a
+transaction that is rolled back after it. Only the serialization is timed.
+
+Run from the backend directory with `python -m benchmarks.serialization`.
+"""
+
+import argparse
+import time
+import timeit
+import uuid
+from collections.abc import Callable
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from fastapi.utils import create_model_field
+from sqlmodel import Session, SQLModel, col, select
+
+from app.api.serialization import dump_json, public_columns
+from app.core.db import engine
+from app.models import Item, ItemPublic, ItemsPublic, User, UserPublic, UsersPublic
+
+
+def response_model_path(model: type[SQLModel]) -> Callable[[list[Any]], bytes]:
+    """
+    What FastAPI does with the return value of a route with a response model.
+    """
+    field = create_model_field(name="Response", type_=model, mode="serialization")
+
+    def serialize(objects: list[Any]) -> bytes:
+        content = {"data": objects, "count": len(objects), "next_cursor": None}
+        value, errors = field.validate(content, {}, loc=("response",))
+        assert not errors
+        return JSONResponse(field.serialize(value)).body
+
+    return serialize
+
+
+def rows_path(rows: list[Any]) -> bytes:
+    return dump_json(
+        {
+            "data": [row._asdict() for row in rows],
+            "count": len(rows),
+            "next_cursor": None,
+        }
+    )
+
+
+def cpu_seconds(
+    serialize: Callable[[list[Any]], bytes], content: list[Any], number: int
+) -> float:
+    """
+    Best CPU time of one serialization, over three runs of number each.
+    """
+    runs = timeit.repeat(
+        lambda: serialize(content), number=number, repeat=3, timer=time.process_time
+    )
+    return min(runs) / number
+
+
+def seed(session: Session, size: int) -> None:
+    owner_id = uuid.uuid4()
+    session.add(User(id=owner_id, email=f"{owner_id}@example.com", hashed_password="x"))
+    session.flush()
+    for i in range(size):
+        session.add(
+            Item(title=f"Item {i}", description="Description " * 10, owner_id=owner_id)
+        )
+        session.add(
+            User(
+                email=f"{uuid.uuid4()}@example.com",
+                full_name=f"User {i}",
+                hashed_password="x",
+            )
+        )
+    session.flush()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--number", type=int, default=500)
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        seed(session, args.page_size)
+        for name, table, public, page in (
+            ("items", Item, ItemPublic, ItemsPublic),
+            ("users", User, UserPublic, UsersPublic),
+        ):
+            objects = list(
+                session.exec(
+                    select(table).order_by(col(table.id)).limit(args.page_size)
+                ).all()
+            )
+            rows = list(
+                session.exec(
+                    select(*public_columns(public, table))
+                    .order_by(col(table.id))
+                    .limit(args.page_size)
+                ).all()
+            )
+            cases = {
+                "response model": (response_model_path(page), objects),
+                "rows": (rows_path, rows),
+            }
+            for case, (serialize, content) in cases.items():
+                seconds = cpu_seconds(serialize, content, args.number)
+                print(
+                    f"/{name}/ {case:>15}: {seconds * 1e6:9.1f} us "
+                    f"CPU per page of {len(content)}"
+                )
+        session.rollback()
+
+
+if __name__ == "__main__":
+    main()
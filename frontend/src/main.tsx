@@ -9,6 +9,8 @@ import { OpenAPI } from "./client"
 import theme from "./theme"
 
 OpenAPI.BASE = import.meta.env.VITE_API_URL
+// Sends back the cookie that sends the reads after a write to the primary
+OpenAPI.WITH_CREDENTIALS = true
 OpenAPI.TOKEN = async () => {
   return localStorage.getItem("access_token") || ""
 }